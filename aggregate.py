@@ -0,0 +1,197 @@
+"""
+Distribution of projections over simulations
+
+Means, quantiles (like P5 / P50 / P95) and shortfall probabilities per
+employee x plan (or per employee x claim x projection year of the detail
+Tableau) across simulations. Statistics are accumulated chunk by chunk and
+partial results can be merged, so chunked and parallel runs never need
+all simulations in memory at once.
+"""
+import numpy as np
+import pandas as pd
+
+
+DISTRIBUTION_COLUMNS = ['projectie_op', 'capital', 'projectie_op_plus_pv_aow']
+QUANTILES = (0.05, 0.5, 0.95)
+SUMMARY_KEYS = ['id', 'regeling_id']
+TABLEAU_KEYS = ['id', 'regeling_id', 'aanspraak', 'BOY']
+
+# sketch buckets: offset keeping the bucket numbers of positive values > 0
+BUCKET_OFFSET = 1 << 20
+MIN_VALUE = 1e-12
+
+
+class Distribution:
+    """ Mergeable statistics of columns over simulations, per group
+
+    Quantiles are exact (method='exact') or estimated from a sketch
+    (method='sketch'): values are counted in logarithmic buckets, so each
+    quantile is within relative_accuracy of an actual value, and merging
+    two sketches is adding their bucket counts. Exact quantiles are
+    computed per update, so the groups of different updates (like the
+    employees of different chunks) must not overlap; sketches have no such
+    restriction (e.g. simulations 1-1000 and 1001-2001 of the same
+    employees).
+
+    Parameters
+    ----------
+    by         : group keys
+    columns    : columns to aggregate
+    quantiles  : quantiles (between 0 and 1)
+    thresholds : dict of column: threshold (number or name of a column
+                 with a threshold per row). The shortfall probability is
+                 the fraction of simulations with value < threshold.
+    method     : 'exact' or 'sketch'
+    relative_accuracy : of the sketch quantiles
+
+    Examples
+    --------
+        >>> dist = Distribution(thresholds={'projectie_op': 20000})
+        >>> for summary in tab.iter_summary(chunk_employees=500):
+        ...     dist.update(summary)
+        >>> dist.result()  # 1 record per employee x plan
+    """
+
+    def __init__(self, by=SUMMARY_KEYS, columns=DISTRIBUTION_COLUMNS,
+                 quantiles=QUANTILES, thresholds=None, method='exact',
+                 relative_accuracy=0.01):
+        if method not in ('exact', 'sketch'):
+            raise ValueError("method should be 'exact' or 'sketch', not "
+                             "{!r}".format(method))
+        self.by = list(by)
+        self.columns = list(columns)
+        self.quantiles = list(quantiles)
+        self.thresholds = dict(thresholds or {})
+        self.method = method
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._counts = None   # count, sum and shortfall per group
+        self._exact = []      # exact quantiles per update
+        self._sketch = None   # bucket counts per group x column x bucket
+
+    def update(self, frame):
+        """ Add rows of frame (e.g. a summary chunk) and return self
+        """
+        values = frame[self.columns]
+        counts = {}
+        for column in self.columns:
+            counts[(column, 'count')] = values[column].notna()
+            counts[(column, 'sum')] = values[column]
+            if column in self.thresholds:
+                threshold = self.thresholds[column]
+                if isinstance(threshold, str):
+                    threshold = frame[threshold]
+                counts[(column, 'shortfall')] = values[column] < threshold
+        keys = [np.asarray(frame[key]) for key in self.by]
+        counts = pd.DataFrame(counts).groupby(keys).sum()
+        counts.index.names = self.by
+        self._counts = add(self._counts, counts)
+
+        if self.method == 'exact':
+            exact = values.groupby(keys).quantile(self.quantiles).unstack()
+            exact.index.names = self.by
+            if any(len(part.index.intersection(exact.index))
+                   for part in self._exact):
+                raise ValueError('exact quantiles need disjoint groups per '
+                                 "update, use method='sketch'")
+            self._exact.append(exact)
+        else:
+            self._sketch = add(self._sketch, self._buckets(frame))
+        return self
+
+    def merge(self, other):
+        """ Add statistics of other Distribution (same settings), return
+        self
+        """
+        self._counts = add(self._counts, other._counts)
+        for exact in other._exact:
+            if any(len(part.index.intersection(exact.index))
+                   for part in self._exact):
+                raise ValueError('exact quantiles need disjoint groups, '
+                                 "use method='sketch'")
+            self._exact.append(exact)
+        self._sketch = add(self._sketch, other._sketch)
+        return self
+
+    def _buckets(self, frame):
+        """ Return counts per group x column x bucket of frame
+        """
+        parts = []
+        for position, column in enumerate(self.columns):
+            values = frame[column].values.astype(float)
+            valid = ~np.isnan(values)
+            keys = {key: np.asarray(frame[key])[valid] for key in self.by}
+            keys['column'] = position
+            keys['bucket'] = self.bucket(values[valid])
+            parts.append(pd.DataFrame(keys))
+        buckets = pd.concat(parts, ignore_index=True)
+        return buckets.groupby(self.by + ['column', 'bucket']).size()
+
+    def bucket(self, values):
+        """ Return bucket numbers of values, ordered like the values
+        (0 for 0, positive for positive values, negative for negative)
+        """
+        magnitude = np.maximum(np.abs(values), MIN_VALUE)
+        index = (np.ceil(np.log(magnitude) / np.log(self.gamma)).
+                 astype(np.int64) + BUCKET_OFFSET)
+        return np.sign(values).astype(np.int64) * index
+
+    def value(self, buckets):
+        """ Return representative value of buckets
+        """
+        index = np.abs(buckets) - BUCKET_OFFSET
+        return (np.sign(buckets) * 2 * self.gamma**index /
+                (self.gamma + 1))
+
+    def _sketch_quantiles(self):
+        """ Return quantiles from sketch, 1 column per column x quantile
+        """
+        sketch = self._sketch.sort_index()
+        cumulative = np.cumsum(sketch.values)
+        groups = sketch.groupby(level=self.by + ['column'])
+        total = groups.sum()
+        start = groups.cumcount().values == 0
+        offset = (cumulative - sketch.values)[start]
+        result = {}
+        for q in self.quantiles:
+            rank = offset + q * (total.values - 1)
+            position = np.searchsorted(cumulative, rank, side='right')
+            result[q] = self.value(
+              sketch.index.get_level_values('bucket')[position].values)
+        quantiles = pd.DataFrame(result, index=total.index).unstack('column')
+        quantiles.columns = pd.MultiIndex.from_tuples(
+          [(self.columns[column], q) for q, column in quantiles.columns])
+        return quantiles
+
+    def result(self):
+        """ Return frame with 1 record per group and per column: count,
+        mean, quantiles (like p5, p50, p95) and shortfall probability
+        (if threshold given)
+        """
+        counts = self._counts
+        if self.method == 'exact':
+            quantiles = pd.concat(self._exact).sort_index()
+        else:
+            quantiles = self._sketch_quantiles()
+        result = {}
+        for column in self.columns:
+            n = counts[(column, 'count')].astype(np.int64)
+            result[column + '_count'] = n
+            result[column + '_mean'] = counts[(column, 'sum')] / n
+            for q in self.quantiles:
+                result['{}_p{:g}'.format(column, 100 * q)] = (
+                  quantiles[(column, q)])
+            if column in self.thresholds:
+                result[column + '_shortfall'] = (
+                  counts[(column, 'shortfall')] / n)
+        return pd.DataFrame(result).sort_index()
+
+
+def add(left, right):
+    """ Return sum of frames / series (either may be None), aligned on the
+    index
+    """
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return left.add(right, fill_value=0)
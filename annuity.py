@@ -0,0 +1,141 @@
+"""
+Stochastic annuity factors
+
+Annuity factors at the pension date per simulation: the expected cash flows
+after the pension date (utils.CashFlows) are discounted with the simulated
+intrest of lookup_intrest in the years after the pension date, instead of
+the fixed factors of sheet lookup_tar_at_pensionage.
+"""
+import numpy as np
+import pandas as pd
+from utils import LookupArray, discount_factors
+
+
+class StochasticAnnuityFactors:
+    """ Annuity factors at pension date from simulated intrest
+
+    An employee aged leeftijd at the calculation date retires after
+    n = pensioenlfd - leeftijd years. The curve of (scenario, n) is the
+    simulated intrest of scenario in projection years n + 1, n + 2, ...
+    (the last simulated year is extended beyond the end of lookup_intrest),
+    the cash flows are those of calc_year rekendatum + n.
+
+    Factors are computed in bulk for all missing keys at once and cached
+    by (scenario, n, pensioenlfd, geslacht), so repeated lookups (other
+    workbooks with the same intrest scenarios, more simulations recycling
+    the same scenarios) cost a dict lookup.
+
+    Parameters
+    ----------
+    cashflows : utils.CashFlows
+    claims    : insurance ids of the cash flows to convert
+
+    Examples
+    --------
+        >>> factors = StochasticAnnuityFactors(CashFlows('cfs_68.pkl', 68))
+        >>> tab = Tableau(xlswb='newdata.xlsx', nsimuls=2001,
+        ...               annuity_factors=factors)
+        >>> summary = tab.add_summary()
+    """
+
+    def __init__(self, cashflows, claims=('OPLL', 'NPLLRS')):
+        self.cashflows = cashflows
+        self.claims = list(claims)
+        self._cache = {}
+        self._intrest = None
+
+    def set_intrest(self, lookup_intrest, calc_year):
+        """ Use simulated intrest of lookup_intrest (fractions, indexed by
+        jaar x simulnr) and calculation year calc_year. Cached factors of
+        other intrest scenarios are dropped.
+        """
+        rates = LookupArray(lookup_intrest['pct_rente_ultimo'])
+        intrest = (calc_year, tuple(tuple(axis) for axis in rates.axes),
+                   rates.values.tobytes())
+        if intrest != self._intrest:
+            self._intrest = intrest
+            self._cache = {}
+        self.calc_year = calc_year
+        self.rates = rates
+
+    @property
+    def nscenarios(self):
+        return self.rates.axes[1].max()
+
+    def curves(self, scenarios, nyears, length):
+        """ Return yield curves (in %) of given (scenario, n) pairs, shaped
+        (pairs, length), with the discount factors of the simulated intrest
+        after projection year n
+        """
+        years = np.minimum(
+          np.asarray(nyears)[:, None] + np.arange(1, length),
+          self.rates.axes[0].max())
+        rates = self.rates.lookup(years, np.asarray(scenarios)[:, None])
+        t = np.arange(1, length)
+        spot = np.cumprod(1 + rates, axis=1)**(1. / t) - 1
+        return 100 * np.concatenate([spot[:, :1], spot], axis=1)
+
+    def _compute(self, keys):
+        """ Add factors of given keys (scenario, n, pensioenlfd, geslacht)
+        to cache, in 1 go
+        """
+        scenarios, nyears, pension_ages, sexes = (np.array(key) for key in
+                                                   zip(*keys))
+        cfs = self.cashflows.get_cashflows(
+          (self.calc_year + nyears)[:, None], pension_ages[:, None],
+          sexes[:, None], pension_ages[:, None],
+          np.array(self.claims)[None, :])
+        v = discount_factors(self.curves(scenarios, nyears, cfs.shape[-1]),
+                             cfs.shape[-1])
+        factors = np.einsum('kit,kt->ki', cfs, v)
+        self._cache.update(zip(keys, factors))
+
+    def factors(self, scenarios, nyears, pension_ages, sexes):
+        """ Return factors shaped (keys, claims) of given keys (arrays of
+        equal length)
+        """
+        keys = list(zip(np.asarray(scenarios).tolist(),
+                        np.asarray(nyears).tolist(),
+                        np.asarray(pension_ages).tolist(),
+                        np.asarray(sexes).tolist()))
+        missing = list(set(keys).difference(self._cache))
+        if missing:
+            self._compute(missing)
+        return np.array([self._cache[key] for key in keys])
+
+    def table(self, pension_ages, sexes, ages):
+        """ Return factors of all intrest scenarios as frame like
+        lookup_tar_at_pensionage
+        """
+        index = pd.MultiIndex.from_product(
+          [pension_ages, sexes, self.claims, ages,
+           np.arange(1, self.nscenarios + 1)],
+          names=['pensioenlfd', 'geslacht', 'aanspraak_id', 'leeftijd',
+                 'simulnr'])
+        keys = index.to_frame(index=False)
+        keys = keys[keys.aanspraak_id == self.claims[0]]
+        nyears = np.maximum(keys.pensioenlfd - keys.leeftijd, 0)
+        factors = self.factors(keys.simulnr, nyears, keys.pensioenlfd,
+                               keys.geslacht)
+        # factors rows are (pensioenlfd, geslacht, leeftijd, simulnr)
+        shape = (len(pension_ages), len(sexes), len(ages),
+                 self.nscenarios, len(self.claims))
+        tar = factors.reshape(shape).transpose(0, 1, 4, 2, 3).ravel()
+        return pd.DataFrame({'tar': tar}, index=index)
+
+    def apply(self, data):
+        """ Return data (named tuple from read_xlswb) with
+        lookup_tar_at_pensionage replaced by the factors of the simulated
+        intrest, for the pension ages, sexes and ages of the sheet
+        """
+        self.set_intrest(data.lookup_intrest,
+                         data.tbl_assumption.rekendatum[0].year)
+        index = data.lookup_tar_at_pensionage.index
+        table = self.table(
+          *(sorted(index.get_level_values(level).unique())
+            for level in ['pensioenlfd', 'geslacht', 'leeftijd']))
+        lookup_arrays = dict(data.lookup_arrays,
+                             lookup_tar_at_pensionage=LookupArray(
+                               table['tar']))
+        return data._replace(lookup_tar_at_pensionage=table,
+                             lookup_arrays=lookup_arrays)
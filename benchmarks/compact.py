@@ -0,0 +1,32 @@
+"""
+Benchmark memory usage of Tableau versus Tableau(compact=True)
+
+    $ python benchmarks/compact.py [nsimuls]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from codex import Tableau  # noqa: E402
+
+TESTDATA = ['codex_test_data_pwc.xlsx', 'codex_test_data_wtw.xlsx']
+
+
+def main(nsimuls=100):
+    test_dir = os.path.join(os.path.dirname(__file__), '..', 'tests')
+    for testdata in TESTDATA:
+        xlswb = os.path.join(test_dir, testdata)
+        default = Tableau(xlswb=xlswb, nsimuls=nsimuls)
+        compact = Tableau(xlswb=xlswb, nsimuls=nsimuls, compact=True)
+        before, after = default.bytes_per_row(), compact.bytes_per_row()
+        print('{}: {:,} rows'.format(testdata, len(default.tableau)))
+        print('  default : {:8.0f} bytes per row, {:8.1f} MB'.format(
+              before, before * len(default.tableau) / 1e6))
+        print('  compact : {:8.0f} bytes per row, {:8.1f} MB  '
+              '({:.0f}% less)'.format(after,
+                                      after * len(compact.tableau) / 1e6,
+                                      100 * (1 - after / before)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
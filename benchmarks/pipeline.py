@@ -0,0 +1,298 @@
+"""
+Benchmark the stages of the projection pipeline on synthetic workbooks
+
+Synthetic workbooks follow the schema of data/template.xlsx: employees,
+pension plans and claims are copies of the template's with new ids, random
+ages and salaries, and each scenario sheet gets nsimuls random scenarios
+around the template's. Every stage (read_xlswb, _merge, _add_age,
+_lookup_increments, _run_projections, add_summary) is recorded by the
+Tableau's own report (see instrument.Instrument): wall time, peak RSS and
+rows and bytes of its result. For a range of sizes this gives a scaling
+curve per stage, with its slope on a log-log scale (1 = linear).
+
+    $ python benchmarks/pipeline.py employees 10 100 1000
+    $ python benchmarks/pipeline.py nsimuls 1 10 100 --employees 50
+    $ python benchmarks/pipeline.py plans 1 3 9 --csv plans.csv
+
+To catch regressions, save the results as baseline (a JSON file with the
+slope per stage and the seconds per stage and size, relative to a
+calibration run of a fixed NumPy / pandas workload on the same machine)
+and compare later runs with it. Slopes do not depend on the hardware and
+relative seconds only roughly, so the committed baseline can be used on
+other machines and in CI. The script exits with status 1 if a stage scales
+worse than its baseline (larger slope) or is slower by more than the
+tolerance:
+
+    $ python benchmarks/pipeline.py employees 100 300 1000 --repeat 3 \\
+          --baseline benchmarks/baseline_employees.json
+
+Save a new baseline (--save-baseline instead of --baseline) when the
+expected performance changes.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from codex import Tableau  # noqa: E402
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), '..', 'data',
+                        'template.xlsx')
+STAGES = ['read_xlswb', '_merge', '_add_age', '_lookup_increments',
+          '_run_projections', 'add_summary']
+
+# scenario sheets: value column, widened to 1 column per simulation
+SCENARIO_SHEETS = {
+  'lookup_prijsinflatie': ('pct_prijsinflatie_primo', 0.005),
+  'lookup_salarisstijging': ('pct_salstijging_primo', 0.005),
+  'lookup_indexatie': ('pct_indexatie_primo', 0.005),
+  'lookup_rente': ('pct_rente_ultimo', 0.005),
+  'lookup_rendement_aandelen': ('pct_rendement_aandelen', 0.1),
+  'lookup_rendement_obligaties': ('pct_rendement_obligaties', 0.02)}
+
+
+def synthetic_workbook(directory, employees=10, plans=3, claims=None,
+                       nsimuls=1, template=TEMPLATE, seed=0):
+    """ Write synthetic workbook to directory (1 csv file per sheet, see
+    load.read_sheet) and return directory
+
+    Parameters
+    ----------
+    employees : number of employees, aged 25 to 64
+    plans     : number of pension plans, copies of the template's plans
+    claims    : max. number of claims per plan (None: all claims of the
+                copied template plan)
+    nsimuls   : number of scenarios in the scenario sheets
+    """
+    rng = np.random.RandomState(seed)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        sheets = pd.read_excel(template, sheet_name=None)
+    calc_date = pd.Timestamp(sheets['tbl_assumptie'].rekendatum[0])
+
+    employee = sheets['tbl_deelnemer']
+    employee = employee.iloc[np.arange(employees) % len(employee)].copy()
+    employee['id'] = np.arange(1, employees + 1)
+    employee['naam'] = ['employee_{}'.format(i) for i in employee.id]
+    age = rng.randint(25, 65, employees)
+    employee['geboortedatum'] = [
+      (calc_date - pd.DateOffset(years=int(years))).date() for years in age]
+    employee['datum_in_dienst'] = [
+      (calc_date - pd.DateOffset(years=int(years))).date()
+      for years in rng.randint(0, age - 20)]
+    employee['ft_salaris'] = rng.uniform(25000, 120000, employees).round(2)
+    sheets['tbl_deelnemer'] = employee
+
+    plan = sheets['tbl_regeling']
+    copies = np.arange(plans) % len(plan)
+    claim = sheets['tbl_aanspraak']
+    claim_copies = []
+    for regeling_id, copy in enumerate(copies, start=1):
+        claims_plan = claim[claim.regeling_id ==
+                            plan.id.iloc[copy]].iloc[:claims].copy()
+        claims_plan['regeling_id'] = regeling_id
+        claim_copies.append(claims_plan)
+    plan = plan.iloc[copies].copy()
+    plan['id'] = np.arange(1, plans + 1)
+    sheets['tbl_regeling'] = plan
+    sheets['tbl_aanspraak'] = pd.concat(claim_copies, ignore_index=True)
+
+    if nsimuls > 1:
+        for sheet_name, (column, scale) in SCENARIO_SHEETS.items():
+            df = sheets[sheet_name]
+            values = df.pop(column).values[:, None]
+            scenarios = pd.DataFrame(
+              values + rng.normal(0, scale, (len(df), nsimuls)),
+              columns=range(1, nsimuls + 1), index=df.index)
+            sheets[sheet_name] = pd.concat([df, scenarios], axis=1)
+
+    os.makedirs(directory, exist_ok=True)
+    for sheet_name, df in sheets.items():
+        df.to_csv(os.path.join(directory, sheet_name + '.csv'), index=False)
+    return directory
+
+
+def profile_stages(xlswb, nsimuls=1):
+    """ Return frame with the report records (seconds, peak RSS MB, rows
+    and bytes of the result) of STAGES, 1 row per stage
+    """
+    tab = Tableau(xlswb=xlswb, nsimuls=nsimuls)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        tab.add_summary()
+    report = tab.report.to_frame()
+    return report[report.stage.isin(STAGES)].reset_index(drop=True)
+
+
+def calibrate(repeat=5, size=10 ** 6, seed=0):
+    """ Return seconds of a fixed NumPy / pandas workload (sorting, a
+    groupby and fancy indexing of size rows), the fastest of repeat runs.
+    Timings divided by it can be compared across machines.
+    """
+    rng = np.random.RandomState(seed)
+    frame = pd.DataFrame({'key': rng.randint(0, size // 10, size),
+                          'value': rng.normal(size=size)})
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frame.sort_values(['key', 'value']).groupby('key').value.cumsum()
+        frame.value.values[rng.randint(0, size, size)].sum()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def scaling(parameter, sizes, employees=10, plans=3, claims=None,
+            nsimuls=1, seed=0, repeat=1):
+    """ Return frame with profile_stages for each size of parameter
+    (employees, plans, claims or nsimuls), other parameters fixed. With
+    repeat > 1, the fastest of repeat runs per stage (less noisy).
+    """
+    settings = dict(employees=employees, plans=plans, claims=claims,
+                    nsimuls=nsimuls)
+    results = []
+    for size in sizes:
+        settings[parameter] = size
+        with tempfile.TemporaryDirectory() as directory:
+            xlswb = synthetic_workbook(directory, seed=seed, **settings)
+            runs = pd.concat([profile_stages(xlswb,
+                                             nsimuls=settings['nsimuls'])
+                              for _ in range(repeat)])
+            result = runs.groupby('stage', sort=False).min().reset_index()
+        result.insert(0, parameter, size)
+        results.append(result)
+    return pd.concat(results, ignore_index=True)
+
+
+def slopes(results, parameter):
+    """ Return slope of log(seconds) and log(peak MB) versus log(size)
+    per stage (1 = linear scaling)
+    """
+    def slope(group, column):
+        return np.polyfit(np.log(group[parameter]),
+                          np.log(np.maximum(group[column], 1e-6)), 1)[0]
+
+    return results.groupby('stage', sort=False).apply(
+      lambda group: pd.Series({'seconds': slope(group, 'seconds'),
+                               'nbytes': slope(group, 'nbytes')}))
+
+
+def to_baseline(results, parameter, calibration):
+    """ Return baseline (dict) of results: seconds per stage and size
+    relative to calibration (seconds of calibrate()), and slope of seconds
+    per stage (if more than 1 size)
+    """
+    seconds = results.pivot(index=parameter, columns='stage',
+                            values='seconds') / calibration
+    baseline = {'parameter': parameter,
+                'relative_seconds': {
+                  stage: {str(size): float(value)
+                          for size, value in seconds[stage].items()}
+                  for stage in seconds.columns}}
+    if len(seconds) > 1:
+        baseline['slopes'] = {
+          stage: float(slope)
+          for stage, slope in slopes(results, parameter).seconds.items()}
+    return baseline
+
+
+def regressions(results, baseline, calibration, tolerance=0.5,
+                min_seconds=0.05, slope_tolerance=0.25):
+    """ Return list of regressions of results compared with baseline (see
+    to_baseline), empty if none
+
+    A stage regresses if its slope is more than slope_tolerance larger, or
+    if it is more than tolerance (relative) and min_seconds (absolute, to
+    ignore noise in fast stages) slower than its baseline at the same
+    size, after scaling the baseline by calibration (seconds of
+    calibrate() on this machine). Sizes and stages not in baseline are
+    skipped.
+    """
+    current = to_baseline(results, baseline['parameter'], calibration)
+    found = []
+    for stage, sizes in current['relative_seconds'].items():
+        for size, relative in sizes.items():
+            expected = baseline['relative_seconds'].get(stage, {}).get(size)
+            if expected is None:
+                continue
+            seconds, expected = relative * calibration, expected * calibration
+            if (seconds > expected * (1 + tolerance) and
+                    seconds - expected > min_seconds):
+                found.append('{} at {}={}: {:.3f} s, baseline {:.3f} s'.
+                             format(stage, baseline['parameter'], size,
+                                    seconds, expected))
+    for stage, slope in current.get('slopes', {}).items():
+        expected = baseline.get('slopes', {}).get(stage)
+        if expected is not None and slope > expected + slope_tolerance:
+            found.append('{}: slope {:.2f}, baseline {:.2f}'.format(
+              stage, slope, expected))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('parameter',
+                        choices=['employees', 'plans', 'claims', 'nsimuls'])
+    parser.add_argument('sizes', type=int, nargs='+')
+    parser.add_argument('--employees', type=int, default=10)
+    parser.add_argument('--plans', type=int, default=3)
+    parser.add_argument('--claims', type=int, default=None)
+    parser.add_argument('--nsimuls', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='fastest of repeat runs per stage')
+    parser.add_argument('--csv', help='write results to csv file')
+    parser.add_argument('--save-baseline', help='write results to json file')
+    parser.add_argument('--baseline', help='compare results with json file '
+                        '(exit status 1 on regressions)')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed relative slowdown (default 0.5)')
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help='ignore slowdowns below this (default 0.05)')
+    parser.add_argument('--slope-tolerance', type=float, default=0.25,
+                        help='allowed slope increase (default 0.25)')
+    args = parser.parse_args()
+
+    results = scaling(args.parameter, args.sizes, employees=args.employees,
+                      plans=args.plans, claims=args.claims,
+                      nsimuls=args.nsimuls, repeat=args.repeat)
+    with pd.option_context('display.width', 120,
+                           'display.float_format', '{:.3f}'.format):
+        print('seconds:')
+        print(results.pivot(index=args.parameter, columns='stage',
+                            values='seconds')[STAGES].to_string())
+        print()
+        print('MB of result:')
+        print((results.pivot(index=args.parameter, columns='stage',
+                             values='nbytes')[STAGES] / 1e6).to_string())
+        if len(args.sizes) > 1:
+            print('\nslope log-log (1 = linear):')
+            print(slopes(results, args.parameter).to_string())
+    if args.csv:
+        results.to_csv(args.csv, index=False)
+    if args.save_baseline or args.baseline:
+        calibration = calibrate()
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(to_baseline(results, args.parameter, calibration), f,
+                      indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['parameter'] != args.parameter:
+            parser.error('baseline is for parameter {}'.format(
+              baseline['parameter']))
+        found = regressions(results, baseline, calibration, args.tolerance,
+                            args.min_seconds, args.slope_tolerance)
+        if found:
+            print('\nregressions:\n' + '\n'.join(found))
+            sys.exit(1)
+        print('\nno regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Benchmark cumulative indices per employee x claim x simulation:
+groupby().apply(calculate_cumulative_index) versus Segments.cumprod
+
+    $ python benchmarks/segments.py [nsimuls]
+"""
+import os
+import sys
+import time
+import warnings
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from codex import Tableau  # noqa: E402
+from utils import Segments, calculate_cumulative_index  # noqa: E402
+
+TESTDATA = ['codex_test_data_pwc.xlsx', 'codex_test_data_wtw.xlsx']
+COLUMNS = ['pct_prijsinflatie_primo', 'pct_salstijging_primo',
+           'pct_indexatie_primo', 'pct_rente_ultimo', 'pct_rendement_ultimo']
+GROUP = ['id', 'regeling_id', 'aanspraak', 'simulnr']
+
+
+def timeit(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main(nsimuls=100):
+    test_dir = os.path.join(os.path.dirname(__file__), '..', 'tests')
+    for testdata in TESTDATA:
+        tab = Tableau(xlswb=os.path.join(test_dir, testdata), nsimuls=nsimuls)
+        tableau = tab.tableau
+
+        def before():
+            grouped = tableau.groupby(GROUP)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                return [grouped[col].apply(calculate_cumulative_index).values
+                        for col in COLUMNS]
+
+        def after():
+            segments = Segments(tableau.BOY.values == 1)
+            return [segments.cumprod(1 + tableau[col]) for col in COLUMNS]
+
+        t_before, expected = timeit(before)
+        t_after, calculated = timeit(after)
+        assert all(np.allclose(x, y, equal_nan=True)
+                   for x, y in zip(expected, calculated))
+        print('{}: {:,} rows, {} cumulative indices'.format(
+              testdata, len(tableau), len(COLUMNS)))
+        print('  groupby().apply : {:8.3f} s'.format(t_before))
+        print('  Segments        : {:8.3f} s  ({:.0f}x faster)'.format(
+              t_after, t_before / t_after))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -1,82 +1,281 @@
 """
 Module for actuarial projections
 """
+import copy
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-from load import read_xlswb
+from aggregate import (Distribution, DISTRIBUTION_COLUMNS, QUANTILES,
+                       TABLEAU_KEYS)
+from instrument import Instrument
+from load import (build_lookup_arrays, read_lookup_sheets, read_xlswb,
+                  select_lookups)
+from running import (project_pensiondate, summarize, summarize_tableau,
+                     tile_simulations)
 from settings import XLSWB
-from utils import (calculate_cumulative_index,
-                   calculate_cumulative_index_conjugate, modulo_map)
+from utils import Segments, ScenarioIndex
 from vectorize import (pensiondate, future_service_years,
                        past_service_years, total_service_years,
-                       nprojection_years, age, ft_base,
+                       roundup, age, ft_base,
                        employee_contribution,
-                       eur_return)
+                       eur_return, accumulate_capital)
+
+
+# lookup tables with scenarios (indexed by simulnr)
+SCENARIO_TABLES = ['lookup_inflation', 'lookup_salincrease',
+                   'lookup_indexation', 'lookup_intrest', 'lookup_return',
+                   'lookup_tar_at_pensionage']
+
+# dtypes of tableau columns, enforced from Tableau._merge onward. Other
+# columns (text, dates) never enter the projection calculations.
+TABLEAU_DTYPES = {
+  'id': np.int64, 'regeling_id': np.int64, 'tarief_id': np.int64,
+  'BOY': np.int32, 'simulnr': np.int32, 'pensioenlfd': np.int32,
+  'leeftijd0': np.int32, 'leeftijd0_adjusted': np.int32,
+  'nprojectionyears': np.int32, 'leeftijd_low': np.int32,
+  'leeftijd_low_adjusted': np.int32,
+  'ft_salaris': np.float64, 'pt_percentage': np.float64,
+  'op_premievrij': np.float64, 'np_premievrij': np.float64,
+  'franchise': np.float64, 'max_salaris': np.float64,
+  'percentage': np.float64, 'pct_eigen_bijdrage': np.float64,
+  'premie_franchise': np.float64, 'premie_plafond': np.float64,
+  'fsy0': np.float64, 'psy0': np.float64, 'tsy': np.float64,
+  'fsy': np.float64, 'leeftijd': np.float64,
+  'pct_prijsinflatie_primo': np.float64, 'pct_salstijging_primo': np.float64,
+  'pct_indexatie_primo': np.float64,
+  'pct_indexatie_primo_inactief': np.float64,
+  'pct_rente_ultimo': np.float64, 'pct_rendement_ultimo': np.float64,
+  'nqx_primo': np.float64, 'tarief_primo': np.float64
+  }
+
+# compact layout: narrow integers, categorical text columns used in the
+# projection (other text columns are only joined into the summary)
+COMPACT_DTYPES = dict(TABLEAU_DTYPES, **{
+  col: np.int16 for col, dtype in TABLEAU_DTYPES.items()
+  if dtype == np.int32})
+CATEGORICAL_COLUMNS = ['aanspraak', 'geslacht', 'type_regeling']
+
+# lazy stages of Tableau, with the parameters each stage depends on (besides
+# the parameters of the stages before it)
+STAGES = [('data', ('xlswb', 'cache_dir', 'compact', 'annuity_factors')),
+          ('categories', ()),
+          ('scenario_index', ('nsimuls',)),
+          ('merge', ()),
+          ('add_age', ()),
+          ('lookup_increments', ('join_lookups',)),
+          ('tableau', ()),
+          ('summary', ('detail',))]
+STAGE_NAMES = [name for name, parameters in STAGES]
 
 
 class Tableau:
     """  Tableau with benefit projections
+
+    The intermediate stages of the tableau (_merge, _add_age,
+    _lookup_increments) are only memoised if keep_stages, so that changing
+    a downstream parameter (like join_lookups) reuses them. By default only
+    the workbook, the tableau or summary and (after variant / what_if) the
+    tableau after _add_age are kept.
+
+    If the workbook is deterministic (every lookup table has 1 scenario),
+    add_summary and the summary-only / chunked / parallel modes project 1
+    simulation and repeat its summary for the others. The tableau itself
+    always has all nsimuls simulations (and once it is there, add_summary
+    summarizes it).
+
+    Every stage that is run (reading each sheet, _merge, _add_age,
+    _lookup_increments, _run_projections, the summary) is recorded in
+    report: wall time, peak RSS and rows and bytes of its result. If
+    callback is given, it is called with the record (instrument.StageRecord)
+    of each stage as soon as the stage is done.
     """
 
-    def __init__(self, xlswb=XLSWB, nsimuls=1, maxyears=None):
+    def __init__(self, xlswb=XLSWB, nsimuls=1, maxyears=None,
+                 chunk_employees=None, n_jobs=None, cache_dir=None,
+                 join_lookups=False, compact=False, detail=True,
+                 annuity_factors=None, callback=None, keep_stages=False):
         self.xlswb = xlswb
+        self.cache_dir = cache_dir
+        self.annuity_factors = annuity_factors
+        self.join_lookups = join_lookups
+        self.compact = compact
+        self.detail = detail
         self.nsimuls = nsimuls
         self.maxyears = maxyears
-        self.data = self._read()
-        self.tableau = self.create()
+        self.chunk_employees = chunk_employees
+        self.n_jobs = n_jobs
+        self.keep_stages = keep_stages
+        self.instrument = Instrument(callback)
+        self._memo = {}
+
+    # ----- lazy stages -------------------------------------------------
+    #
+    # Nothing is read or projected until data, tableau, summary or
+    # add_summary() is accessed. Each stage is memoised together with the
+    # parameters it (and the stages before it) depends on, so changing
+    # e.g. join_lookups reuses the workbook (and, if keep_stages, the
+    # expanded tableau and the ages), while changing nsimuls only reuses
+    # the workbook.
+
+    def _memo_key(self, stage):
+        """ Return values of parameters stage depends on
+        """
+        return tuple(getattr(self, parameter)
+                     for name, parameters in STAGES for parameter in parameters
+                     if STAGE_NAMES.index(name) <= STAGE_NAMES.index(stage))
+
+    def _is_memoised(self, stage):
+        """ Return True if there is a memoised result of stage for the
+        current parameters
+        """
+        return (stage in self._memo and
+                self._memo[stage][0] == self._memo_key(stage))
+
+    def _memoised(self, stage, compute, keep=True):
+        """ Return memoised result of stage, computed by compute() if
+        there is none or if parameters changed (and memoised if keep)
+        """
+        if self._is_memoised(stage):
+            return self._memo[stage][1]
+        result = compute()
+        if keep:
+            self._memo[stage] = (self._memo_key(stage), result)
+        return result
+
+    def clear_cache(self):
+        """ Remove memoised stages (to free memory)
+        """
+        self._memo = {}
+
+    @property
+    def data(self):
+        """ Named tuple with sheets from workbook (see _read)
+        """
+        return self._memoised('data', self._read)
+
+    @property
+    def report(self):
+        """ instrument.Report of the stages run so far
+        """
+        return self.instrument.report
+
+    @property
+    def dtypes(self):
+        return COMPACT_DTYPES if self.compact else TABLEAU_DTYPES
+
+    @property
+    def categories(self):
+        return self._memoised('categories', lambda: categories(self.data))
+
+    @property
+    def scenario_index(self):
+        return self._memoised('scenario_index',
+                              lambda: scenario_indices(self.data,
+                                                       self.nsimuls))
+
+    @property
+    def deterministic(self):
+        """ True if every lookup table has 1 scenario (all simulations
+        are identical)
+        """
+        return is_deterministic(self.scenario_index)
+
+    @property
+    def full_tableau(self):
+        """ True if the tableau of all employees is kept, False in
+        summary-only / chunked / parallel mode (only the summary is kept
+        in memory)
+        """
+        return (self.detail and self.chunk_employees is None and
+                self.n_jobs is None)
+
+    @property
+    def tableau(self):
+        """ Tableau of all employees, None if not full_tableau
+        """
+        if not self.full_tableau:
+            return None
+        return self._memoised('tableau', self.create)
+
+    @property
+    def summary(self):
+        """ Summary in summary-only / chunked / parallel mode, None if
+        full_tableau (use add_summary)
+        """
+        if self.full_tableau:
+            return None
+        return self._memoised('summary', lambda: pd.concat(
+          self.iter_summary(self.chunk_employees, self.n_jobs),
+          ignore_index=True))
 
     def _read(self):
-        """ Return named tuple with sheets from given workbook
+        """ Return named tuple with sheets from given workbook,
+        employees indexed by id and pension plans by (regeling_id, aanspraak),
+        cast to self.dtypes
+
+        If annuity_factors (annuity.StochasticAnnuityFactors) is given,
+        lookup_tar_at_pensionage is replaced by the factors of the
+        simulated intrest.
+        """
+        data = self.instrument.run('read_xlswb', read_xlswb, self.xlswb,
+                                   cache_dir=self.cache_dir,
+                                   instrument=self.instrument)
+        if self.annuity_factors is not None:
+            data = self.annuity_factors.apply(data)
+        data.tbl_employee.set_index('id', inplace=True)
+        data.tbl_pension_plan.set_index(['regeling_id', 'aanspraak'],
+                                        inplace=True)
+        return data._replace(
+          tbl_employee=enforce_dtypes(data.tbl_employee, self.dtypes),
+          tbl_pension_plan=enforce_dtypes(data.tbl_pension_plan,
+                                          self.dtypes))
+
+    def _claims(self, ids=None, regeling_ids=None):
+        """ Return frame with 1 record per employee x claim
+
+        If compact, CATEGORICAL_COLUMNS are categoricals and other text
+        columns (like naam and memo) are left out.
         """
-        return read_xlswb(self.xlswb)
+        empxclm = employee_claims(self.data, ids, regeling_ids)
+        if self.compact:
+            empxclm = to_categorical(empxclm, self.categories)
+            text = [col for col in empxclm.columns
+                    if empxclm[col].dtype == object]
+            empxclm = enforce_dtypes(empxclm.drop(text, axis=1),
+                                     self.dtypes)
+        return empxclm
 
-    def _merge(self):
+    def _merge(self, ids=None, regeling_ids=None):
         """ Merge data into tableau length Employees x Claims x Years x Simulations
+
+        Employee and claim attributes (including pension date, service
+        years and age at calculation date) are calculated once per
+        employee x claim and copied onto the years and simulations by
+        index.
+
+        Parameters
+        ----------
+        ids          : list of employee ids or None (all employees)
+        regeling_ids : list of pension plan ids or None (all plans)
         """
-        # calculate number of projection years for each employee/claim
-        # combination
-        assumption = [assumption for assumption in
-                      self.data.tbl_assumption.itertuples(index=False)][0]
-        emp = pd.DataFrame(self.data.tbl_employee[['id', 'geboortedatum']])
-        clm = (
-          pd.DataFrame(self.data.tbl_pension_plan[['regeling_id', 'aanspraak',
-                                                   'pensioenlfd']])
-          )
-        emp['ones'], clm['ones'] = 1, 1
-        empxclm = pd.merge(left=emp, right=clm, on='ones')
-        empxclm['nprojectionyears'] = (
-          nprojection_years(birthdate=empxclm.geboortedatum,
-                            calculation_date=assumption.rekendatum,
-                            pension_age=empxclm.pensioenlfd).apply(int)
-          )
+        if self.compact and self.nsimuls > np.iinfo(np.int16).max:
+            raise ValueError('compact Tableau supports up to {} '
+                             'simulations'.format(np.iinfo(np.int16).max))
+        empxclm = self._claims(ids, regeling_ids)
 
-        # build tableau Employee x Claim x Year x Simulation
-        cols = ['id', 'regeling_id', 'aanspraak']
-        empxclmxyr = (np.repeat(np.array(empxclm[cols].values),
-                      repeats=np.array(empxclm.nprojectionyears), axis=0))
-        empxclmxyr = pd.DataFrame(data=empxclmxyr,
-                                  columns=['id', 'regeling_id', 'aanspraak'])
-        empxclmxyr['ones'] = 1
-        cols = ['id', 'regeling_id', 'aanspraak']
-        empxclmxyr['BOY'] = (empxclmxyr.groupby(cols)['ones'].cumsum())
-        sim = pd.DataFrame(data={'simulnr': range(1, self.nsimuls + 1),
-                           'ones': self.nsimuls * [1]})
-        cols = ['id', 'regeling_id', 'aanspraak', 'simulnr', 'BOY']
-        empxclmxyrxsim = (
-          pd.merge(empxclmxyr, sim).sort_values(cols).
-          reset_index().drop(['index', 'ones'], axis=1)
-          )
-        empxclmxyrxsim['id'] = empxclmxyrxsim.id.apply(int)
-        # for merging with employee data on id
-        empxclmxyrxsim['regeling_id'] = empxclmxyrxsim.regeling_id.apply(int)
-        # for merging with claim data on regeling_id, aanspraak
-
-        # merge employee & pensionplan data into tableau
-        self.data.tbl_employee.set_index('id', inplace=True)
-        tab = empxclmxyrxsim.join(self.data.tbl_employee, on='id')
-        cols = ['regeling_id', 'aanspraak']
-        self.data.tbl_pension_plan.set_index(cols, inplace=True)
-        tab = tab.join(self.data.tbl_pension_plan, on=cols)
+        # build tableau Employee x Claim x Simulation x Year, sorted by
+        # id, regeling_id, aanspraak, simulnr, BOY
+        # (int64: nsimuls x years overflows the int16 of compact mode)
+        nyears = empxclm.nprojectionyears.values.astype(np.int64)
+        counts = self.nsimuls * nyears
+        rows = np.repeat(np.arange(len(empxclm)), counts)
+        position = (np.arange(counts.sum()) -
+                    np.repeat(np.cumsum(counts) - counts, counts))
+        tab = empxclm.take(rows).reset_index(drop=True)
+        tab.insert(3, 'BOY',
+                   (position % nyears[rows] + 1).astype(self.dtypes['BOY']))
+        tab.insert(4, 'simulnr', (position // nyears[rows] + 1).astype(
+          self.dtypes['simulnr']))
         return tab
 
     def _add_age(self, tab):
@@ -87,138 +286,126 @@ class Tableau:
                       self.data.tbl_assumption.itertuples(index=False)][0]
 
         # calculate age etc.
-        tab['pensioendatum'] = pensiondate(tab.geboortedatum, tab.pensioenlfd)
-        tab['fsy0'] = future_service_years(assumption.rekendatum,
-                                           tab.pensioendatum)
-        tab['psy0'] = past_service_years(tab.datum_in_dienst,
-                                         assumption.rekendatum, method='PwC')
-        tab['tsy'] = total_service_years(tab.psy0, tab.fsy0)
         tab['fsy'] = tab['fsy0'] - tab['BOY'] + 1
-        tab['leeftijd0'] = age(tab.pensioenlfd, tab.fsy0).astype(int)
-        tab['leeftijd0_adjusted'] = tab.leeftijd0 + assumption.age_adjustment
         tab['leeftijd'] = age(tab.pensioenlfd, tab.fsy)
-        tab['leeftijd_low'] = tab.leeftijd.values.astype(int)
-        tab['leeftijd_low_adjusted'] = (tab.leeftijd_low +
-                                        assumption.age_adjustment)
+        tab['leeftijd_low'] = tab.leeftijd.values.astype(
+          self.dtypes['leeftijd_low'])
+        tab['leeftijd_low_adjusted'] = (
+          tab.leeftijd_low.values + assumption.age_adjustment
+          ).astype(self.dtypes['leeftijd_low_adjusted'])
+        return tab
+
+    def _lookup(self, tab, name, on, level=None, rsuffix=''):
+        """ Add values from lookup table to tableau, matched on columns on
+
+        By fancy indexing the integer coded lookup array, or (if
+        join_lookups) by joining the lookup table.
+
+        Parameters
+        ----------
+        tab     : tableau
+        name    : name of lookup table in self.data
+        on      : list of tableau columns, 1 per index level
+        level   : value for first index level (like 'actief') or None
+        rsuffix : suffix added to column name
+
+        Simulation numbers (column simulnr) are mapped to scenario numbers
+        of the lookup table by self.scenario_index.
+        """
+        keys = [tab[col].values for col in on]
+        if 'simulnr' in on:
+            position = on.index('simulnr')
+            keys[position] = self.scenario_index[name][keys[position]]
+
+        if self.join_lookups:
+            table = getattr(self.data, name)
+            if level is not None:
+                table = table.loc[level]
+            return tab.join(table, on=keys, rsuffix=rsuffix)
+
+        array = self.data.lookup_arrays[name]
+        if level is not None:
+            keys = [level] + keys
+        tab[array.name + rsuffix] = array.lookup(*keys)
         return tab
 
     def _lookup_increments(self, tab):
         """ Add increments like inflation, intrest, return etc.
         """
-        # merge (cumulative) indices into tableau
-        tab['simulnr_cpy'] = tab.simulnr
+        # the projection years of each employee x claim x simulation are
+        # consecutive rows of the (sorted) tableau
+        segments = Segments(tab.BOY.values == 1)
 
+        # merge (cumulative) indices into tableau
         # inflation
-        n = self.data.lookup_inflation.index.get_level_values('simulnr').max()
-        tab['simulnr'] = tab.simulnr_cpy.map(lambda x: modulo_map(x, n))
-        tab = tab.join(self.data.lookup_inflation, on=['BOY', 'simulnr'])
-        # PJM : simulnr --> simulnr_cpy
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr_cpy'])
+        tab = self._lookup(tab, 'lookup_inflation', on=['BOY', 'simulnr'])
         tab['pct_prijsinflatie_primo_idx'] = (
-          grouped['pct_prijsinflatie_primo'].apply(calculate_cumulative_index)
+          segments.cumprod(1 + tab.pct_prijsinflatie_primo)
           )
-        tab['simulnr'] = tab.simulnr_cpy
 
         # salary increase
-        n = (self.data.lookup_salincrease.index.
-             get_level_values('simulnr').max())
-        tab['simulnr'] = tab.simulnr_cpy.map(lambda x: modulo_map(x, n))
-        tab = tab.join(self.data.lookup_salincrease,
-                       on=['leeftijd_low', 'simulnr'])
-        # PJM
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr_cpy'])
+        tab = self._lookup(tab, 'lookup_salincrease',
+                           on=['leeftijd_low', 'simulnr'])
         tab['pct_salstijging_primo_idx'] = (
-          grouped['pct_salstijging_primo'].apply(calculate_cumulative_index)
+          segments.cumprod(1 + tab.pct_salstijging_primo)
           )
-        tab['simulnr'] = tab.simulnr_cpy
 
         # indexation (actives)
-        n = (self.data.lookup_indexation.index.
-             get_level_values('simulnr').max())
-        tab['simulnr'] = tab.simulnr_cpy.map(lambda x: modulo_map(x, n))
-
-        lookup_indexation_actives = self.data.lookup_indexation.loc['actief']
-        tab = tab.join(lookup_indexation_actives, on=['BOY', 'simulnr'])
-        # PJM
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr_cpy'])
+        tab = self._lookup(tab, 'lookup_indexation', on=['BOY', 'simulnr'],
+                           level='actief')
         tab['pct_indexatie_primo_idx'] = (
-            grouped['pct_indexatie_primo'].
-            apply(calculate_cumulative_index)
+            segments.cumprod(1 + tab.pct_indexatie_primo)
             )
         tab['pct_indexatie_primo_idx_shifted'] = (
-          grouped['pct_indexatie_primo_idx'].shift().fillna(1)
+          segments.shift(tab.pct_indexatie_primo_idx, fill=1)
           )
 
         # indexation (inactives)
-        lookup_indexation_inactives = (
-          self.data.lookup_indexation.loc['inactief']
-          )
-        tab = tab.join(lookup_indexation_inactives,
-                       on=['BOY', 'simulnr'], rsuffix='_inactief')
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr'])
+        tab = self._lookup(tab, 'lookup_indexation', on=['BOY', 'simulnr'],
+                           level='inactief', rsuffix='_inactief')
         tab['pct_indexatie_primo_inactief_idx'] = (
-            grouped['pct_indexatie_primo_inactief'].
-            apply(calculate_cumulative_index)
+            segments.cumprod(1 + tab.pct_indexatie_primo_inactief)
             )
         tab['pct_indexatie_primo_inactief_idx_shifted'] = (
-          grouped['pct_indexatie_primo_inactief_idx'].shift().fillna(1)
+          segments.shift(tab.pct_indexatie_primo_inactief_idx, fill=1)
           )
-        tab['simulnr'] = tab.simulnr_cpy
 
         # intrest
-        n = (self.data.lookup_intrest.index.
-             get_level_values('simulnr').max())
-        tab['simulnr'] = tab.simulnr_cpy.map(lambda x: modulo_map(x, n))
-        tab = tab.join(self.data.lookup_intrest, on=['BOY', 'simulnr'])
-        # PJM
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr_cpy'])
+        tab = self._lookup(tab, 'lookup_intrest', on=['BOY', 'simulnr'])
         tab['pct_rente_ultimo_idx'] = (
-            grouped['pct_rente_ultimo'].apply(calculate_cumulative_index))
+            segments.cumprod(1 + tab.pct_rente_ultimo))
         tab['pct_rente_ultimo_idx_shifted'] = (
-          grouped['pct_rente_ultimo_idx'].shift().fillna(1)
+          segments.shift(tab.pct_rente_ultimo_idx, fill=1)
           )
-        tab['simulnr'] = tab.simulnr_cpy
 
         # return
-        n = (self.data.lookup_return.index.
-             get_level_values('simulnr').max())
-        tab['simulnr'] = tab.simulnr_cpy.map(lambda x: modulo_map(x, n))
-        tab = tab.join(self.data.lookup_return,
-                       on=['leeftijd0', 'BOY', 'simulnr'])
-        # PJM
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr_cpy'])
+        tab = self._lookup(tab, 'lookup_return',
+                           on=['leeftijd0', 'BOY', 'simulnr'])
         tab['pct_rendement_ultimo_idx'] = (
-            grouped['pct_rendement_ultimo'].apply(calculate_cumulative_index))
+            segments.cumprod(1 + tab.pct_rendement_ultimo))
         tab['pct_rendement_ultimo_idx_shifted'] = (
-          grouped['pct_rendement_ultimo_idx'].shift().fillna(1)
+          segments.shift(tab.pct_rendement_ultimo_idx, fill=1)
           )
-        tab['simulnr'] = tab.simulnr_cpy
 
         # nqx
         cols = ['geslacht', 'leeftijd0_adjusted', 'leeftijd_low_adjusted']
-        tab = tab.join(self.data.lookup_nqx, on=cols)
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr'])
-        tab['nqx_primo_idx'] = (
-            grouped['nqx_primo'].apply(calculate_cumulative_index_conjugate)
-            )
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr'])
+        tab = self._lookup(tab, 'lookup_nqx', on=cols)
+        tab['nqx_primo_idx'] = segments.cumprod(1 - tab.nqx_primo)
         tab['nqx_primo_idx_shifted'] = (
-          grouped['nqx_primo_idx'].shift().fillna(1)
+          segments.shift(tab.nqx_primo_idx, fill=1)
           )
 
         # tariff
         cols = ['tarief_id', 'aanspraak', 'geslacht', 'leeftijd_low']
-        tab = tab.join(self.data.lookup_tariff, on=cols)
+        tab = self._lookup(tab, 'lookup_tariff', on=cols)
         return tab
 
-        # reset simulnr column
-        # tab.drop('simulnr_cpy', inplace=True, axis=1)
-
     def _run_projections(self, tab):
         """ Add benefit projections to tableau
 
         Note: yes, finally we can go vectorized!
         """
+        segments = Segments(tab.BOY.values == 1)
         assumption = [assumption for assumption in
                       self.data.tbl_assumption.itertuples(index=False)][0]
         # require pension base at start for final pay plan
@@ -244,10 +431,7 @@ class Tableau:
         tab['pro_rata'] = np.minimum(tab.fsy.values, 1)
 
         tab['discount'] = tab.eigen_bijdrage / tab.pct_rente_ultimo_idx_shifted
-        # Cast colum to be summed from object to float!
-        tab['discount'] = tab.discount.astype('float')
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr'])
-        cum_discount = grouped['discount'].cumsum()
+        cum_discount = segments.cumsum(tab.discount)
         tab['cum_eigen_bijdrage'] = tab.pct_rente_ultimo_idx * cum_discount
 
         tab['eur_rendement'] = eur_return(tab.cum_eigen_bijdrage,
@@ -277,23 +461,13 @@ class Tableau:
         avg_pay = defined_benefit & (tab.type_regeling == 'ML')
         tab['inkoop_ml'] = (avg_pay * tab.pro_rata * tab.percentage *
                             tab.pt_pensioengrondslag)
-        # Cast colum to be summed from object to float!
-        tab['inkoop_ml'] = tab.inkoop_ml.astype('float')
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr'])
-        tab['tijdsevenredig_ml'] = avg_pay * grouped['inkoop_ml'].cumsum()
         tab['discount'] = (avg_pay * tab.inkoop_ml /
                            tab.pct_indexatie_primo_idx_shifted)
-        # Cast colum to be summed from object to float!
-        tab['discount'] = avg_pay * tab.discount.astype('float')
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr'])
-        cum_discount = avg_pay * grouped['discount'].cumsum()
+        cum_discount = avg_pay * segments.cumsum(tab.discount)
         tab['tijdsevenredig_ml'] = (avg_pay *
                                     tab.pct_indexatie_primo_idx_shifted *
                                     cum_discount)
-        # Cast colum to be summed from object to float!
-        tab['tijdsevenredig_ml'] = tab.tijdsevenredig_ml.astype('float')
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr'])
-        opbouw_ml = avg_pay * grouped['tijdsevenredig_ml'].diff()
+        opbouw_ml = avg_pay * segments.diff(tab.tijdsevenredig_ml)
         tab['opbouw_ml'] = avg_pay * ((tab.BOY == 1) * tab.tijdsevenredig_ml +
                                       (tab.BOY != 1) * opbouw_ml.fillna(0))
         tab['backservice_ml'] = (avg_pay * tab.pct_indexatie_primo *
@@ -301,11 +475,8 @@ class Tableau:
 
         # final pay
         final_pay = defined_benefit & (tab.type_regeling == 'EL')
-        # Cast colum to be summed from object to float!
-        tab['pt_pensioengrondslag'] = tab.pt_pensioengrondslag.astype('float')
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr'])
         pt_grondslag_shifted = (
-          grouped['pt_pensioengrondslag'].shift().fillna(0)
+          segments.shift(tab.pt_pensioengrondslag, fill=0)
           )
         tab['pt_pensioengrondslag_shifted'] = (
           (tab.BOY == 1) * tab.pt_pensioengrondslag0 +
@@ -319,10 +490,7 @@ class Tableau:
         tab['inkoop_el'] = (final_pay * tab.percentage *
                             tab.pt_pensioengrondslag)
         tab['opbouw_el'] = final_pay * (tab.inkoop_el + tab.backservice_el)
-        # Cast colum to be summed from object to float!
-        tab['opbouw_el'] = tab.opbouw_el.astype('float')
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr'])
-        tab['tijdsevenredig_el'] = final_pay * grouped['opbouw_el'].cumsum()
+        tab['tijdsevenredig_el'] = final_pay * segments.cumsum(tab.opbouw_el)
 
         # both average pay and final pay
         tab['inkoop'] = avg_pay * tab.inkoop_ml + final_pay * tab.inkoop_el
@@ -344,18 +512,11 @@ class Tableau:
         tab['eur_premie_dc'] = (c * tab.pro_rata * tab.pct_staffel *
                                 tab.pt_pensioengrondslag)
         timing_investments = 1 - assumption.timing_belegging
-        cf_timing_factor = ((1 + timing_investments *
-                             tab.pct_rendement_ultimo) /
-                            (1 + tab.pct_rendement_ultimo))
-        tab['discount_varl'] = (c * tab.eur_premie_dc * cf_timing_factor *
-                                tab.nqx_primo_idx_shifted /
-                                tab.pct_rendement_ultimo_idx_shifted)
-        # Cast colum to be summed from object to float!
-        tab['discount_varl'] = c * tab.discount_varl.astype('float')
-        grouped = tab.groupby(['id', 'regeling_id', 'aanspraak', 'simulnr'])
-        tab['cum_discount'] = (grouped['discount_varl'].cumsum())
-        tab['capital'] = (c * (tab.pct_rendement_ultimo_idx /
-                          tab.nqx_primo_idx) * tab.cum_discount)
+        capital = accumulate_capital(tab.eur_premie_dc.values,
+                                     tab.pct_rendement_ultimo.values,
+                                     tab.nqx_primo.values,
+                                     timing_investments, segments=segments)
+        tab['capital'] = c * capital
 
         # universal premium
         tab['eur_premie'] = (defined_benefit * tab.eur_premie_db + c *
@@ -371,11 +532,348 @@ class Tableau:
         tab.drop(todrop, axis=1, inplace=True)
         return tab
 
-    def create(self):
-        tableau = self._merge()
-        tableau = self._add_age(tableau)
-        tableau = self._lookup_increments(tableau)
-        return self._run_projections(tableau)
+    def create(self, ids=None, regeling_ids=None):
+        """ Return tableau for given employee ids and pension plans (all
+        employees / plans if None)
+
+        For all employees and plans, the intermediate stages are memoised
+        if keep_stages (each stage then works on a copy of the previous
+        one).
+        """
+        run = self.instrument.run
+        if ids is not None or regeling_ids is not None:
+            tableau = run('_merge', self._merge, ids, regeling_ids)
+            check_dtypes(tableau, self.dtypes)
+            tableau = run('_add_age', self._add_age, tableau)
+            tableau = run('_lookup_increments', self._lookup_increments,
+                          tableau)
+            check_dtypes(tableau, self.dtypes)
+            return run('_run_projections', self._run_projections, tableau)
+
+        def lookup_increments():
+            aged = self._skeleton()
+            if self._is_memoised('add_age'):
+                aged = aged.copy()
+            tableau = run('_lookup_increments', self._lookup_increments,
+                          aged)
+            check_dtypes(tableau, self.dtypes)
+            return tableau
+
+        keep = self.keep_stages
+        increments = self._memoised('lookup_increments', lookup_increments,
+                                    keep)
+        if keep:
+            increments = increments.copy()
+        return run('_run_projections', self._run_projections, increments)
+
+    def _skeleton(self, keep=False):
+        """ Return tableau of all employees and plans after _merge and
+        _add_age (before the lookups), memoised if keep or keep_stages
+        """
+        run = self.instrument.run
+        keep = keep or self.keep_stages
+
+        def merge():
+            tableau = run('_merge', self._merge)
+            check_dtypes(tableau, self.dtypes)
+            return tableau
+
+        def add_age():
+            merged = self._memoised('merge', merge, self.keep_stages)
+            if self.keep_stages:
+                merged = merged.copy()
+            return run('_add_age', self._add_age, merged)
+
+        return self._memoised('add_age', add_age, keep)
+
+    def variant(self, assumptions, sheets=None):
+        """ Return Tableau of the same workbook with tbl_assumption values
+        replaced by assumptions
+
+        The variant shares the expanded tableau (after _merge and
+        _add_age) with this Tableau, so only the lookups and projections
+        are redone. This Tableau keeps it (until clear_cache) for the next
+        variant. Changed ids (like rente_id) reselect the lookup tables
+        from sheets.
+
+        Parameters
+        ----------
+        assumptions : dict of tbl_assumptie column: value, like
+                      {'rente_id': 2, 'timing_belegging': 0.5}. tarief_id
+                      sets the tariff of all claims (a number) or maps
+                      old to new tariffs (a dict). rekendatum can not be
+                      changed, as it changes the projection years.
+        sheets      : lookup sheets (see load.read_lookup_sheets), or None
+                      to read them from xlswb if needed
+        """
+        data = self.data
+        unknown = (set(assumptions) - set(data.tbl_assumption.columns) -
+                   {'tarief_id'})
+        if unknown:
+            raise ValueError('Unknown assumption(s): ' +
+                             ', '.join(sorted(unknown)))
+        if 'rekendatum' in assumptions:
+            raise ValueError('rekendatum changes the projection years, '
+                             'use a new Tableau')
+
+        tbl_assumption = data.tbl_assumption.copy()
+        for column, value in assumptions.items():
+            if column in tbl_assumption.columns:
+                tbl_assumption[column] = value
+        new = data._replace(tbl_assumption=tbl_assumption)
+        ids = [col for col in tbl_assumption.columns if col.endswith('_id')]
+        if not tbl_assumption[ids].equals(data.tbl_assumption[ids]):
+            if sheets is None:
+                sheets = read_lookup_sheets(self.xlswb, self.instrument)
+            new = new._replace(**select_lookups(sheets, tbl_assumption,
+                                                self.instrument))
+            new = new._replace(lookup_arrays=build_lookup_arrays(new))
+            if self.annuity_factors is not None:
+                new = self.annuity_factors.apply(new)
+        changes = {}
+        if 'tarief_id' in assumptions:
+            tariff = assumptions['tarief_id']
+            plans = data.tbl_pension_plan.copy()
+            if isinstance(tariff, dict):
+                plans['tarief_id'] = plans.tarief_id.replace(tariff)
+            else:
+                plans['tarief_id'] = tariff
+            new = new._replace(tbl_pension_plan=enforce_dtypes(plans,
+                                                               self.dtypes))
+            changes['tarief_id'] = new.tbl_pension_plan.tarief_id
+
+        variant = copy.copy(self)
+        variant._memo = {name: self._memo[name] for name in ['categories']
+                         if name in self._memo}
+        variant._memo['data'] = (self._memo_key('data'), new)
+        if self.full_tableau:
+            aged = self._skeleton(keep=True)
+            adjustment = (tbl_assumption.age_adjustment[0] -
+                          data.tbl_assumption.age_adjustment[0])
+            columns = {}
+            if adjustment:
+                for col in ['leeftijd0_adjusted', 'leeftijd_low_adjusted']:
+                    columns[col] = (aged[col].values + adjustment).astype(
+                      aged[col].dtype)
+            if changes:
+                tariff = changes['tarief_id']
+                columns['tarief_id'] = tariff.reindex(
+                  pd.MultiIndex.from_arrays([aged.regeling_id,
+                                             aged.aanspraak])).values
+            if columns:
+                aged = aged.assign(**columns)
+            variant._memo['add_age'] = (self._memo_key('add_age'), aged)
+        return variant
+
+    def what_if(self, variants):
+        """ Return summaries of assumption variants, keyed by variant
+
+        Every variant (see variant) reuses the expanded tableau and the
+        lookup sheets, so the workbook is read and expanded once.
+
+        Parameters
+        ----------
+        variants : dict of name: assumptions or list of assumptions (named
+                   0, 1, ...), e.g. {'low rates': {'rente_id': 2},
+                   'no adjustment': {'age_adjustment': 0}}
+
+        Returns
+        -------
+        summary : DataFrame indexed by variant and record number
+        """
+        if not isinstance(variants, dict):
+            variants = dict(enumerate(variants))
+        ids = {col for col in self.data.tbl_assumption.columns
+               if col.endswith('_id')}
+        sheets = None
+        if any(ids.intersection(assumptions)
+               for assumptions in variants.values()):
+            sheets = read_lookup_sheets(self.xlswb, self.instrument)
+        summaries = {}
+        for name, assumptions in variants.items():
+            variant = self.variant(assumptions, sheets)
+            summaries[name] = variant.add_summary().reset_index(drop=True)
+        return pd.concat(summaries, names=['variant', None])
+
+    def iter_summary(self, chunk_employees=None, n_jobs=None):
+        """ Generate summaries for batches of chunk_employees employees
+
+        Each batch is projected independently, so peak memory is bounded
+        by the batch size instead of the population. If n_jobs > 1, the
+        batches are projected by a pool of n_jobs worker processes. The
+        summaries are generated in order of employee id, so the result is
+        identical to a serial run.
+        """
+        ids = np.sort(self.data.tbl_employee.index.values)
+        if chunk_employees is None:
+            chunk_employees = -(-len(ids) // (n_jobs or 1))
+        chunks = [ids[start:start + chunk_employees]
+                  for start in range(0, len(ids), chunk_employees)]
+        if n_jobs is None or n_jobs == 1:
+            for chunk in chunks:
+                yield self._project(chunk)
+        else:
+            # the data (lookup tables) are sent to each worker once, not
+            # per batch; the stages run by the workers are added to report
+            with ProcessPoolExecutor(max_workers=n_jobs,
+                                     initializer=_init_worker,
+                                     initargs=(self._worker_copy(),)
+                                     ) as executor:
+                for summary, records in executor.map(_summarize_chunk,
+                                                     chunks):
+                    for record in records:
+                        self.instrument.record(record)
+                    yield summary
+
+    def _worker_copy(self):
+        """ Return copy of this Tableau for the worker processes: the
+        parameters and the data, without memoised tableaux or summaries
+        (and without callback, which runs in this process)
+        """
+        shared = ['data', 'categories', 'scenario_index']
+        for name in shared:
+            getattr(self, name)  # computed once, in this process
+        worker = copy.copy(self)
+        worker._memo = {name: self._memo[name] for name in shared}
+        worker.instrument = Instrument()
+        return worker
+
+    def _project(self, ids=None, regeling_ids=None):
+        """ Return summary for given employee ids and pension plans, from
+        the tableau or (if not detail) by project_summary
+
+        If deterministic, the tableau has 1 simulation and its summary is
+        repeated for the other simulations.
+        """
+        if not self.detail:
+            return self.instrument.run('project_summary',
+                                       self.project_summary, ids,
+                                       regeling_ids)
+        if self.deterministic and self.nsimuls > 1:
+            summary = self._single_simulation()._project(ids, regeling_ids)
+            return tile_simulations(summary, self.nsimuls)
+        return self.instrument.run('add_summary', self._summarize,
+                                   self.create(ids, regeling_ids))
+
+    def _single_simulation(self):
+        """ Return copy of this Tableau with 1 simulation, sharing the data
+        and the report, and the first simulation of the memoised tableau
+        after _add_age (e.g. of a variant)
+        """
+        single = copy.copy(self)
+        single.nsimuls = 1
+        single._memo = {name: self._memo[name] for name in
+                        ['data', 'categories'] if name in self._memo}
+        if self._is_memoised('add_age'):
+            aged = self._memo['add_age'][1]
+            single._memo['add_age'] = (
+              single._memo_key('add_age'),
+              aged[aged.simulnr.values == 1].reset_index(drop=True))
+        return single
+
+    def project_summary(self, ids=None, regeling_ids=None):
+        """ Return summary without building the tableau
+
+        Only the running state of each employee x claim x simulation is
+        carried through the projection years, so memory is O(claims x
+        simulations) instead of O(claims x simulations x years). Same
+        records as add_summary.
+
+        If deterministic, only 1 simulation is projected and its summary
+        is repeated for the other simulations.
+
+        Parameters
+        ----------
+        ids          : list of employee ids or None (all employees)
+        regeling_ids : list of pension plan ids or None (all plans)
+        """
+        claims = self._claims(ids, regeling_ids)
+        nsimuls, scenario_index = self.nsimuls, self.scenario_index
+        if self.deterministic:
+            nsimuls, scenario_index = 1, scenario_indices(self.data, 1)
+        at_pensiondate = project_pensiondate(self.data, claims, nsimuls,
+                                             scenario_index)
+        summary = summarize(self.data, claims, nsimuls, scenario_index,
+                            at_pensiondate)
+        if self.deterministic:
+            return tile_simulations(summary, self.nsimuls)
+        return summary
+
+    def update(self, xlswb=None):
+        """ Re-read workbook and reproject only what changed
+
+        The new workbook is compared with the data of the previous run
+        per employee (id) and per pension plan (regeling_id). Only the
+        changed employees x all plans and the other employees x changed
+        plans are reprojected and spliced into the tableau (or into the
+        summary in summary-only / chunked / parallel mode). Changed
+        assumptions or lookup tables reproject everything.
+
+        Parameters
+        ----------
+        xlswb : new workbook (or directory), or None to re-read self.xlswb
+
+        Returns
+        -------
+        (ids, regeling_ids) : reprojected employees and plans, or None if
+            everything is reprojected (on next access)
+        """
+        previous = self._memo.get('data')
+        stage = 'tableau' if self.full_tableau else 'summary'
+        if previous is None or stage not in self._memo:
+            if xlswb is not None:
+                self.xlswb = xlswb
+            self.clear_cache()
+            return None
+
+        # read and compare first: if that fails (e.g. the workbook is
+        # being saved), the current data and tableau are kept
+        current = self.xlswb
+        if xlswb is not None:
+            self.xlswb = xlswb
+        try:
+            old, new = previous[1], self._read()
+            changes = diff_data(old, new)
+            if categories(new) != categories(old):
+                changes = None
+        except Exception:
+            self.xlswb = current
+            raise
+        if changes is None:
+            self.clear_cache()
+            self._memo['data'] = (self._memo_key('data'), new)
+            return None
+        self._memo['data'] = (self._memo_key('data'), new)
+
+        # keep scenario index, drop (stale) intermediate stages
+        frame = self._memo.pop(stage)[1]
+        for name in ['categories', 'scenario_index']:
+            if name in self._memo:
+                self._memo[name] = (self._memo_key(name),
+                                    self._memo[name][1])
+        for name in ['merge', 'add_age', 'lookup_increments']:
+            self._memo.pop(name, None)
+
+        ids, regeling_ids = changes
+        current_ids = new.tbl_employee.index
+        current_plans = new.tbl_pension_plan.index.get_level_values(
+          'regeling_id')
+        reproject = self.create if stage == 'tableau' else self._project
+        slices = []
+        if current_ids.isin(ids).any():
+            slices.append(reproject(current_ids[current_ids.isin(ids)]))
+        others = current_ids[~current_ids.isin(ids)]
+        if len(others) and current_plans.isin(regeling_ids).any():
+            slices.append(reproject(others, regeling_ids))
+        self._memo[stage] = (self._memo_key(stage),
+                             splice(frame, slices, ids, regeling_ids))
+        return ids, regeling_ids
+
+    def bytes_per_row(self):
+        """ Return memory usage of tableau in bytes per row (including
+        text in object columns)
+        """
+        return self.tableau.memory_usage(deep=True).sum() / len(self.tableau)
 
     def long_to_wide(self, df, default=True):
         if default:
@@ -390,97 +888,248 @@ class Tableau:
 
     def add_summary(self):
         """ Return summary: 1 record per employee x plan x simulation
+
+        If deterministic and the tableau is not there yet, 1 simulation is
+        projected and its summary repeated (indexed 0 .. n - 1 instead of
+        by tableau row).
+        """
+        if not self.full_tableau:
+            return self.summary.copy()
+        if (self.deterministic and self.nsimuls > 1 and
+                not self._is_memoised('tableau')):
+            return self._project()
+        return self.instrument.run('add_summary', self._summarize,
+                                   self.tableau)
+
+    def distribution(self, columns=None, quantiles=QUANTILES,
+                     thresholds=None, method='exact', per_year=False):
+        """ Return mean, quantiles and shortfall probabilities over the
+        simulations (see aggregate.Distribution)
+
+        Per employee x plan from the summary, or (per_year) per employee x
+        claim x projection year from the tableau. In summary-only / chunked
+        / parallel mode the summaries are aggregated batch by batch without
+        keeping them (unless the summary is already there).
+
+        Parameters
+        ----------
+        columns    : defaults to aggregate.DISTRIBUTION_COLUMNS, or
+                     tijdsevenredig and capital if per_year
+        quantiles  : like (0.05, 0.5, 0.95)
+        thresholds : dict of column: threshold for shortfall probabilities
+        method     : 'exact' or 'sketch' quantiles
+        per_year   : from tableau (requires full_tableau)
+        """
+        if per_year:
+            if not self.full_tableau:
+                raise ValueError('per_year requires the full tableau '
+                                 '(detail=True, no chunk_employees / '
+                                 'n_jobs)')
+            distribution = Distribution(
+              by=TABLEAU_KEYS, columns=columns or ['tijdsevenredig',
+                                                   'capital'],
+              quantiles=quantiles, thresholds=thresholds, method=method)
+            return distribution.update(self.tableau).result()
+
+        distribution = Distribution(
+          columns=columns or DISTRIBUTION_COLUMNS, quantiles=quantiles,
+          thresholds=thresholds, method=method)
+        memo = self._memo.get('summary')
+        if self.full_tableau or (memo is not None and
+                                 memo[0] == self._memo_key('summary')):
+            summaries = [self.add_summary()]
+        else:
+            summaries = self.iter_summary(self.chunk_employees, self.n_jobs)
+        for summary in summaries:
+            distribution.update(summary)
+        return distribution.result()
+
+    def _summarize(self, tableau):
+        """ Return summary of given tableau
         """
-        tar = self.data.lookup_tar_at_pensionage
-
-        # create lookup table 1: 100/70 combi tarief
-        # indexed by: pensioenlfd x geslacht x leeftijd x simulnr
-        # required for: converting DC capitals to DB claim)
-        lookup_combi = tar.unstack(level='aanspraak_id')
-        lookup_combi.columns = pd.Index(['tar_NPLLRS', 'tar_OPLL'])
-        lookup_combi['tar_combi'] = (lookup_combi.tar_OPLL +
-                                     0.7 * lookup_combi.tar_NPLLRS)
-
-        # create lookup table 2: capital at pension date DB plans
-        # indexed by: regeling_id x id x simulnr
-        # required for: converting DB claims to DC capital
-        db_claims = ['OPLL', 'NPLLRS']
-        db = self.tableau[(self.tableau.fsy == 1) &
-                          (self.tableau.aanspraak.isin(db_claims))]
-        selected_columns = ['regeling_id', 'id', 'pensioenlfd',
-                            'geslacht', 'leeftijd0', 'aanspraak',
-                            'simulnr', 'tijdsevenredig']
-        db = db[selected_columns].copy()
-        n = self.data.lookup_tar_at_pensionage.index.get_level_values(
-          'simulnr').max()
-        db['simulnr_tmp'] = db.simulnr.map(lambda x: modulo_map(x, n))
-        db['leeftijd0'] = db.leeftijd0.astype(np.int64)  # cast: object --> int
-        joined = db.join(tar, on=['pensioenlfd', 'geslacht', 'aanspraak',
-                                  'leeftijd0', 'simulnr_tmp'])
-        joined['capital_db'] = joined.tijdsevenredig * joined.tar
-        remove = ['pensioenlfd', 'geslacht', 'leeftijd0', 'aanspraak',
-                  'tijdsevenredig', 'tar', 'simulnr_tmp']
-        joined.drop(remove, axis=1, inplace=True)
-        grouped = joined.groupby(['regeling_id', 'id', 'simulnr'])
-        lookup_capital = grouped.sum()
-
-        # join lookup tables into summary frame
-        summary_cols = ['regeling_id', 'id', 'simulnr', 'aow',
-                        'cum_eigen_bijdrage', 'geslacht', 'leeftijd0',
-                        'memo', 'naam', 'pensioenlfd', 'type_regeling',
-                        'geboortedatum', 'ft_salaris', 'pt_percentage',
-                        'premie_franchise', 'premie_plafond',
-                        'pct_eigen_bijdrage', 'eigen_bijdrage',
-                        'capital', 'tijdsevenredig']
-        selected_rows = ((self.tableau.fsy == 1) &
-                         (self.tableau.aanspraak.isin(['OPLL', 'VARL'])))
-        summary = self.tableau[selected_rows][summary_cols]
-        summary.rename({'ft_salaris': 'projectie_ft_salaris',
-                        'premie_franchise': 'projectie_premie_franchise',
-                        'premie_plafond': 'projectie_premie_plafond',
-                        'aow': 'projectie_aow'}, axis=1, inplace=True)
-        summary['simulnr_tmp'] = summary.simulnr.map(
-          lambda x: modulo_map(x, n))
-        summary = summary.join(lookup_combi,
-                               on=['pensioenlfd', 'geslacht',
-                                   'leeftijd0', 'simulnr_tmp'])
-        summary = summary.join(lookup_capital,
-                               on=['regeling_id', 'id', 'simulnr'])
-        summary['aow'] = self.data.tbl_assumption['aow'][0]
-        employees = self.data.tbl_employee
-        summary = summary.join(employees[['ft_salaris', 'op_premievrij',
-                                          'np_premievrij']], on='id')
-        plans = self.data.tbl_pension_plan.groupby(
-          'regeling_id')[['premie_franchise', 'premie_plafond']].first()
-        summary = summary.join(plans, on=['regeling_id'])
-        summary['projectie_op_dc'] = summary.capital / summary.tar_combi
-        summary['projectie_op'] = (summary.tijdsevenredig +
-                                   summary.projectie_op_dc)
-        pv = ((summary.op_premievrij * summary.tar_OPLL +
-               summary.np_premievrij * summary.tar_NPLLRS) / summary.tar_combi)
-        summary['projectie_op_plus_pv'] = summary.projectie_op + pv
-        summary['projectie_op_plus_pv_aow'] = (
-          summary.projectie_op_plus_pv + summary.projectie_aow)
-        summary['capital'] = summary.capital.fillna(0)
-        summary['capital_db'] = summary.capital_db.fillna(0)
-        summary['capital'] = summary.capital + summary.capital_db
-        summary['projectie_op_wg'] = (
-          summary.capital - summary.cum_eigen_bijdrage) / summary.tar_combi
-        summary['projectie_op_wn'] = (
-          summary.projectie_op - summary.projectie_op_wg)
-        pension_salary = np.minimum(summary.ft_salaris, summary.premie_plafond)
-        summary['eigen_bijdrage0'] = (
-          summary.pt_percentage * summary.pct_eigen_bijdrage *
-          np.maximum(0, pension_salary - summary.premie_franchise))
-        final_cols = ['id', 'regeling_id', 'simulnr','naam', 'geboortedatum',
-                      'geslacht', 'leeftijd0', 'ft_salaris', 'pt_percentage',
-                      'aow', 'np_premievrij', 'op_premievrij', 'memo',
-                      'type_regeling', 'pensioenlfd', 'pct_eigen_bijdrage',
-                      'eigen_bijdrage0', 'premie_franchise', 'premie_plafond',
-                      'projectie_ft_salaris', 'projectie_aow',
-                      'projectie_premie_franchise', 'projectie_premie_plafond',
-                      'projectie_op', 'projectie_op_plus_pv',
-                      'projectie_op_plus_pv_aow', 'projectie_op_wg',
-                      'projectie_op_wn', 'tar_NPLLRS', 'tar_OPLL',
-                      'cum_eigen_bijdrage', 'capital']
-        return summary[final_cols]
+        return summarize_tableau(self.data, self.scenario_index, tableau)
+
+
+def employee_claims(data, ids=None, regeling_ids=None):
+    """ Return frame with 1 record per employee x claim
+
+    Parameters
+    ----------
+    data         : named tuple from read_xlswb, with tbl_employee indexed
+        by id and tbl_pension_plan by (regeling_id, aanspraak)
+    ids          : list of employee ids or None (all employees)
+    regeling_ids : list of pension plan ids or None (all plans)
+
+    Returns
+    -------
+    empxclm : DataFrame
+        employee and claim attributes plus pension date, future, past and
+        total service years, age at calculation date and number of
+        projection years, sorted by id, regeling_id, aanspraak
+    """
+    assumption = [assumption for assumption in
+                  data.tbl_assumption.itertuples(index=False)][0]
+    employees = data.tbl_employee
+    if ids is not None:
+        employees = employees.loc[ids]
+    emp = employees.reset_index()
+    clm = data.tbl_pension_plan.reset_index()
+    if regeling_ids is not None:
+        clm = clm[clm.regeling_id.isin(regeling_ids)]
+    emp['ones'], clm['ones'] = 1, 1
+    empxclm = pd.merge(left=emp, right=clm, on='ones').drop('ones', axis=1)
+    cols = ['id', 'regeling_id', 'aanspraak']
+    empxclm = empxclm[cols + [col for col in empxclm.columns
+                              if col not in cols]]
+    empxclm = empxclm.sort_values(cols).reset_index(drop=True)
+
+    empxclm['pensioendatum'] = pensiondate(empxclm.geboortedatum,
+                                           empxclm.pensioenlfd)
+    empxclm['fsy0'] = future_service_years(assumption.rekendatum,
+                                           empxclm.pensioendatum)
+    empxclm['psy0'] = past_service_years(empxclm.datum_in_dienst,
+                                         assumption.rekendatum, method='PwC')
+    empxclm['tsy'] = total_service_years(empxclm.psy0, empxclm.fsy0)
+    empxclm['leeftijd0'] = age(empxclm.pensioenlfd, empxclm.fsy0).astype(int)
+    empxclm['leeftijd0_adjusted'] = (empxclm.leeftijd0 +
+                                     assumption.age_adjustment)
+    empxclm['nprojectionyears'] = roundup(empxclm.fsy0)
+    return enforce_dtypes(empxclm)
+
+
+def diff_data(old, new):
+    """ Return (ids, regeling_ids) of employees and pension plans that
+    differ between old and new data (changed, added or removed), or None
+    if anything else (assumptions, lookup tables, columns) differs
+    """
+    for name in old._fields:
+        if name in ['tbl_employee', 'tbl_pension_plan', 'lookup_arrays']:
+            continue
+        if not getattr(old, name).equals(getattr(new, name)):
+            return None
+    ids = changed_rows(old.tbl_employee, new.tbl_employee)
+    plans = changed_rows(old.tbl_pension_plan, new.tbl_pension_plan)
+    if ids is None or plans is None:
+        return None
+    return (ids.unique(), plans.get_level_values('regeling_id').unique())
+
+
+def changed_rows(old, new):
+    """ Return index of rows that differ between old and new table
+    (changed, added or removed), or None if the columns differ
+    """
+    if list(old.columns) != list(new.columns):
+        return None
+    index = old.index.union(new.index)
+    old, new = old.reindex(index), new.reindex(index)
+    same = ((old == new) | (old.isna() & new.isna())).all(axis=1)
+    return index[~same.values]
+
+
+def splice(frame, slices, ids, regeling_ids):
+    """ Return frame (tableau or summary) with rows of given employees
+    and pension plans replaced by slices, sorted by id, regeling_id
+
+    If the new rows match the replaced rows one to one (e.g. after a
+    salary change), they are written in place, otherwise the frame is
+    rebuilt.
+    """
+    replaced = (frame.id.isin(ids) | frame.regeling_id.isin(regeling_ids))
+    positions = np.flatnonzero(replaced.values)
+    new = pd.concat(slices, ignore_index=True) if slices else frame.iloc[:0]
+    new = new.sort_values(['id', 'regeling_id'], kind='mergesort')
+    keys = [col for col in ['id', 'regeling_id', 'aanspraak', 'simulnr',
+                            'BOY'] if col in frame.columns]
+    if (len(new) == len(positions) and
+            (frame[keys].iloc[positions].values == new[keys].values).all()):
+        for col in frame.columns:
+            frame.iloc[positions, frame.columns.get_loc(col)] = (
+              new[col].values)
+        return frame
+    frame = pd.concat([frame[~replaced], new], ignore_index=True)
+    return frame.sort_values(['id', 'regeling_id'],
+                             kind='mergesort').reset_index(drop=True)
+
+
+def enforce_dtypes(frame, dtypes=TABLEAU_DTYPES):
+    """ Return frame with columns cast to given dtypes
+
+    Raises ValueError if a column can not be cast, e.g. text in a numeric
+    column.
+    """
+    dtypes = {col: dtype for col, dtype in dtypes.items()
+              if col in frame.columns and frame[col].dtype != dtype}
+    return frame.astype(dtypes) if dtypes else frame
+
+
+def categories(data):
+    """ Return dict of sorted labels of CATEGORICAL_COLUMNS in employee and
+    pension plan tables
+    """
+    tables = [data.tbl_employee.reset_index(),
+              data.tbl_pension_plan.reset_index()]
+    return {col: sorted(table[col].unique()) for table in tables
+            for col in CATEGORICAL_COLUMNS if col in table.columns}
+
+
+def to_categorical(frame, categories):
+    """ Return frame with columns cast to categoricals with given
+    categories (the same for every batch of employees)
+    """
+    dtypes = {col: pd.CategoricalDtype(labels)
+              for col, labels in categories.items() if col in frame.columns}
+    return frame.astype(dtypes)
+
+
+def check_dtypes(tab, dtypes=TABLEAU_DTYPES):
+    """ Raise TypeError if tableau columns do not have the given dtypes
+    (e.g. object columns from a badly filled workbook)
+    """
+    wrong = ['{} ({}, expected {})'.format(col, tab[col].dtype,
+                                           np.dtype(dtype))
+             for col, dtype in dtypes.items()
+             if col in tab.columns and tab[col].dtype != dtype]
+    if wrong:
+        raise TypeError('Tableau column(s) with wrong dtype: ' +
+                        ', '.join(wrong))
+
+
+def scenario_indices(data, nsimuls):
+    """ Return dict of ScenarioIndex's, keyed by name of lookup table with
+    scenarios (simulnr index level)
+    """
+    return {name: ScenarioIndex.from_table(getattr(data, name), nsimuls)
+            for name in SCENARIO_TABLES}
+
+
+def is_deterministic(scenario_index):
+    """ Return True if all lookup tables in scenario_index (see
+    scenario_indices) have 1 scenario
+    """
+    return all(index.nscenarios == 1 for index in scenario_index.values())
+
+
+# ----- worker processes for Tableau(..., n_jobs=n) -------------------------
+
+_worker_tableau = None
+
+
+def _init_worker(tableau):
+    """ Keep (read only) tableau with lookup tables in worker process
+
+    tableau holds the data only (see Tableau._worker_copy). With the fork
+    start method the worker inherits the parent's memory, so the lookup
+    tables are shared instead of pickled; with spawn / forkserver they are
+    pickled once per worker.
+    """
+    global _worker_tableau
+    _worker_tableau = tableau
+
+
+def _summarize_chunk(ids):
+    """ Return summary for given employee ids and the records of the
+    stages run for it (runs in worker process)
+    """
+    _worker_tableau.instrument.reset()
+    summary = _worker_tableau._project(ids)
+    return summary, _worker_tableau.instrument.report.records
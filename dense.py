@@ -0,0 +1,332 @@
+"""
+Dense projection engine
+
+Same projections as codex.Tableau, but the state is held in NumPy arrays
+shaped (employee x claim, simulation, year) instead of one pandas row per
+employee x claim x simulation x year. Employees with fewer projection years
+are padded at the end of the year axis, so every cumulative index and
+cumulative sum becomes a plain cumprod / cumsum along the last axis. The
+DC capital is accumulated year by year instead (see
+vectorize.accumulate_capital).
+"""
+import numpy as np
+from codex import (employee_claims, enforce_dtypes, is_deterministic,
+                   scenario_indices)
+from load import read_xlswb
+from running import (DB_CLAIMS, DC_CLAIMS, PENSIONDATE_COLUMNS, summarize,
+                     tile_simulations)
+from settings import XLSWB
+from vectorize import accumulate_capital, ft_base, employee_contribution
+
+
+class DenseTableau:
+    """ Benefit projections on dense (claim x simulation x year) arrays
+    """
+
+    def __init__(self, xlswb=XLSWB, nsimuls=1, maxyears=None,
+                 cache_dir=None, annuity_factors=None):
+        self.xlswb = xlswb
+        self.cache_dir = cache_dir
+        self.annuity_factors = annuity_factors
+        self.nsimuls = nsimuls
+        self.maxyears = maxyears
+        self.data = self._read()
+        self.scenario_index = scenario_indices(self.data, nsimuls)
+        self.claims = self._expand()
+        self.state = self.create()
+
+    def _read(self):
+        """ Return named tuple with sheets from given workbook,
+        employees indexed by id and pension plans by (regeling_id, aanspraak),
+        cast to TABLEAU_DTYPES (with stochastic lookup_tar_at_pensionage
+        if annuity_factors is given, see codex.Tableau._read)
+        """
+        data = read_xlswb(self.xlswb, cache_dir=self.cache_dir)
+        if self.annuity_factors is not None:
+            data = self.annuity_factors.apply(data)
+        data.tbl_employee.set_index('id', inplace=True)
+        data.tbl_pension_plan.set_index(['regeling_id', 'aanspraak'],
+                                        inplace=True)
+        return data._replace(
+          tbl_employee=enforce_dtypes(data.tbl_employee),
+          tbl_pension_plan=enforce_dtypes(data.tbl_pension_plan))
+
+    def _expand(self):
+        """ Return frame with 1 record per employee x claim
+        """
+        return employee_claims(self.data)
+
+    def _years(self):
+        """ Return BOY vector (1, 2, ..., max. number of projection years)
+        """
+        return np.arange(1, self.claims.nprojectionyears.max() + 1)
+
+    def _lookup_increments(self):
+        """ Return dict of (cumulative) indices, shaped (claims, sims, years)
+
+        Lookups from scenario tables with only 1 simulation keep a
+        simulation axis of length 1 and are broadcast later on.
+        """
+        assumption = [assumption for assumption in
+                      self.data.tbl_assumption.itertuples(index=False)][0]
+        claims = self.claims
+        boy = self._years()
+        fsy = claims.fsy0.values[:, None] - boy + 1
+        leeftijd = claims.pensioenlfd.values[:, None] - fsy
+        leeftijd_low = leeftijd.astype(np.int32)
+        leeftijd_low_adjusted = leeftijd_low + assumption.age_adjustment
+
+        arrays = self.data.lookup_arrays
+
+        def scenarios(name):
+            return self.scenario_index[name].axis()[None, :, None]
+
+        # keys shaped (claims, sims, years)
+        boy_ = boy[None, None, :]
+        leeftijd_low_ = leeftijd_low[:, None, :]
+
+        def attr(column):
+            return claims[column].values[:, None, None]
+
+        state = {'BOY': boy_,
+                 'fsy': fsy[:, None, :],
+                 'leeftijd': leeftijd[:, None, :],
+                 'leeftijd_low': leeftijd_low_}
+
+        # inflation
+        state['pct_prijsinflatie_primo'] = arrays['lookup_inflation'].lookup(
+          boy_, scenarios('lookup_inflation'))
+
+        # salary increase
+        state['pct_salstijging_primo'] = (
+          arrays['lookup_salincrease'].lookup(
+            leeftijd_low_, scenarios('lookup_salincrease'))
+          )
+
+        # indexation (actives & inactives)
+        state['pct_indexatie_primo'] = arrays['lookup_indexation'].lookup(
+          'actief', boy_, scenarios('lookup_indexation'))
+        state['pct_indexatie_primo_inactief'] = (
+          arrays['lookup_indexation'].lookup(
+            'inactief', boy_, scenarios('lookup_indexation'))
+          )
+
+        # intrest
+        state['pct_rente_ultimo'] = arrays['lookup_intrest'].lookup(
+          boy_, scenarios('lookup_intrest'))
+
+        # return
+        state['pct_rendement_ultimo'] = arrays['lookup_return'].lookup(
+          attr('leeftijd0'), boy_, scenarios('lookup_return'))
+
+        # nqx
+        state['nqx_primo'] = arrays['lookup_nqx'].lookup(
+          attr('geslacht'), attr('leeftijd0_adjusted'),
+          leeftijd_low_adjusted[:, None, :])
+
+        # tariff
+        state['tarief_primo'] = arrays['lookup_tariff'].lookup(
+          attr('tarief_id'), attr('aanspraak'), attr('geslacht'),
+          leeftijd_low_)
+
+        # cumulative indices
+        for col in ['pct_prijsinflatie_primo', 'pct_salstijging_primo',
+                    'pct_indexatie_primo', 'pct_indexatie_primo_inactief',
+                    'pct_rente_ultimo', 'pct_rendement_ultimo']:
+            state[col + '_idx'] = cumulative_index(state[col])
+        state['nqx_primo_idx'] = cumulative_index(state['nqx_primo'],
+                                                  sign=-1)
+        for col in ['pct_indexatie_primo_idx', 'pct_rente_ultimo_idx',
+                    'pct_rendement_ultimo_idx', 'nqx_primo_idx']:
+            state[col + '_shifted'] = shift(state[col], fill=1)
+        return state
+
+    def _run_projections(self, state):
+        """ Add benefit projections to state
+        """
+        assumption = [assumption for assumption in
+                      self.data.tbl_assumption.itertuples(index=False)][0]
+        claims = self.claims
+
+        def attr(column):
+            return claims[column].values[:, None, None]
+
+        infl_idx = state['pct_prijsinflatie_primo_idx']
+        pt_percentage = attr('pt_percentage')
+        percentage = attr('percentage')
+        boy = state['BOY']
+
+        state['psy'] = attr('psy0') + boy
+        state['premie_franchise'] = attr('premie_franchise') * infl_idx
+        state['premie_plafond'] = attr('premie_plafond') * infl_idx
+        state['aow'] = assumption.aow * infl_idx
+        state['ft_salaris'] = (attr('ft_salaris') *
+                               state['pct_salstijging_primo_idx'])
+        ft_premiegrondslag = ft_base(state['ft_salaris'],
+                                     state['premie_franchise'],
+                                     state['premie_plafond'])
+        state['eigen_bijdrage'] = employee_contribution(
+          ft_premiegrondslag, attr('pct_eigen_bijdrage'), pt_percentage)
+        pro_rata = np.minimum(state['fsy'], 1)
+
+        rente_idx = state['pct_rente_ultimo_idx']
+        state['cum_eigen_bijdrage'] = rente_idx * np.cumsum(
+          state['eigen_bijdrage'] / state['pct_rente_ultimo_idx_shifted'],
+          axis=-1)
+
+        franchise = attr('franchise') * infl_idx
+        max_salaris = attr('max_salaris') * infl_idx
+        pt_pensioengrondslag = pt_percentage * ft_base(state['ft_salaris'],
+                                                       franchise,
+                                                       max_salaris)
+
+        # DB
+        defined_benefit = claims.aanspraak.isin(DB_CLAIMS).values
+        avg_pay = (defined_benefit &
+                   (claims.type_regeling == 'ML').values)[:, None, None]
+        final_pay = (defined_benefit &
+                     (claims.type_regeling == 'EL').values)[:, None, None]
+
+        # average pay
+        inkoop_ml = pro_rata * percentage * pt_pensioengrondslag
+        idx_shifted = state['pct_indexatie_primo_idx_shifted']
+        tijdsevenredig_ml = idx_shifted * np.cumsum(inkoop_ml / idx_shifted,
+                                                    axis=-1)
+
+        # final pay
+        # (sic) full time pension base in first year, like Tableau
+        pt_pensioengrondslag0 = ft_base(attr('ft_salaris'),
+                                        attr('franchise'),
+                                        attr('max_salaris'))
+        pt_pensioengrondslag0 = np.broadcast_to(
+          pt_pensioengrondslag0, pt_pensioengrondslag[..., :1].shape)
+        pt_pensioengrondslag_shifted = np.concatenate(
+          [pt_pensioengrondslag0, pt_pensioengrondslag[..., :-1]], axis=-1)
+        backservice_el = (
+          np.maximum(0, state['psy'] - 1) * percentage *
+          np.maximum(0, pt_pensioengrondslag - pt_pensioengrondslag_shifted)
+          )
+        opbouw_el = percentage * pt_pensioengrondslag + backservice_el
+        tijdsevenredig_el = np.cumsum(opbouw_el, axis=-1)
+
+        state['tijdsevenredig'] = (
+          np.where(avg_pay, tijdsevenredig_ml, 0) +
+          np.where(final_pay, tijdsevenredig_el, 0)
+          )
+
+        # DC
+        defined_contribution = (
+          claims.aanspraak.isin(DC_CLAIMS).values[:, None, None]
+          )
+        rendement = state['pct_rendement_ultimo']
+        timing_investments = 1 - assumption.timing_belegging
+        eur_premie_dc = (pro_rata * state['tarief_primo'] * percentage *
+                         pt_pensioengrondslag)
+        capital = accumulate_capital(eur_premie_dc, rendement,
+                                     state['nqx_primo'], timing_investments)
+        capital[~defined_contribution[:, 0, 0]] = 0
+        state['capital'] = capital
+        return state
+
+    def create(self):
+        state = self._lookup_increments()
+        return self._run_projections(state)
+
+    def at_pensiondate(self, name):
+        """ Return state variable at last projection year, shaped
+        (claims, sims)
+        """
+        arr = self.state[name]
+        arr = np.broadcast_to(arr, (len(self.claims), self.nsimuls,
+                                    arr.shape[-1]))
+        last = self.claims.nprojectionyears.values - 1
+        return arr[np.arange(len(last)), :, last]
+
+    def to_frame(self, columns=None):
+        """ Return state in long format: 1 record per employee x claim x
+        simulation x projection year (like Tableau.tableau)
+        """
+        claims = self.claims
+        columns = columns or list(self.state)
+        nyears = len(self._years())
+        shape = (len(claims), self.nsimuls, nyears)
+        valid = np.broadcast_to(
+          self.state['BOY'] <= claims.nprojectionyears.values[:, None, None],
+          shape).ravel()
+        index = np.broadcast_to(np.arange(len(claims))[:, None, None],
+                                shape).ravel()[valid]
+        frame = claims.iloc[index][['id', 'regeling_id',
+                                    'aanspraak']].reset_index(drop=True)
+        frame['simulnr'] = np.broadcast_to(
+          np.arange(1, self.nsimuls + 1, dtype=np.int32)[None, :, None],
+          shape).ravel()[valid]
+        for column in columns:
+            frame[column] = np.broadcast_to(self.state[column],
+                                            shape).ravel()[valid]
+        return frame
+
+    def add_summary(self):
+        """ Return summary: 1 record per employee x plan x simulation
+        """
+        at_pensiondate = {name: self.at_pensiondate(name)
+                          for name in PENSIONDATE_COLUMNS}
+        return summarize(self.data, self.claims, self.nsimuls,
+                         self.scenario_index, at_pensiondate)
+
+
+class DeterministicTableau(DenseTableau):
+    """ Dense projections of a deterministic workbook
+
+    If every lookup table has 1 scenario, all simulations are identical.
+    The projection is done once, on (employee x claim, year) vectors, and
+    nsimuls only sets the number of simulation records in the summary, so
+    the cost does not depend on nsimuls. Raises ValueError for a workbook
+    with scenarios (use DenseTableau).
+    """
+
+    def __init__(self, xlswb=XLSWB, nsimuls=1, maxyears=None,
+                 cache_dir=None, annuity_factors=None):
+        self.summary_nsimuls = nsimuls
+        super().__init__(xlswb=xlswb, nsimuls=1, maxyears=maxyears,
+                         cache_dir=cache_dir,
+                         annuity_factors=annuity_factors)
+
+    def _read(self):
+        data = super()._read()
+        if not is_deterministic(scenario_indices(data, 1)):
+            raise ValueError('{} has lookup tables with more than 1 '
+                             'scenario, use DenseTableau'.format(self.xlswb))
+        return data
+
+    def vector(self, name):
+        """ Return state variable shaped (employee x claim, year)
+        """
+        arr = self.state[name]
+        return np.broadcast_to(arr, (len(self.claims), 1,
+                                     arr.shape[-1]))[:, 0, :]
+
+    def add_summary(self):
+        """ Return summary: 1 record per employee x plan x simulation
+        (nsimuls identical simulations)
+        """
+        return tile_simulations(super().add_summary(), self.summary_nsimuls)
+
+
+def cumulative_index(arr, sign=1):
+    """ Return cumulative index along year axis
+
+    Parameters
+    ----------
+    arr  : numpy array, last axis is projection year
+    sign : 1 for (1 + arr).cumprod(), -1 for (1 - arr).cumprod()
+    """
+    return np.cumprod(1 + sign * arr, axis=-1)
+
+
+def shift(arr, fill=0):
+    """ Shift 1 position forward along year axis, filling first year
+    """
+    shifted = np.empty_like(arr)
+    shifted[..., 0] = fill
+    shifted[..., 1:] = arr[..., :-1]
+    return shifted
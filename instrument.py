@@ -0,0 +1,135 @@
+"""
+Instrumentation of the projection pipeline
+
+Each stage (reading a sheet, expanding the tableau, the lookups, the
+projections, the summary) is run through Instrument.run, which records
+its wall time, the peak resident memory of the process after the stage
+and the number of rows and bytes of its result. The records are collected
+in a Report, passed to an optional callback and logged (logger 'codex',
+level INFO).
+"""
+import logging
+import sys
+import time
+from collections import namedtuple
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = logging.getLogger('codex')
+
+StageRecord = namedtuple('StageRecord', ['stage', 'seconds', 'peak_rss_mb',
+                                         'rows', 'nbytes'])
+
+
+def peak_rss_mb():
+    """ Return peak resident memory of this process in MB (NaN if unknown)
+    """
+    if resource is None:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def size(result):
+    """ Return (rows, bytes) of result of a stage: DataFrames and named
+    tuples of DataFrames (like read_xlswb's), None otherwise
+    """
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return len(result), int(result.memory_usage(index=True).sum())
+    if isinstance(result, tuple) and hasattr(result, '_fields'):
+        frames = [value for value in result
+                  if isinstance(value, (pd.DataFrame, pd.Series))]
+        if frames:
+            sizes = [size(frame) for frame in frames]
+            return tuple(sum(values) for values in zip(*sizes))
+    return None, None
+
+
+class Report:
+    """ Records of the stages run so far, in order
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def append(self, record):
+        self.records.append(record)
+
+    def to_frame(self):
+        """ Return records as frame, 1 row per stage
+        """
+        return pd.DataFrame.from_records(self.records,
+                                         columns=StageRecord._fields)
+
+    def totals(self):
+        """ Return frame with total seconds, number of runs and max. peak
+        RSS per stage
+        """
+        stages = self.to_frame().groupby('stage', sort=False)
+        return pd.DataFrame({'seconds': stages.seconds.sum(),
+                             'runs': stages.seconds.size(),
+                             'peak_rss_mb': stages.peak_rss_mb.max()},
+                            columns=['seconds', 'runs', 'peak_rss_mb'])
+
+    def __str__(self):
+        if not self.records:
+            return 'Report (no stages run)'
+        return self.to_frame().to_string(
+          index=False, float_format='{:.3f}'.format)
+
+
+class Instrument:
+    """ Run stages, recording each in report
+
+    Parameters
+    ----------
+    callback : function called with the StageRecord of each stage, or
+               None. E.g. to send the timings to a monitoring system.
+
+    Examples
+    --------
+        >>> instrument = Instrument(callback=print)
+        >>> tableau = instrument.run('_merge', tab._merge)
+        >>> instrument.report.to_frame()
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.report = Report()
+
+    def run(self, stage, func, *args, **kwargs):
+        """ Return func(*args, **kwargs), recording stage
+        """
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        rows, nbytes = size(result)
+        self.record(StageRecord(stage, seconds, peak_rss_mb(), rows, nbytes))
+        return result
+
+    def record(self, record):
+        """ Add record (StageRecord) to report, e.g. of a stage run in a
+        worker process
+        """
+        self.report.append(record)
+        logger.info('%s: %.3f s, peak RSS %.0f MB, %s rows',
+                     record.stage, record.seconds, record.peak_rss_mb,
+                     record.rows)
+        if self.callback is not None:
+            self.callback(record)
+
+    def reset(self):
+        """ Start a new report
+        """
+        self.report = Report()
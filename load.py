@@ -1,70 +1,256 @@
 """
 Read Excel workbook containing tables with employees, assumptions,
 pension plans and various lookup tables
+
+Instead of an Excel workbook, a directory containing one file per sheet
+(<sheet name>.parquet or <sheet name>.csv) can be read as well. This is
+convenient for large scenario sets (e.g. 2001 simulation columns).
 """
+import hashlib
+import importlib.util
+import logging
+import os
+import pickle
 import pandas as pd
 from collections import namedtuple
-from utils import stack_lookup_table, calculate_portfolio_return
+from instrument import Instrument
+from utils import (stack_lookup_table, calculate_portfolio_return,
+                   LookupArray)
+
+
+Data = namedtuple('Data', ['tbl_employee', 'tbl_assumption',
+                           'tbl_pension_plan', 'lookup_inflation',
+                           'lookup_salincrease', 'lookup_indexation',
+                           'lookup_intrest', 'lookup_lifecycle',
+                           'lookup_return_stocks', 'lookup_return_bonds',
+                           'lookup_tar_at_pensionage', 'lookup_nqx',
+                           'lookup_tariff', 'lookup_return',
+                           'lookup_arrays'])
+
+# lookup sheets with keyword arguments for read_sheet. Tables are selected
+# by the ids in tbl_assumptie (see select_lookups).
+LOOKUP_SHEETS = {
+  'lookup_prijsinflatie': {'converters': {'jaar': int}},
+  'lookup_salarisstijging': {},
+  'lookup_indexatie': {},
+  'lookup_rente': {},
+  'lookup_lifecycle': {},
+  'lookup_rendement_aandelen': {},
+  'lookup_rendement_obligaties': {},
+  'lookup_tar_at_pensionage': {'converters': {'pensioenlfd': int,
+                                              'leeftijd': int}},
+  'lookup_nqx': {},
+  'lookup_tarief': {}}
+
+# optional packages, one of which pandas needs for parquet files
+PARQUET_ENGINES = ['pyarrow', 'fastparquet']
+
+CACHE_VERSION = 2  # increment when parse_xlswb output changes
+
+logger = logging.getLogger('codex')
 
 
-def read_xlswb(xlswb):
+def read_xlswb(xlswb, cache_dir=None, instrument=None):
     """ Read sheets from given Excel workbook.
 
+    Parameters
+    ----------
+    xlswb     : str
+        path to Excel workbook or directory with one file per sheet
+    cache_dir : str or None
+        directory for caching the parsed workbook. The cache is keyed on
+        the workbook contents (so also on the assumption ids selected in
+        tbl_assumptie), which invalidates it as soon as the workbook
+        changes.
+    instrument : instrument.Instrument or None
+        records reading each sheet (see parse_xlswb)
+
     Return
     ------
     Named tuple containing sheets read from xlswb
     """
+    if cache_dir is None:
+        return parse_xlswb(xlswb, instrument)
+
+    cached = os.path.join(cache_dir, workbook_hash(xlswb) + '.pck')
+    if os.path.exists(cached):
+        logger.info('Reading cached workbook %s', cached)
+        with open(cached, 'rb') as f:
+            return pickle.load(f)
+
+    data = parse_xlswb(xlswb, instrument)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = cached + '.tmp{}'.format(os.getpid())
+    with open(tmp, 'wb') as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, cached)
+    return data
+
 
-    Data = namedtuple('Data', ['tbl_employee', 'tbl_assumption',
-                               'tbl_pension_plan', 'lookup_inflation',
-                               'lookup_salincrease', 'lookup_indexation',
-                               'lookup_intrest', 'lookup_lifecycle',
-                               'lookup_return_stocks', 'lookup_return_bonds',
-                               'lookup_tar_at_pensionage', 'lookup_nqx',
-                               'lookup_tariff', 'lookup_return'])
+def workbook_hash(xlswb):
+    """ Return hex digest of workbook contents (and cache format version)
+    """
+    digest = hashlib.sha256()
+    digest.update('{}-{}'.format(CACHE_VERSION, pd.__version__).encode())
+    if os.path.isdir(xlswb):
+        paths = [os.path.join(xlswb, name)
+                 for name in sorted(os.listdir(xlswb))]
+    else:
+        paths = [xlswb]
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def read_sheet(xlswb, sheet_name, **kwargs):
+    """ Read sheet from Excel workbook or directory with one file per sheet
+
+    Parameters
+    ----------
+    xlswb      : str
+        path to Excel workbook or directory
+    sheet_name : str
+        looked up as <sheet_name>.parquet or <sheet_name>.csv in a directory
+    kwargs     : keyword arguments of pd.read_excel (like converters,
+        index_col, true_values) that are also supported by pd.read_csv
+
+    Returns
+    -------
+    df : DataFrame
+    """
+    if not os.path.isdir(xlswb):
+        return pd.read_excel(xlswb, sheet_name=sheet_name, **kwargs)
+
+    path = os.path.join(xlswb, sheet_name)
+    if os.path.exists(path + '.parquet'):
+        check_parquet_engine()
+        df = pd.read_parquet(path + '.parquet')
+        for col, converter in kwargs.get('converters', {}).items():
+            df[col] = df[col].map(converter)
+        if kwargs.get('index_col') is not None:
+            df.set_index(df.columns[kwargs['index_col']], inplace=True)
+        return df
+    if os.path.exists(path + '.csv'):
+        return pd.read_csv(path + '.csv', **kwargs)
+    raise FileNotFoundError('No {0}.parquet or {0}.csv in {1}'.
+                            format(sheet_name, xlswb))
+
+
+def check_parquet_engine():
+    """ Raise ImportError if none of PARQUET_ENGINES is installed
+    """
+    if not any(importlib.util.find_spec(engine) is not None
+               for engine in PARQUET_ENGINES):
+        raise ImportError('Reading or writing parquet files requires {} '
+                          '(pip install pyarrow)'.format(
+                            ' or '.join(PARQUET_ENGINES)))
+
+
+def export_xlswb(xlswb, directory, fmt='csv'):
+    """ Write every sheet of given Excel workbook to directory, one file
+    per sheet (fmt 'csv' or 'parquet'), for reading with read_xlswb
+    """
+    if fmt == 'parquet':
+        check_parquet_engine()
+    os.makedirs(directory, exist_ok=True)
+    for sheet_name, df in pd.read_excel(xlswb, sheet_name=None).items():
+        path = os.path.join(directory, '{}.{}'.format(sheet_name, fmt))
+        if fmt == 'parquet':
+            df.columns = [str(col) for col in df.columns]
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False)
+
+
+def parse_xlswb(xlswb, instrument=None):
+    """ Parse sheets from given Excel workbook.
+
+    Reading each sheet is a stage 'read_sheet.<sheet name>' of instrument
+    (if None, a new Instrument only logs them).
+
+    Return
+    ------
+    Named tuple containing sheets read from xlswb
+    """
+    if instrument is None:
+        instrument = Instrument()
+
+    def read(sheet_name, **kwargs):
+        return instrument.run('read_sheet.' + sheet_name, read_sheet,
+                              xlswb, sheet_name=sheet_name, **kwargs)
 
     # ---------- read data ------------------------------------------
-    print('Reading data ...',)
-    print('tbl_deelnemer')
+    logger.info('Reading data from %s', xlswb)
     # tbl_deelnemer : read only records where (aan == True)
-    tbl_employee = pd.read_excel(xlswb, sheet_name='tbl_deelnemer',
-                                 true_values=['TRUE'])
+    tbl_employee = read(sheet_name='tbl_deelnemer',
+                        true_values=['TRUE'])
     tbl_employee = (tbl_employee[tbl_employee.aan == True].
                     drop(labels='aan', axis=1))
     # date: convert format Timestamp to format datetime
-    tbl_employee['geboortedatum'] = tbl_employee.geboortedatum.dt.date
-    tbl_employee['datum_in_dienst'] = tbl_employee.datum_in_dienst.dt.date
+    tbl_employee['geboortedatum'] = (
+      pd.to_datetime(tbl_employee.geboortedatum).dt.date)
+    tbl_employee['datum_in_dienst'] = (
+      pd.to_datetime(tbl_employee.datum_in_dienst).dt.date)
 
     # tbl_assumptie: read 1 line
-    print('tbl_assumptie')
-    tbl_assumption = pd.read_excel(xlswb, sheet_name='tbl_assumptie')
+    tbl_assumption = read(sheet_name='tbl_assumptie')
     # date: convert format Timestamp to format datetime
-    tbl_assumption['rekendatum'] = tbl_assumption.rekendatum.dt.date
+    tbl_assumption['rekendatum'] = (
+      pd.to_datetime(tbl_assumption.rekendatum).dt.date)
 
     # tbl_regeling & tbl_aanspraak: inner join these tables
     # into tbl_pension_plan
-    print('tbl_regeling')
-    tbl_plan = pd.read_excel(xlswb, sheet_name='tbl_regeling',
-                             true_values=['TRUE'], index_col=0)
+    tbl_plan = read(sheet_name='tbl_regeling',
+                    true_values=['TRUE'], index_col=0)
     tbl_plan = tbl_plan[tbl_plan.aan == True].drop(labels='aan', axis=1)
-    print('tbl_aanspraak')
-    tbl_claim = pd.read_excel(xlswb, sheet_name='tbl_aanspraak',
-                              true_values=['TRUE'])
+    tbl_claim = read(sheet_name='tbl_aanspraak',
+                     true_values=['TRUE'])
     tbl_claim = tbl_claim[tbl_claim.aan == True].drop(labels='aan', axis=1)
     tbl_pension_plan = tbl_claim.join(tbl_plan, on='regeling_id',
                                       how='inner')
-    print('OK\n')
 
     # ----------- read lookup tables --------------------------------
 
-    print('Reading lookup tables ...')
+    logger.info('Reading lookup tables')
+    sheets = read_lookup_sheets(xlswb, instrument)
+    lookups = select_lookups(sheets, tbl_assumption, instrument)
+    data = Data(tbl_employee, tbl_assumption, tbl_pension_plan,
+                lookup_arrays=None, **lookups)
+
+    return data._replace(lookup_arrays=instrument.run(
+      'build_lookup_arrays', build_lookup_arrays, data))
+
+
+def read_lookup_sheets(xlswb, instrument=None):
+    """ Return dict of lookup sheets (LOOKUP_SHEETS) with the tables of
+    all omschrijving_id's, keyed by sheet name
+
+    Reading each sheet is a stage 'read_sheet.<sheet name>' of instrument.
+    """
+    if instrument is None:
+        instrument = Instrument()
+    return {sheet_name: instrument.run('read_sheet.' + sheet_name,
+                                       read_sheet, xlswb,
+                                       sheet_name=sheet_name, **kwargs)
+            for sheet_name, kwargs in LOOKUP_SHEETS.items()}
+
+
+def select_lookups(sheets, tbl_assumption, instrument=None):
+    """ Return dict of lookup tables (fields of Data, without
+    lookup_arrays) selected from sheets (see read_lookup_sheets) by the
+    ids in tbl_assumption
+
+    Call build_lookup_arrays after replacing the lookup tables in data.
+    """
+    if instrument is None:
+        instrument = Instrument()
 
     # lookup_prijsinflatie : read (omschrijving_id ==
     # tbl_assumptie.prijsinflatie_id) & index on jaar
-    print('lookup_prijsinflatie')
-    lookup_inflation = pd.read_excel(xlswb,
-                                     sheet_name='lookup_prijsinflatie',
-                                     converters={'jaar': int})
+    lookup_inflation = sheets['lookup_prijsinflatie']
     selection = (lookup_inflation.omschrijving_id ==
                  tbl_assumption.prijsinflatie_id.values[0])
     lookup_inflation = (lookup_inflation[selection].
@@ -75,8 +261,7 @@ def read_xlswb(xlswb):
 
     # lookup_salarisstijging : read (omschrijving_id ==
     # tbl_assumptie.salarisstijging_id) & index on leeftijd
-    print('lookup_salarisstijging')
-    lookup_salincrease = pd.read_excel(xlswb, sheet_name='lookup_salarisstijging')
+    lookup_salincrease = sheets['lookup_salarisstijging']
     selection = (lookup_salincrease.omschrijving_id ==
                  tbl_assumption.salarisstijging_id.values[0])
     lookup_salincrease = (lookup_salincrease[selection].
@@ -87,9 +272,7 @@ def read_xlswb(xlswb):
 
     # lookup_indexatie : read (omschrijving_id ==
     # tbl_assumptie.indexatie_id) & index on (status, jaar)
-    print('lookup_indexatie')
-    lookup_indexation = pd.read_excel(xlswb,
-                                      sheet_name='lookup_indexatie')
+    lookup_indexation = sheets['lookup_indexatie']
     selection = (lookup_indexation.omschrijving_id ==
                  tbl_assumption.indexatie_id.values[0])
     lookup_indexation = (lookup_indexation[selection].
@@ -100,8 +283,7 @@ def read_xlswb(xlswb):
 
     # lookup_rente : read (omschrijving_id ==
     # tbl_assumptie.rente_id) & index on jaar
-    print('lookup_rente')
-    lookup_intrest = pd.read_excel(xlswb, sheet_name='lookup_rente')
+    lookup_intrest = sheets['lookup_rente']
     selection = (lookup_intrest.omschrijving_id ==
                  tbl_assumption.rente_id.values[0])
     lookup_intrest = (lookup_intrest[selection].
@@ -112,10 +294,7 @@ def read_xlswb(xlswb):
 
     # lookup_lifecycle: read (omschrijving_id ==
     # tbl_assumptie.lifecycle_id) & index on leeftijd
-    print('lookup_lifecycle')
-    lookup_lifecycle = (
-      pd.read_excel(xlswb, sheet_name='lookup_lifecycle')
-      )
+    lookup_lifecycle = sheets['lookup_lifecycle']
     selection = (lookup_lifecycle.omschrijving_id ==
                  tbl_assumption.lifecycle_id.values[0])
     lookup_lifecycle = (lookup_lifecycle[selection].
@@ -124,10 +303,7 @@ def read_xlswb(xlswb):
 
     # lookup_rendement_aandelen : read (omschrijving_id ==
     # tbl_assumptie.rendement_aandelen_id) & index on jaar
-    print('lookup_rendement_aandelen')
-    lookup_return_stocks = (
-      pd.read_excel(xlswb, sheet_name='lookup_rendement_aandelen')
-      )
+    lookup_return_stocks = sheets['lookup_rendement_aandelen']
     selection = (lookup_return_stocks.omschrijving_id ==
                  tbl_assumption.rendement_aandelen_id.values[0])
     lookup_return_stocks = (lookup_return_stocks[selection].
@@ -138,10 +314,7 @@ def read_xlswb(xlswb):
 
     # lookup_rendement_obligaties : read (omschrijving_id ==
     # tbl_assumptie.rendement_obligaties_id) & index on jaar
-    print('lookup_rendement_obligaties')
-    lookup_return_bonds = (
-      pd.read_excel(xlswb, sheet_name='lookup_rendement_obligaties')
-      )
+    lookup_return_bonds = sheets['lookup_rendement_obligaties']
     selection = (lookup_return_bonds.omschrijving_id ==
                  tbl_assumption.rendement_obligaties_id.values[0])
     lookup_return_bonds = (lookup_return_bonds[selection].
@@ -153,11 +326,7 @@ def read_xlswb(xlswb):
     # lookup_tar_at_pensionage : read (omschrijving_id ==
     # tbl_assumptie.tar_at_pensionage_id) &
     # index on leeftijd (*pensioenlfd*, geslacht, *aanspraak_id*, leeftijd)
-    print('lookup_tar_at_pensionage')
-    lookup_tar_at_pensionage =(
-      pd.read_excel(xlswb, sheet_name='lookup_tar_at_pensionage',
-                    converters={'pensioenlfd': int, 'leeftijd': int})
-      )
+    lookup_tar_at_pensionage = sheets['lookup_tar_at_pensionage']
     selection = (lookup_tar_at_pensionage.omschrijving_id ==
                  tbl_assumption.tar_at_pensionage_id.values[0])
     lookup_tar_at_pensionage = (lookup_tar_at_pensionage[selection].
@@ -170,8 +339,7 @@ def read_xlswb(xlswb):
 
     # lookup_nqx : read (omschrijving_id ==
     # tbl_assumptie.nqx_id) & index on (geslacht, lfd_huidig, leeftijd)
-    print('lookup_nqx')
-    lookup_nqx = pd.read_excel(xlswb, sheet_name='lookup_nqx')
+    lookup_nqx = sheets['lookup_nqx']
     selection = (lookup_nqx.omschrijving_id ==
                  tbl_assumption.nqx_id.values[0])
     lookup_nqx = (lookup_nqx[selection].
@@ -181,31 +349,56 @@ def read_xlswb(xlswb):
 
     # lookup_tarief : read (omschrijving_id == tbl_assumptie.tarief_id)
     # & index on leeftijd (aanspraak, geslacht, leeftijd)
-    print('lookup_tarief')
-    lookup_tariff = pd.read_excel(xlswb, sheet_name='lookup_tarief')
+    lookup_tariff = sheets['lookup_tarief']
 
     # selection = (lookup_tariff.omschrijving_id ==
     #             tbl_assumption.tarief_id.values[0])
     # lookup_tariff = (lookup_tariff[selection].
     #                  drop(labels='omschrijving_id', axis=1))
     # Now, we also include omschrijving_id in the index!
-    lookup_tariff.set_index(['omschrijving_id', 'aanspraak',
-                             'geslacht', 'leeftijd'], inplace=True)
-    print('OK')
+    lookup_tariff = lookup_tariff.set_index(['omschrijving_id', 'aanspraak',
+                                             'geslacht', 'leeftijd'])
 
     # ----convert lifecycle, stocks/bond returns to portfolio returns -------
 
-    lookup_return = calculate_portfolio_return(lookup_lifecycle,
-                                               lookup_return_stocks,
-                                               lookup_return_bonds)
+    lookup_return = instrument.run('calculate_portfolio_return',
+                                   calculate_portfolio_return,
+                                   lookup_lifecycle, lookup_return_stocks,
+                                   lookup_return_bonds)
 
     # -----------------------------------------------------------------------
 
-    data = Data(tbl_employee, tbl_assumption, tbl_pension_plan,
-                lookup_inflation, lookup_salincrease,
-                lookup_indexation, lookup_intrest,
-                lookup_lifecycle, lookup_return_stocks,
-                lookup_return_bonds, lookup_tar_at_pensionage,
-                lookup_nqx, lookup_tariff, lookup_return)
+    return dict(lookup_inflation=lookup_inflation,
+                lookup_salincrease=lookup_salincrease,
+                lookup_indexation=lookup_indexation,
+                lookup_intrest=lookup_intrest,
+                lookup_lifecycle=lookup_lifecycle,
+                lookup_return_stocks=lookup_return_stocks,
+                lookup_return_bonds=lookup_return_bonds,
+                lookup_tar_at_pensionage=lookup_tar_at_pensionage,
+                lookup_nqx=lookup_nqx, lookup_tariff=lookup_tariff,
+                lookup_return=lookup_return)
 
-    return data
+
+def build_lookup_arrays(data):
+    """ Return dict of LookupArray's (for lookups by fancy indexing),
+    keyed by lookup table name
+
+    Call again after replacing lookup tables in data, e.g.
+    data._replace(lookup_arrays=build_lookup_arrays(data))
+    """
+    return {
+      'lookup_inflation':
+        LookupArray(data.lookup_inflation['pct_prijsinflatie_primo']),
+      'lookup_salincrease':
+        LookupArray(data.lookup_salincrease['pct_salstijging_primo']),
+      'lookup_indexation':
+        LookupArray(data.lookup_indexation['pct_indexatie_primo']),
+      'lookup_intrest': LookupArray(data.lookup_intrest['pct_rente_ultimo']),
+      'lookup_return':
+        LookupArray(data.lookup_return['pct_rendement_ultimo']),
+      'lookup_tar_at_pensionage':
+        LookupArray(data.lookup_tar_at_pensionage['tar']),
+      'lookup_nqx': LookupArray(data.lookup_nqx['nqx_primo']),
+      'lookup_tariff': LookupArray(data.lookup_tariff['tarief_primo'])
+      }
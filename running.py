@@ -0,0 +1,300 @@
+"""
+Summary-only projection
+
+Carries the running state of each employee x claim x simulation (indices,
+cumulative sums, DC capital, last pension base) from one projection year to
+the next and only keeps the values at the pension date. Memory is
+O(claims x sims) instead of O(claims x sims x years) for codex.Tableau or
+dense.DenseTableau.
+Both engines build their summary from these pension date values with
+summarize.
+"""
+import numpy as np
+import pandas as pd
+from vectorize import ft_base, employee_contribution
+
+
+DB_CLAIMS = ['OPLL', 'NPLLRS', 'NPTL-O', 'NPTL-OT']
+DC_CLAIMS = ['VARL']
+
+# state variables required for the summary, at pension date
+PENSIONDATE_COLUMNS = ['fsy', 'tijdsevenredig', 'capital',
+                       'cum_eigen_bijdrage', 'ft_salaris', 'aow',
+                       'premie_franchise', 'premie_plafond']
+
+# text columns joined into the summary
+EMPLOYEE_TEXT_COLUMNS = ['naam', 'geboortedatum']
+PLAN_TEXT_COLUMNS = ['memo']
+
+
+def project_pensiondate(data, claims, nsimuls, scenario_index):
+    """ Return dict of state variables at pension date, shaped
+    (claims, sims)
+
+    Same projections as codex.Tableau, year by year.
+
+    Parameters
+    ----------
+    data           : named tuple from read_xlswb (with lookup_arrays)
+    claims         : frame with 1 record per employee x claim, like
+        codex.employee_claims
+    nsimuls        : int
+    scenario_index : dict of ScenarioIndex's, like codex.scenario_indices
+    """
+    assumption = [assumption for assumption in
+                  data.tbl_assumption.itertuples(index=False)][0]
+    arrays = data.lookup_arrays
+    nclaims = len(claims)
+    shape = (nclaims, nsimuls)
+
+    def attr(column):
+        return np.asarray(claims[column])[:, None]
+
+    def scenarios(name):
+        return scenario_index[name].axis()[None, :]
+
+    nyears = claims.nprojectionyears.values
+    fsy0, pensioenlfd = attr('fsy0'), attr('pensioenlfd')
+    geslacht, aanspraak = attr('geslacht'), attr('aanspraak')
+    leeftijd0, psy0 = attr('leeftijd0'), attr('psy0')
+    pt_percentage, percentage = attr('pt_percentage'), attr('percentage')
+    pct_eigen_bijdrage = attr('pct_eigen_bijdrage')
+    defined_benefit = np.isin(aanspraak, DB_CLAIMS)
+    avg_pay = defined_benefit & (attr('type_regeling') == 'ML')
+    final_pay = defined_benefit & (attr('type_regeling') == 'EL')
+    defined_contribution = np.isin(aanspraak, DC_CLAIMS)
+    timing_investments = 1 - assumption.timing_belegging
+
+    # running state: cumulative indices, (discounted) cumulative sums and
+    # DC capital
+    infl_idx, sal_idx, idx, rente_idx = (np.ones(shape) for _ in range(4))
+    cum_eigen_bijdrage, cum_ml, cum_el, capital = (
+      np.zeros(shape) for _ in range(4))
+    # (sic) full time pension base in first year, like Tableau
+    pt_pensioengrondslag_shifted = np.broadcast_to(
+      ft_base(attr('ft_salaris'), attr('franchise'), attr('max_salaris')),
+      shape)
+
+    result = {name: np.full(shape, np.nan) for name in PENSIONDATE_COLUMNS}
+    for boy in range(1, nyears.max() + 1):
+        fsy = fsy0 - boy + 1
+        leeftijd = pensioenlfd - fsy
+        leeftijd_low = leeftijd.astype(np.int32)
+        leeftijd_low_adjusted = leeftijd_low + assumption.age_adjustment
+
+        # indices, previous year's indices are the shifted ones
+        idx_shifted = idx
+        rente_idx_shifted = rente_idx
+        infl_idx = infl_idx * (1 + arrays['lookup_inflation'].lookup(
+          boy, scenarios('lookup_inflation')))
+        sal_idx = sal_idx * (1 + arrays['lookup_salincrease'].lookup(
+          leeftijd_low, scenarios('lookup_salincrease')))
+        idx = idx * (1 + arrays['lookup_indexation'].lookup(
+          'actief', boy, scenarios('lookup_indexation')))
+        rente = arrays['lookup_intrest'].lookup(
+          boy, scenarios('lookup_intrest'))
+        rente_idx = rente_idx * (1 + rente)
+        rendement = arrays['lookup_return'].lookup(
+          leeftijd0, boy, scenarios('lookup_return'))
+        nqx = arrays['lookup_nqx'].lookup(
+          geslacht, attr('leeftijd0_adjusted'), leeftijd_low_adjusted)
+        tarief = arrays['lookup_tariff'].lookup(
+          attr('tarief_id'), aanspraak, geslacht, leeftijd_low)
+
+        # salaries and contributions
+        premie_franchise = attr('premie_franchise') * infl_idx
+        premie_plafond = attr('premie_plafond') * infl_idx
+        ft_salaris = attr('ft_salaris') * sal_idx
+        ft_premiegrondslag = ft_base(ft_salaris, premie_franchise,
+                                     premie_plafond)
+        eigen_bijdrage = employee_contribution(
+          ft_premiegrondslag, pct_eigen_bijdrage, pt_percentage)
+        cum_eigen_bijdrage = (cum_eigen_bijdrage +
+                              eigen_bijdrage / rente_idx_shifted)
+        pro_rata = np.minimum(fsy, 1)
+        pt_pensioengrondslag = pt_percentage * ft_base(
+          ft_salaris, attr('franchise') * infl_idx,
+          attr('max_salaris') * infl_idx)
+
+        # DB: average pay
+        inkoop_ml = pro_rata * percentage * pt_pensioengrondslag
+        cum_ml = cum_ml + inkoop_ml / idx_shifted
+
+        # DB: final pay
+        backservice_el = (
+          np.maximum(0, psy0 + boy - 1) * percentage *
+          np.maximum(0, pt_pensioengrondslag - pt_pensioengrondslag_shifted)
+          )
+        cum_el = cum_el + percentage * pt_pensioengrondslag + backservice_el
+        pt_pensioengrondslag_shifted = pt_pensioengrondslag
+
+        # DC: year recursion of vectorize.accumulate_capital
+        eur_premie_dc = pro_rata * tarief * percentage * pt_pensioengrondslag
+        capital = (capital * (1 + rendement) + eur_premie_dc *
+                   (1 + timing_investments * rendement)) / (1 - nqx)
+
+        # keep values of claims with pension date in this year
+        done = nyears == boy
+        if not done.any():
+            continue
+        values = {
+          'fsy': fsy,
+          'tijdsevenredig': (np.where(avg_pay, idx_shifted * cum_ml, 0) +
+                             np.where(final_pay, cum_el, 0)),
+          'capital': np.where(defined_contribution, capital, 0),
+          'cum_eigen_bijdrage': rente_idx * cum_eigen_bijdrage,
+          'ft_salaris': ft_salaris,
+          'aow': assumption.aow * infl_idx,
+          'premie_franchise': premie_franchise,
+          'premie_plafond': premie_plafond
+          }
+        for name, value in values.items():
+            result[name][done] = np.broadcast_to(value, shape)[done]
+    return result
+
+
+def summarize(data, claims, nsimuls, scenario_index, at_pensiondate):
+    """ Return summary: 1 record per employee x plan x simulation
+
+    The state at pension date is laid out like the records of the tableau
+    at pension date and summarized by summarize_tableau, like
+    codex.Tableau.
+
+    Parameters
+    ----------
+    data           : named tuple from read_xlswb (with lookup_arrays)
+    claims         : frame with 1 record per employee x claim
+    nsimuls        : int
+    scenario_index : dict of ScenarioIndex's, like codex.scenario_indices
+    at_pensiondate : dict of PENSIONDATE_COLUMNS, shaped (claims, sims)
+    """
+    cols = ['id', 'regeling_id', 'aanspraak', 'geslacht', 'leeftijd0',
+            'pensioenlfd', 'type_regeling', 'pt_percentage',
+            'pct_eigen_bijdrage']
+    tableau = (claims[cols].iloc[np.repeat(np.arange(len(claims)), nsimuls)].
+               reset_index(drop=True))
+    tableau.insert(3, 'simulnr', np.tile(
+      np.arange(1, nsimuls + 1, dtype=np.int32), len(claims)))
+    for name in PENSIONDATE_COLUMNS:
+        tableau[name] = np.broadcast_to(at_pensiondate[name],
+                                        (len(claims), nsimuls)).ravel()
+    return summarize_tableau(data, scenario_index,
+                             tableau).reset_index(drop=True)
+
+
+def summarize_tableau(data, scenario_index, tableau):
+    """ Return summary: 1 record per employee x plan x simulation, from
+    the records of tableau at pension date (fsy == 1)
+
+    Parameters
+    ----------
+    data           : named tuple from read_xlswb
+    scenario_index : dict of ScenarioIndex's, like codex.scenario_indices
+    tableau        : like codex.Tableau.tableau, or only its records at
+        pension date (see summarize)
+    """
+    tar = data.lookup_tar_at_pensionage
+
+    # create lookup table 1: 100/70 combi tarief
+    # indexed by: pensioenlfd x geslacht x leeftijd x simulnr
+    # required for: converting DC capitals to DB claim)
+    lookup_combi = tar.unstack(level='aanspraak_id')
+    lookup_combi.columns = pd.Index(['tar_NPLLRS', 'tar_OPLL'])
+    lookup_combi['tar_combi'] = (lookup_combi.tar_OPLL +
+                                 0.7 * lookup_combi.tar_NPLLRS)
+
+    # create lookup table 2: capital at pension date DB plans
+    # indexed by: regeling_id x id x simulnr
+    # required for: converting DB claims to DC capital
+    db_claims = ['OPLL', 'NPLLRS']
+    db = tableau[(tableau.fsy == 1) & (tableau.aanspraak.isin(db_claims))]
+    selected_columns = ['regeling_id', 'id', 'pensioenlfd',
+                        'geslacht', 'leeftijd0', 'aanspraak',
+                        'simulnr', 'tijdsevenredig']
+    db = db[selected_columns].copy()
+    scenarios = scenario_index['lookup_tar_at_pensionage']
+    joined = db.join(tar, on=['pensioenlfd', 'geslacht', 'aanspraak',
+                              'leeftijd0',
+                              scenarios[db.simulnr.values]])
+    joined['capital_db'] = joined.tijdsevenredig * joined.tar
+    remove = ['pensioenlfd', 'geslacht', 'leeftijd0', 'aanspraak',
+              'tijdsevenredig', 'tar']
+    joined.drop(remove, axis=1, inplace=True)
+    grouped = joined.groupby(['regeling_id', 'id', 'simulnr'])
+    lookup_capital = grouped.sum()
+
+    # join lookup tables into summary frame
+    summary_cols = ['regeling_id', 'id', 'simulnr', 'aow',
+                    'cum_eigen_bijdrage', 'aanspraak', 'geslacht',
+                    'leeftijd0', 'pensioenlfd', 'type_regeling',
+                    'ft_salaris', 'pt_percentage',
+                    'premie_franchise', 'premie_plafond',
+                    'pct_eigen_bijdrage', 'capital', 'tijdsevenredig']
+    selected_rows = ((tableau.fsy == 1) &
+                     (tableau.aanspraak.isin(['OPLL', 'VARL'])))
+    summary = tableau[selected_rows][summary_cols]
+    summary.rename({'ft_salaris': 'projectie_ft_salaris',
+                    'premie_franchise': 'projectie_premie_franchise',
+                    'premie_plafond': 'projectie_premie_plafond',
+                    'aow': 'projectie_aow'}, axis=1, inplace=True)
+    summary = summary.join(lookup_combi,
+                           on=['pensioenlfd', 'geslacht', 'leeftijd0',
+                               scenarios[summary.simulnr.values]])
+    summary = summary.join(lookup_capital,
+                           on=['regeling_id', 'id', 'simulnr'])
+    summary['aow'] = data.tbl_assumption['aow'][0]
+    employees = data.tbl_employee
+    summary = summary.join(employees[['ft_salaris', 'op_premievrij',
+                                      'np_premievrij'] +
+                                     EMPLOYEE_TEXT_COLUMNS], on='id')
+    summary = summary.join(
+      data.tbl_pension_plan[PLAN_TEXT_COLUMNS],
+      on=[summary.regeling_id.values, summary.aanspraak.values])
+    plans = data.tbl_pension_plan.groupby(
+      'regeling_id')[['premie_franchise', 'premie_plafond']].first()
+    summary = summary.join(plans, on=['regeling_id'])
+    summary['projectie_op_dc'] = summary.capital / summary.tar_combi
+    summary['projectie_op'] = (summary.tijdsevenredig +
+                               summary.projectie_op_dc)
+    pv = ((summary.op_premievrij * summary.tar_OPLL +
+           summary.np_premievrij * summary.tar_NPLLRS) / summary.tar_combi)
+    summary['projectie_op_plus_pv'] = summary.projectie_op + pv
+    summary['projectie_op_plus_pv_aow'] = (
+      summary.projectie_op_plus_pv + summary.projectie_aow)
+    summary['capital'] = summary.capital.fillna(0)
+    summary['capital_db'] = summary.capital_db.fillna(0)
+    summary['capital'] = summary.capital + summary.capital_db
+    summary['projectie_op_wg'] = (
+      summary.capital - summary.cum_eigen_bijdrage) / summary.tar_combi
+    summary['projectie_op_wn'] = (
+      summary.projectie_op - summary.projectie_op_wg)
+    pension_salary = np.minimum(summary.ft_salaris, summary.premie_plafond)
+    summary['eigen_bijdrage0'] = (
+      summary.pt_percentage * summary.pct_eigen_bijdrage *
+      np.maximum(0, pension_salary - summary.premie_franchise))
+    final_cols = ['id', 'regeling_id', 'simulnr','naam', 'geboortedatum',
+                  'geslacht', 'leeftijd0', 'ft_salaris', 'pt_percentage',
+                  'aow', 'np_premievrij', 'op_premievrij', 'memo',
+                  'type_regeling', 'pensioenlfd', 'pct_eigen_bijdrage',
+                  'eigen_bijdrage0', 'premie_franchise', 'premie_plafond',
+                  'projectie_ft_salaris', 'projectie_aow',
+                  'projectie_premie_franchise', 'projectie_premie_plafond',
+                  'projectie_op', 'projectie_op_plus_pv',
+                  'projectie_op_plus_pv_aow', 'projectie_op_wg',
+                  'projectie_op_wn', 'tar_NPLLRS', 'tar_OPLL',
+                  'cum_eigen_bijdrage', 'capital']
+    return summary[final_cols]
+
+
+def tile_simulations(summary, nsimuls):
+    """ Return summary of 1 simulation repeated for simulations
+    1 .. nsimuls (same records as summarize with nsimuls), for
+    deterministic projections where all simulations are identical
+    """
+    if nsimuls == 1:
+        return summary
+    tiled = (summary.iloc[np.repeat(np.arange(len(summary)), nsimuls)].
+             reset_index(drop=True))
+    tiled['simulnr'] = np.tile(
+      np.arange(1, nsimuls + 1, dtype=summary.simulnr.dtype), len(summary))
+    return tiled
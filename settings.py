@@ -1,2 +1,14 @@
+import os
+
 XLSWB = '/home/pieter/projects/codex/data/template.xlsx'
 PICKLED = '/home/pieter/Desktop/codex_data.pck'
+
+# expected cash flows for utils.CashFlows: environment variable
+# CODEX_CASHFLOWS, or the pickled frame. Convert the pickle once to a cash
+# flow store (a directory, memory mapped instead of unpickled) and point
+# CODEX_CASHFLOWS to it:
+#     >>> from utils import save_cashflow_store
+#     >>> save_cashflow_store('cashflows_AG2014_67.pkl', 'cashflows_AG2014_67')
+#     $ export CODEX_CASHFLOWS=/path/to/cashflows_AG2014_67
+CASHFLOWS = os.environ.get('CODEX_CASHFLOWS',
+                           '/home/pieter/Desktop/cashflows_AG2014_67.pkl')
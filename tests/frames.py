@@ -0,0 +1,27 @@
+"""
+Compare frames with a relative tolerance on the float columns
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def assert_frame_close(left, right, rtol=1e-10, **kwargs):
+    """ Assert frames are equal, with float columns equal within rtol
+    (pd.testing.assert_frame_equal only has rtol from pandas 1.1)
+
+    kwargs are passed to pd.testing.assert_frame_equal, which compares
+    the index, the columns and the other (non float) columns exactly.
+    """
+    assert list(left.columns) == list(right.columns)
+    floats = [col for col in right.columns
+              if pd.api.types.is_float_dtype(right[col])]
+    others = [col for col in right.columns if col not in floats]
+    pd.testing.assert_frame_equal(left[others], right[others],
+                                  check_exact=True, **kwargs)
+    for col in floats:
+        if kwargs.get('check_dtype', True):
+            assert left[col].dtype == right[col].dtype, col
+        np.testing.assert_allclose(left[col].values.astype(float),
+                                   right[col].values, rtol=rtol,
+                                   err_msg=col)
@@ -0,0 +1,36 @@
+"""
+Stochastic copies of the test workbooks
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from load import export_xlswb
+
+# scenario sheets: value column and standard deviation of the scenarios
+SCENARIO_SHEETS = {
+  'lookup_prijsinflatie': ('pct_prijsinflatie_primo', 0.005),
+  'lookup_salarisstijging': ('pct_salstijging_primo', 0.005),
+  'lookup_indexatie': ('pct_indexatie_primo', 0.005),
+  'lookup_rente': ('pct_rente_ultimo', 0.005),
+  'lookup_rendement_aandelen': ('pct_rendement_aandelen', 0.1),
+  'lookup_rendement_obligaties': ('pct_rendement_obligaties', 0.02),
+  'lookup_tar_at_pensionage': ('tar', 0.5)}
+
+
+def stochastic_workbook(xlswb, directory, nscenarios=3, seed=0):
+    """ Write xlswb to directory (1 csv file per sheet) with nscenarios
+    random scenarios around the values of each scenario sheet, and return
+    directory
+    """
+    rng = np.random.RandomState(seed)
+    export_xlswb(xlswb, directory, fmt='csv')
+    for sheet_name, (column, scale) in SCENARIO_SHEETS.items():
+        csv_file = os.path.join(directory, sheet_name + '.csv')
+        df = pd.read_csv(csv_file)
+        values = df.pop(column).values[:, None]
+        scenarios = pd.DataFrame(
+          values + rng.normal(0, scale, (len(df), nscenarios)),
+          columns=range(1, nscenarios + 1), index=df.index)
+        pd.concat([df, scenarios], axis=1).to_csv(csv_file, index=False)
+    return directory
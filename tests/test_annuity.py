@@ -0,0 +1,90 @@
+"""
+Compare stochastic annuity factors with present values of the cash flows
+discounted by the simulated intrest
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from annuity import StochasticAnnuityFactors
+from codex import Tableau
+from dense import DenseTableau
+from utils import CashFlows
+from tests.frames import assert_frame_close
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_wtw.xlsx'
+PENSION_AGE = 68
+CALC_YEAR = 2019
+NYEARS = 40
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+
+@pytest.fixture
+def cashflows(tmp_path):
+    rng = np.random.RandomState(0)
+    index = pd.MultiIndex.from_product(
+      [range(CALC_YEAR, CALC_YEAR + 60), [PENSION_AGE], ['M', 'F'],
+       [PENSION_AGE], range(NYEARS)],
+      names=['calc_year', 'pension_age', 'sex', 'age', 't'])
+    frame = pd.DataFrame(rng.uniform(0, 1, (len(index), 3)), index=index,
+                         columns=['OPLL', 'NPLLRS', 'NPTLO'])
+    infile = tmp_path / 'cashflows.pkl'
+    frame.to_pickle(infile)
+    return CashFlows(infile=str(infile), pension_age=PENSION_AGE)
+
+
+def lookup_intrest(nscenarios, nyears=30):
+    rng = np.random.RandomState(1)
+    index = pd.MultiIndex.from_product(
+      [range(1, nyears + 1), range(1, nscenarios + 1)],
+      names=['jaar', 'simulnr'])
+    return pd.DataFrame({'pct_rente_ultimo':
+                         rng.uniform(0, 0.04, len(index))}, index=index)
+
+# ------ test factors -------------------------------------------------
+
+def test_factors(cashflows):
+
+    intrest = lookup_intrest(3)
+    factors = StochasticAnnuityFactors(cashflows)
+    factors.set_intrest(intrest, CALC_YEAR)
+    keys = [(2, 5, PENSION_AGE, 'M'), (3, 28, PENSION_AGE, 'F')]
+    result = factors.factors(*(np.array(key) for key in zip(*keys)))
+    for (scenario, n, _, sex), tar in zip(keys, result):
+        years = np.minimum(n + np.arange(1, NYEARS), 30)
+        rates = intrest.pct_rente_ultimo.loc[
+          list(zip(years, [scenario] * len(years)))].values
+        v = np.concatenate([[1], np.cumprod(1 / (1 + rates))])
+        cfs = cashflows.cashflows.loc[(CALC_YEAR + n, PENSION_AGE, sex,
+                                       PENSION_AGE)]
+        np.testing.assert_allclose(tar, v @ cfs[['OPLL', 'NPLLRS']].values,
+                                   rtol=1e-12)
+    assert len(factors._cache) == 2
+
+
+def test_flat_intrest(cashflows):
+
+    # wtw workbook: 1 scenario of 2% intrest
+    factors = StochasticAnnuityFactors(cashflows)
+    tab = Tableau(xlswb=abs_file_path, nsimuls=2, annuity_factors=factors)
+    tar = tab.data.lookup_tar_at_pensionage.tar
+    for (_, sex, claim, age, _), value in tar.sample(
+      20, random_state=0).items():
+        expected = cashflows.annuity_factors(
+          CALC_YEAR + PENSION_AGE - age, sex, PENSION_AGE, claim, intrest=2.)
+        assert value == pytest.approx(expected, rel=1e-12)
+
+    summary = tab.add_summary()
+    dense = DenseTableau(xlswb=abs_file_path, nsimuls=2,
+                         annuity_factors=factors).add_summary()
+    assert_frame_close(summary.reset_index(drop=True),
+                       dense.reset_index(drop=True), check_dtype=False)
+
+# ------ [end tests] --------------------------------------------------
@@ -0,0 +1,63 @@
+"""
+Compare cached workbook and directory of csv files with workbook read
+from Excel
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import load
+from load import read_xlswb, workbook_hash, export_xlswb
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_wtw.xlsx'
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+data = read_xlswb(abs_file_path)
+
+
+def assert_data_equal(left, right):
+    for expected, table in zip(right[:-1], left[:-1]):
+        pd.testing.assert_frame_equal(table, expected)
+    for name, expected in right.lookup_arrays.items():
+        np.testing.assert_allclose(left.lookup_arrays[name].values,
+                                   expected.values)
+
+# ------ test read_xlswb ----------------------------------------------
+
+def test_read_cached(tmp_path):
+
+    cache_dir = str(tmp_path)
+    read_xlswb(abs_file_path, cache_dir=cache_dir)
+    cached_file = os.path.join(cache_dir, workbook_hash(abs_file_path) + '.pck')
+    assert os.path.exists(cached_file)
+
+    cached = read_xlswb(abs_file_path, cache_dir=cache_dir)
+    assert cached._fields == data._fields
+    assert_data_equal(cached, data)
+
+
+def test_read_directory(tmp_path):
+
+    directory = str(tmp_path)
+    export_xlswb(abs_file_path, directory, fmt='csv')
+    assert os.path.exists(os.path.join(directory, 'lookup_rente.csv'))
+
+    from_directory = read_xlswb(directory)
+    assert_data_equal(from_directory, data)
+
+
+def test_parquet_engine(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(load, 'PARQUET_ENGINES', ['no_such_engine'])
+    with pytest.raises(ImportError, match='no_such_engine'):
+        export_xlswb(abs_file_path, str(tmp_path), fmt='parquet')
+    assert not os.listdir(str(tmp_path))
+
+# ------ [end tests] --------------------------------------------------
@@ -0,0 +1,97 @@
+"""
+Compare batched annuity factors with present values per cash flow series
+"""
+
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+from utils import CashFlows, present_value, save_cashflow_store
+
+# ----- settings for this test ----------------------------------------
+
+PENSION_AGE = 67
+START = 2017
+END = 2020
+NYEARS = 40
+
+# ----- fixtures ------------------------------------------------------
+
+@pytest.fixture
+def cashflows(tmp_path):
+    rng = np.random.RandomState(0)
+    index = pd.MultiIndex.from_product(
+      [range(START, START + 50), [PENSION_AGE], ['M', 'F'],
+       range(PENSION_AGE - 2, PENSION_AGE + 1), range(NYEARS)],
+      names=['calc_year', 'pension_age', 'sex', 'age', 't'])
+    frame = pd.DataFrame(rng.uniform(0, 1, (len(index), 3)), index=index,
+                         columns=['OPLL', 'NPLLRS', 'NPTLO'])
+    infile = tmp_path / 'cashflows.pkl'
+    frame.sample(frac=1, random_state=0).to_pickle(infile)
+    return CashFlows(infile=str(infile), pension_age=PENSION_AGE,
+                     start=START, end=END)
+
+
+@pytest.fixture
+def store(cashflows, tmp_path):
+    path = str(tmp_path / 'cashflows')
+    save_cashflow_store(cashflows.infile, path)
+    return CashFlows(infile=path, pension_age=PENSION_AGE, start=START,
+                     end=END)
+
+
+def curves(nsimuls):
+    rng = np.random.RandomState(1)
+    return rng.uniform(0, 4, (nsimuls, NYEARS - 5))
+
+# ------ test present values ------------------------------------------
+
+def test_present_value():
+
+    cfs = pd.Series([1., 2., 3.])
+    assert present_value(cfs, intrest=0) == 6.
+    assert present_value(cfs, intrest=2.5) == pytest.approx(
+      1 + 2 / 1.025 + 3 / 1.025**2)
+    assert present_value(cfs, intrest=pd.Series([1., 2.])) == pytest.approx(
+      1 + 2 / 1.02)
+
+
+@pytest.mark.parametrize('intrest', [3, 2.5, pd.Series(curves(1)[0])])
+def test_predict_factors_at_pensionage(cashflows, intrest):
+
+    factors = cashflows.predict_factors_at_pensionage(START, intrest=intrest)
+    expected = factors.apply(lambda row: cashflows.pv(
+      row['calc_year'], PENSION_AGE, row['geslacht'], PENSION_AGE,
+      row['aanspraak_id'], intrest), axis=1)
+    np.testing.assert_allclose(factors.tar, expected, rtol=1e-12)
+
+
+def test_factors_by_simulation(cashflows):
+
+    ages = np.arange(20, 68)
+    factors = cashflows.factors_by_simulation(curves(3), START, ages)
+    assert len(factors) == 2 * 3 * len(ages) * 3
+    for (_, sex, ins, age, simulnr), tar in factors.tar.sample(
+      50, random_state=0).items():
+        expected = cashflows.pv(START + PENSION_AGE - age, PENSION_AGE, sex,
+                                PENSION_AGE, ins,
+                                pd.Series(curves(3)[simulnr - 1]))
+        assert tar == pytest.approx(expected, rel=1e-12)
+
+
+def test_store(cashflows, store):
+
+    assert isinstance(store.cube.values, np.memmap)
+    pd.testing.assert_frame_equal(
+      store.predict_factors_at_pensionage(START, intrest=2.5),
+      cashflows.predict_factors_at_pensionage(START, intrest=2.5))
+    pd.testing.assert_frame_equal(store.cashflows, cashflows.cashflows,
+                                  check_like=True, check_names=False,
+                                  check_index_type=False)
+
+    # worker processes map the store themselves
+    unpickled = pickle.loads(pickle.dumps(store))
+    assert len(pickle.dumps(store)) < store.cube.values.nbytes
+    np.testing.assert_array_equal(unpickled.cube.values, store.cube.values)
+
+# ------ [end tests] --------------------------------------------------
@@ -0,0 +1,66 @@
+"""
+Compare chunked and parallel Tableau with Tableau projected in one go
+"""
+
+import os
+import pandas as pd
+from codex import Tableau
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_wtw.xlsx'
+NSIMULS = 1
+CHUNK_EMPLOYEES = 4
+N_JOBS = 2
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+tab = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+chunked = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS,
+                  chunk_employees=CHUNK_EMPLOYEES)
+parallel = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS,
+                   chunk_employees=CHUNK_EMPLOYEES, n_jobs=N_JOBS)
+
+# ------ test add_summary----------------------------------------------
+
+def test_add_summary():
+
+    expected = tab.add_summary().reset_index(drop=True)
+    assert chunked.tableau is None
+    pd.testing.assert_frame_equal(chunked.add_summary(), expected)
+
+
+def test_add_summary_parallel():
+
+    expected = tab.add_summary().reset_index(drop=True)
+    pd.testing.assert_frame_equal(parallel.add_summary(), expected,
+                                  check_exact=True)
+
+
+def test_report_parallel():
+
+    records = []
+    tab = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS,
+                  chunk_employees=CHUNK_EMPLOYEES, n_jobs=N_JOBS,
+                  callback=records.append)
+    tab.add_summary()
+    totals = tab.report.totals()
+    nchunks = -(-len(tab.data.tbl_employee) // CHUNK_EMPLOYEES)
+    assert totals.loc['_run_projections', 'runs'] == nchunks
+    assert totals.loc['add_summary', 'runs'] == nchunks
+    assert list(tab.report) == records
+
+
+def test_worker_copy():
+
+    tab = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+    tab.add_summary()
+    worker = tab._worker_copy()
+    assert set(worker._memo) == {'data', 'categories', 'scenario_index'}
+    assert worker.instrument.callback is None
+    assert 'tableau' in tab._memo
+
+# ------ [end tests] --------------------------------------------------
@@ -0,0 +1,55 @@
+"""
+Compare compact Tableau with default Tableau
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from codex import Tableau
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_wtw.xlsx'
+NSIMULS = 1
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+tab = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+compact = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS, compact=True)
+
+# ------ test compact -------------------------------------------------
+
+def test_add_summary():
+
+    pd.testing.assert_frame_equal(compact.add_summary(), tab.add_summary(),
+                                  check_dtype=False, check_categorical=False,
+                                  check_exact=True)
+
+
+def test_bytes_per_row():
+
+    assert 'naam' not in compact.tableau.columns
+    assert compact.bytes_per_row() < 0.6 * tab.bytes_per_row()
+
+
+def test_merge_many_simulations():
+
+    # nsimuls x projection years does not fit in int16
+    nsimuls = 1000
+    many = Tableau(xlswb=abs_file_path, nsimuls=nsimuls, compact=True)
+    claims = many._claims()
+    nyears = claims.nprojectionyears.values.astype(np.int64)
+    assert (nsimuls * nyears).max() > np.iinfo(np.int16).max
+
+    merged = many._merge()
+    assert len(merged) == nsimuls * nyears.sum()
+    first = merged.groupby(['id', 'regeling_id', 'aanspraak'], sort=False,
+                           observed=True)
+    assert (first.simulnr.max().values == nsimuls).all()
+    np.testing.assert_array_equal(first.BOY.max().values, nyears)
+    assert merged.BOY.dtype == merged.simulnr.dtype == np.int16
+
+# ------ [end tests] --------------------------------------------------
@@ -0,0 +1,150 @@
+"""
+Compare dense engine results with Tableau and PwC
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from utils import compare, Segments
+from codex import Tableau
+from dense import DenseTableau, cumulative_index, shift
+from load import export_xlswb
+from tests.frames import assert_frame_close
+from tests.scenarios import stochastic_workbook
+from vectorize import accumulate_capital
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_pwc.xlsx'
+MAXERROR = 0.25  # Absolute difference must be less than 0.25 percent
+TEST_COLS = ['pwc_projectie_op_plus_pv_aow', 'pwc_eigen_bijdrage0',
+             'xls_projectie_op_wg',  'xls_projectie_op_wn']
+TEST_INDEX = ['regeling_id', 'deelnemer_id']
+CALCULATED_COLS = ['projectie_op_plus_pv_aow', 'eigen_bijdrage0',
+                   'projectie_op_wg',  'projectie_op_wn']
+CALCULATED_INDEX = ['regeling_id', 'id']
+NSIMULS = 1
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+tab = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+dense = DenseTableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+test_values = pd.read_excel(abs_file_path, sheet_name='test_waarden')
+
+# ------ test add_summary----------------------------------------------
+
+def test_add_summary():
+
+    calculated_values = dense.add_summary()
+    calculated_values.set_index(CALCULATED_INDEX, inplace=True)
+    merged = test_values.join(calculated_values[CALCULATED_COLS],
+                              on=TEST_INDEX)
+    merged.set_index(TEST_INDEX, inplace=True)
+    comp = compare(merged, TEST_COLS, CALCULATED_COLS)
+
+    print('\n\n*** Top 20 differences: ***')
+    print(comp.head(20))
+
+    assert (comp.pct_diff.max() < MAXERROR)
+
+
+def test_same_as_tableau():
+
+    expected = tab.add_summary().reset_index(drop=True)
+    pd.testing.assert_frame_equal(dense.add_summary(), expected)
+
+
+@pytest.mark.parametrize('testdata', ['codex_test_data_pwc.xlsx',
+                                      'codex_test_data_wtw.xlsx'])
+@pytest.mark.parametrize('nscenarios, nsimuls', [(1, 3), (3, 7)])
+def test_equivalence(tmp_path, testdata, nscenarios, nsimuls):
+
+    # more simulations than scenarios: scenarios are recycled, and tables
+    # with 1 scenario are broadcast over the simulation axis
+    xlswb = os.path.join(main_dir, testdata)
+    if nscenarios > 1:
+        xlswb = stochastic_workbook(xlswb, str(tmp_path), nscenarios)
+    expected = Tableau(xlswb=xlswb, nsimuls=nsimuls).add_summary()
+    expected = expected.reset_index(drop=True)
+    assert set(expected.simulnr) == set(range(1, nsimuls + 1))
+    assert_frame_close(
+      DenseTableau(xlswb=xlswb, nsimuls=nsimuls).add_summary(), expected)
+
+
+def test_accumulate_capital():
+
+    rng = np.random.RandomState(0)
+    premium = rng.uniform(0, 1000, (5, 1, 60))
+    rendement = rng.normal(0.04, 0.1, (1, 7, 60))
+    nqx = rng.uniform(0, 0.02, (5, 1, 60))
+    timing_investments = 0.5
+    cf_timing_factor = ((1 + timing_investments * rendement) /
+                        (1 + rendement))
+    rendement_idx = cumulative_index(rendement)
+    nqx_idx = cumulative_index(nqx, sign=-1)
+    expected = (rendement_idx / nqx_idx * np.cumsum(
+      premium * cf_timing_factor * shift(nqx_idx, fill=1) /
+      shift(rendement_idx, fill=1), axis=-1))
+    capital = accumulate_capital(premium, rendement, nqx, timing_investments)
+    np.testing.assert_allclose(capital, expected, rtol=1e-10)
+
+    # cumulative return index underflows, capital does not
+    years = 1200
+    capital = accumulate_capital(np.ones(years), np.full(years, -0.5),
+                                 np.zeros(years))
+    assert cumulative_index(np.full(years, -0.5))[-1] == 0
+    assert np.isfinite(capital).all()
+    np.testing.assert_allclose(capital[-1], 1)
+
+
+def test_accumulate_capital_rows():
+
+    # tableau rows: segments of 1 .. 40 years, same as the padded years
+    rng = np.random.RandomState(1)
+    lengths = rng.randint(1, 41, 50)
+    position = np.concatenate([np.arange(length) for length in lengths])
+    segments = Segments(position == 0)
+    premium, nqx = rng.uniform(0, 1000, (2, len(position))) / [[1], [5e4]]
+    rendement = rng.normal(0.04, 0.1, len(position))
+    capital = accumulate_capital(premium, rendement, nqx, 0.5,
+                                 segments=segments)
+    expected = segments.unpad(accumulate_capital(
+      segments.pad(premium), segments.pad(rendement), segments.pad(nqx),
+      0.5))
+    np.testing.assert_allclose(capital, expected, rtol=1e-12)
+
+    # a missing return: NaN from that year on, other claims unaffected
+    rendement[position == 3] = np.nan
+    capital = accumulate_capital(premium, rendement, nqx, 0.5,
+                                 segments=segments)
+    assert np.isnan(capital[position >= 3]).all()
+    assert np.isfinite(capital[position < 3]).all()
+
+
+def test_total_loss(tmp_path):
+
+    # all investments lost in the first year: the cumulative return index
+    # is 0 from then on, the capital is rebuilt by the later premiums
+    directory = str(tmp_path)
+    export_xlswb(os.path.join(main_dir, 'codex_test_data_wtw.xlsx'),
+                 directory, fmt='csv')
+    for sheet_name in ['lookup_rendement_aandelen',
+                       'lookup_rendement_obligaties']:
+        csv_file = os.path.join(directory, sheet_name + '.csv')
+        sheet = pd.read_csv(csv_file)
+        sheet.iloc[(sheet.jaar == 1).values, -1] = -1
+        sheet.to_csv(csv_file, index=False)
+
+    expected = Tableau(xlswb=directory).add_summary().reset_index(drop=True)
+    assert np.isfinite(expected.capital).all()
+    assert (expected.capital > 0).any()
+    pd.testing.assert_frame_equal(
+      Tableau(xlswb=directory, detail=False).add_summary(), expected)
+    pd.testing.assert_frame_equal(
+      DenseTableau(xlswb=directory).add_summary(), expected)
+
+# ------ [end tests] --------------------------------------------------
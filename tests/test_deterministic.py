@@ -0,0 +1,90 @@
+"""
+Compare deterministic projections (1 simulation, repeated) with full
+projections of all simulations
+"""
+
+import os
+import pandas as pd
+import pytest
+from codex import Tableau
+from dense import DenseTableau, DeterministicTableau
+from load import export_xlswb
+from tests.frames import assert_frame_close
+from tests.scenarios import stochastic_workbook
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_pwc.xlsx'
+NSIMULS = 4
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+tab = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+deterministic = DeterministicTableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+
+# ------ test deterministic -------------------------------------------
+
+def test_project_summary():
+
+    assert tab.deterministic
+    expected = tab.add_summary().reset_index(drop=True)
+    summary_only = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS,
+                           detail=False)
+    assert_frame_close(summary_only.add_summary(), expected)
+
+
+def test_add_summary():
+
+    # 1 simulation is projected and its summary repeated
+    single = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+    summary = single.add_summary()
+    assert 'tableau' not in single._memo
+    report = single.report.to_frame().set_index('stage')
+    expected = tab._summarize(tab.tableau).reset_index(drop=True)
+    assert report.loc['_run_projections', 'rows'] == len(tab.tableau) // NSIMULS
+    pd.testing.assert_frame_equal(summary, expected, check_exact=True)
+
+    chunked = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS,
+                      chunk_employees=2)
+    pd.testing.assert_frame_equal(chunked.add_summary(), expected,
+                                  check_exact=True)
+
+
+def test_deterministic_tableau():
+
+    dense = DenseTableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+    pd.testing.assert_frame_equal(deterministic.add_summary(),
+                                  dense.add_summary(), check_exact=True)
+    assert deterministic.vector('capital').shape == (
+      len(deterministic.claims), deterministic.claims.nprojectionyears.max())
+
+
+def test_scenarios(tmp_path):
+
+    directory = str(tmp_path)
+    export_xlswb(abs_file_path, directory, fmt='csv')
+    csv_file = os.path.join(directory, 'lookup_rente.csv')
+    sheet = pd.read_csv(csv_file).rename(columns={'pct_rente_ultimo': '1'})
+    sheet['2'] = sheet['1'] + 0.01
+    sheet.to_csv(csv_file, index=False)
+    assert not Tableau(xlswb=directory, nsimuls=2).deterministic
+    with pytest.raises(ValueError):
+        DeterministicTableau(xlswb=directory, nsimuls=2)
+
+
+def test_stochastic_summary_only(tmp_path):
+
+    # 3 scenarios, recycled over 5 simulations: nothing is tiled
+    directory = stochastic_workbook(abs_file_path, str(tmp_path))
+    tab = Tableau(xlswb=directory, nsimuls=5)
+    summary_only = Tableau(xlswb=directory, nsimuls=5, detail=False)
+    assert not summary_only.deterministic
+    expected = tab.add_summary().reset_index(drop=True)
+    assert len(expected) == 5 * len(tab.add_summary().groupby(
+      ['id', 'regeling_id']))
+    assert_frame_close(summary_only.add_summary(), expected)
+
+# ------ [end tests] --------------------------------------------------
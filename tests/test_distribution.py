@@ -0,0 +1,91 @@
+"""
+Compare distribution statistics over simulations with numpy, for whole,
+chunked and merged runs
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from aggregate import Distribution
+from codex import Tableau
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_wtw.xlsx'
+NSIMULS = 3
+QUANTILES = (0.05, 0.5, 0.95)
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+rng = np.random.RandomState(0)
+frame = pd.DataFrame({'id': np.repeat([1, 2, 3], 1000),
+                      'regeling_id': 1,
+                      'simulnr': np.tile(np.arange(1, 1001), 3),
+                      'capital': rng.lognormal(10, 1, 3000),
+                      'projectie_op': rng.normal(1000, 2000, 3000)})
+frame.loc[5, 'capital'] = np.nan
+COLUMNS = ['capital', 'projectie_op']
+
+
+def expected():
+    grouped = frame.groupby(['id', 'regeling_id'])
+    result = {}
+    for column in COLUMNS:
+        result[column + '_mean'] = grouped[column].mean()
+        for q in QUANTILES:
+            result['{}_p{:g}'.format(column, 100 * q)] = (
+              grouped[column].quantile(q))
+    result['projectie_op_shortfall'] = grouped.projectie_op.apply(
+      lambda values: (values < 0).mean())
+    return pd.DataFrame(result)
+
+# ------ test statistics ----------------------------------------------
+
+def test_exact():
+
+    dist = Distribution(columns=COLUMNS, thresholds={'projectie_op': 0})
+    for _, chunk in frame.groupby('id'):
+        dist.update(chunk)
+    result = dist.result()
+    assert result.capital_count.tolist() == [999, 1000, 1000]
+    pd.testing.assert_frame_equal(result[expected().columns], expected(),
+                                  check_names=False)
+    with pytest.raises(ValueError):
+        dist.update(frame[frame.id == 1])
+
+
+def test_sketch():
+
+    first = Distribution(columns=COLUMNS, thresholds={'projectie_op': 0},
+                         method='sketch')
+    second = Distribution(columns=COLUMNS, thresholds={'projectie_op': 0},
+                          method='sketch')
+    first.update(frame[frame.simulnr <= 400])
+    second.update(frame[frame.simulnr > 400])
+    result = first.merge(second).result()
+    exact = expected()
+    for column in exact.columns:
+        # quantiles within relative accuracy of the sketch (+ 1 rank)
+        np.testing.assert_allclose(result[column], exact[column],
+                                   rtol=0.03)
+
+
+def test_tableau():
+
+    full = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+    chunked = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS,
+                      chunk_employees=4)
+    thresholds = {'projectie_op': 'projectie_op_wg'}
+    pd.testing.assert_frame_equal(
+      full.distribution(thresholds=thresholds),
+      chunked.distribution(thresholds=thresholds))
+    per_year = full.distribution(per_year=True)
+    assert len(per_year) == len(full.tableau) // NSIMULS
+    with pytest.raises(ValueError):
+        chunked.distribution(per_year=True)
+
+# ------ [end tests] --------------------------------------------------
@@ -0,0 +1,37 @@
+"""
+Check dtypes of Tableau columns
+"""
+
+import os
+import pytest
+from codex import Tableau, TABLEAU_DTYPES, check_dtypes
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_pwc.xlsx'
+NSIMULS = 1
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+tab = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+
+# ------ test dtypes --------------------------------------------------
+
+def test_dtypes():
+
+    check_dtypes(tab.tableau)
+    for col in TABLEAU_DTYPES:
+        assert tab.tableau[col].dtype != object
+
+
+def test_check_dtypes():
+
+    tableau = tab.tableau.head().copy()
+    tableau['ft_salaris'] = tableau.ft_salaris.astype(object)
+    with pytest.raises(TypeError):
+        check_dtypes(tableau)
+
+# ------ [end tests] --------------------------------------------------
@@ -0,0 +1,54 @@
+"""
+Check the per-stage records of Tableau.report and the callback
+"""
+
+import logging
+import os
+from codex import Tableau
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_wtw.xlsx'
+NSIMULS = 2
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+# ------ test report --------------------------------------------------
+
+def test_report(caplog):
+
+    records = []
+    tab = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS,
+                  callback=records.append)
+    with caplog.at_level(logging.INFO, logger='codex'):
+        # the full tableau (the workbook is deterministic, so add_summary
+        # alone would project 1 simulation)
+        tab.tableau
+        summary = tab.add_summary()
+
+    stages = [record.stage for record in records]
+    assert stages[0] == 'read_sheet.tbl_deelnemer'
+    assert 'read_sheet.lookup_nqx' in stages
+    assert stages.count('calculate_portfolio_return') == 1
+    assert stages[-6:] == ['read_xlswb', '_merge', '_add_age',
+                           '_lookup_increments', '_run_projections',
+                           'add_summary']
+    assert list(tab.report) == records
+    assert 'lookup_nqx' in caplog.text
+
+    report = tab.report.to_frame().set_index('stage')
+    assert report.loc['_run_projections', 'rows'] == len(tab.tableau)
+    assert report.loc['add_summary', 'rows'] == len(summary)
+    assert (report.loc['_run_projections', 'nbytes'] >
+            report.loc['_merge', 'nbytes'] > 0)
+    assert (report.seconds >= 0).all()
+
+    # memoised stages are not run (nor recorded) again
+    tab.add_summary()
+    assert tab.report.totals().loc['_merge', 'runs'] == 1
+    assert tab.report.totals().loc['add_summary', 'runs'] == 2
+
+# ------ [end tests] --------------------------------------------------
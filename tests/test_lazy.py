@@ -0,0 +1,66 @@
+"""
+Check lazy construction and memoised stages of Tableau
+"""
+
+import os
+import pandas as pd
+from codex import Tableau
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_wtw.xlsx'
+NSIMULS = 1
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+# ------ test lazy construction ---------------------------------------
+
+def test_lazy():
+
+    tab = Tableau(xlswb='does_not_exist.xlsx', nsimuls=NSIMULS)
+    tab.xlswb = abs_file_path
+    assert len(tab.tableau) > 0
+
+
+def test_memoised_stages():
+
+    tab = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS, keep_stages=True)
+    expected = tab.add_summary()
+    data, aged = tab.data, tab._memo['add_age'][1]
+
+    # downstream parameter: earlier stages are reused
+    tab.join_lookups = True
+    pd.testing.assert_frame_equal(tab.add_summary(), expected,
+                                  check_exact=True)
+    assert tab._memo['add_age'][1] is aged
+
+    # nsimuls: only the workbook is reused
+    tab.nsimuls = 2
+    assert tab.tableau.simulnr.max() == 2
+    assert tab.data is data
+    assert tab._memo['add_age'][1] is not aged
+
+
+def test_default_stages():
+
+    # only the workbook and the tableau are kept
+    tab = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+    expected = tab.add_summary()
+    assert set(tab._memo) == {'data', 'scenario_index', 'tableau'}
+    assert tab.report.totals().loc['_merge', 'runs'] == 1
+
+    tab.join_lookups = True
+    pd.testing.assert_frame_equal(tab.add_summary(), expected,
+                                  check_exact=True)
+    assert tab.report.totals().loc['_merge', 'runs'] == 2
+
+    # variants share the tableau after _add_age
+    tab.what_if([{'age_adjustment': 0}, {'timing_belegging': 0}])
+    assert set(tab._memo) == {'data', 'scenario_index', 'tableau',
+                              'add_age'}
+    assert tab.report.totals().loc['_merge', 'runs'] == 3
+
+# ------ [end tests] --------------------------------------------------
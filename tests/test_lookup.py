@@ -0,0 +1,76 @@
+"""
+Compare lookups by integer coded arrays with lookups by join
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from codex import Tableau
+from utils import LookupArray, ScenarioIndex, calculate_portfolio_return
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_wtw.xlsx'
+NSIMULS = 1
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+tab = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+joined = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS, join_lookups=True)
+
+# ------ test lookups -------------------------------------------------
+
+def test_lookup_array():
+
+    index = pd.MultiIndex.from_tuples([('M', 20), ('M', 21), ('V', 21)],
+                                      names=['geslacht', 'leeftijd'])
+    arr = LookupArray(pd.Series([1., 2., 3.], index=index, name='x'))
+    result = arr.lookup(np.array(['V', 'M', 'M', 'X']),
+                        np.array([21, 20, 22, 20]))
+    np.testing.assert_array_equal(result, [3., 1., np.nan, np.nan])
+
+
+def test_scenario_index():
+
+    scenarios = ScenarioIndex(nscenarios=3, nsimuls=7)
+    np.testing.assert_array_equal(scenarios[np.arange(1, 8)],
+                                  [1, 2, 3, 1, 2, 3, 1])
+    np.testing.assert_array_equal(ScenarioIndex(1, 7).axis(), [1])
+
+
+def test_portfolio_return():
+
+    lifecycle = pd.DataFrame({'pct_aandelen': [0.8, 0.5, 0.2]},
+                             index=pd.Index([60, 61, 62], name='leeftijd'))
+    index = pd.MultiIndex.from_product([[1, 2], [1, 2, 3]],
+                                       names=['jaar', 'simulnr'])
+    stocks = pd.DataFrame({'pct_rendement_aandelen': np.arange(6) / 10.},
+                          index=index)
+    bonds = pd.DataFrame({'pct_rendement_obligaties': [0.01, 0.02]},
+                         index=pd.MultiIndex.from_product(
+                           [[1, 2], [1]], names=['jaar', 'simulnr']))
+    result = calculate_portfolio_return(lifecycle, stocks, bonds)
+    assert len(result) == 3 * 3 + 2 * 3  # start age + year - 1 <= 62
+    assert result.loc[(61, 2, 3), 'pct_rendement_ultimo'] == pytest.approx(
+      0.2 * 0.5 + 0.8 * 0.02)
+
+    # multiple lifecycle profiles at once
+    profiles = pd.concat({1: lifecycle, 2: lifecycle.iloc[:2] / 2},
+                         names=['profiel'])
+    both = calculate_portfolio_return(profiles, stocks, bonds)
+    pd.testing.assert_frame_equal(both.loc[1], result)
+    pd.testing.assert_frame_equal(
+      both.loc[2], calculate_portfolio_return(lifecycle.iloc[:2] / 2,
+                                              stocks, bonds))
+
+
+def test_add_summary():
+
+    pd.testing.assert_frame_equal(tab.add_summary(), joined.add_summary(),
+                                  check_exact=True)
+
+# ------ [end tests] --------------------------------------------------
@@ -0,0 +1,78 @@
+"""
+Compare segmented cumulative operations with pandas groupby
+"""
+
+import numpy as np
+import pandas as pd
+from utils import Segments
+
+# ----- settings for this test ----------------------------------------
+
+SEED = 1234
+LENGTHS = [1, 4, 1, 7, 2, 1, 5]  # segment lengths, including single rows
+
+# ----- fixtures ------------------------------------------------------
+
+rng = np.random.RandomState(SEED)
+group = np.repeat(np.arange(len(LENGTHS)), LENGTHS)
+position = np.concatenate([np.arange(length) for length in LENGTHS])
+segments = Segments(position == 0)
+values = rng.uniform(-1, 1, len(group))
+missing = values.copy()
+missing[[0, 2, 6, 9, 12]] = np.nan  # first, middle and last rows
+
+
+def groupby(values):
+    return pd.Series(values).groupby(group)
+
+# ------ test segments ------------------------------------------------
+
+def test_boundaries():
+
+    np.testing.assert_array_equal(segments.segment, group)
+    np.testing.assert_array_equal(segments.position, position)
+    assert segments.shape == (len(LENGTHS), max(LENGTHS))
+    np.testing.assert_allclose(segments.cumsum(values),
+                               groupby(values).cumsum().values)
+    np.testing.assert_allclose(segments.cumprod(1 + values),
+                               groupby(1 + values).cumprod().values)
+
+
+def test_missing_values():
+
+    # missing values stay NaN, the accumulation skips them
+    np.testing.assert_allclose(segments.cumsum(missing),
+                               groupby(missing).cumsum().values)
+    np.testing.assert_allclose(segments.cumprod(1 + missing),
+                               groupby(1 + missing).cumprod().values)
+    assert np.isnan(segments.cumsum(missing)[np.isnan(missing)]).all()
+
+
+def test_shift():
+
+    shifted = segments.shift(missing, fill=1.)
+    expected = groupby(missing).shift().fillna(1.).values
+    np.testing.assert_array_equal(shifted, expected)
+    assert (shifted[position == 0] == 1.).all()
+    assert np.isnan(segments.shift(values)[position == 0]).all()
+
+
+def test_diff():
+
+    diff = segments.diff(values)
+    np.testing.assert_allclose(diff, groupby(values).diff().values)
+    assert np.isnan(diff[position == 0]).all()
+    np.testing.assert_allclose(diff[position > 0],
+                               (values[1:] - values[:-1])[position[1:] > 0])
+
+
+
+def test_rows_by_position():
+
+    rows = segments.rows_by_position()
+    assert len(rows) == max(LENGTHS)
+    for at, positions in enumerate(rows):
+        np.testing.assert_array_equal(np.sort(positions),
+                                      np.flatnonzero(position == at))
+
+# ------ [end tests] --------------------------------------------------
@@ -0,0 +1,56 @@
+"""
+Compare summary-only projection with summary of Tableau
+"""
+
+import os
+import pytest
+from codex import Tableau
+from tests.frames import assert_frame_close
+from tests.scenarios import stochastic_workbook
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_pwc.xlsx'
+NSIMULS = 1
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+tab = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS)
+summary_only = Tableau(xlswb=abs_file_path, nsimuls=NSIMULS, detail=False)
+
+# ------ test add_summary----------------------------------------------
+
+def test_add_summary():
+
+    assert summary_only.tableau is None
+    expected = tab.add_summary().reset_index(drop=True)
+    assert_frame_close(summary_only.add_summary(), expected)
+
+
+def test_project_summary():
+
+    ids = tab.data.tbl_employee.index[:3]
+    expected = tab.add_summary()
+    expected = expected[expected.id.isin(ids)].reset_index(drop=True)
+    assert_frame_close(tab.project_summary(ids), expected)
+
+
+
+@pytest.mark.parametrize('testdata', ['codex_test_data_pwc.xlsx',
+                                      'codex_test_data_wtw.xlsx'])
+def test_stochastic(tmp_path, testdata):
+
+    # 3 scenarios per lookup table, recycled over 5 simulations
+    directory = stochastic_workbook(os.path.join(main_dir, testdata),
+                                    str(tmp_path))
+    expected = Tableau(xlswb=directory, nsimuls=5).add_summary()
+    expected = expected.reset_index(drop=True)
+    assert expected.projectie_op.nunique() > expected.id.nunique()
+    summary_only = Tableau(xlswb=directory, nsimuls=5, detail=False,
+                           chunk_employees=2)
+    assert_frame_close(summary_only.add_summary(), expected)
+
+# ------ [end tests] --------------------------------------------------
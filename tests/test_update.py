@@ -0,0 +1,81 @@
+"""
+Compare incremental re-projection after an edit with a fresh projection
+"""
+
+import os
+import pandas as pd
+import pytest
+from codex import Tableau
+from load import export_xlswb
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_wtw.xlsx'
+NSIMULS = 1
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+
+def edit(directory, sheet_name, column, row, factor):
+    csv_file = os.path.join(directory, sheet_name + '.csv')
+    sheet = pd.read_csv(csv_file)
+    sheet.loc[row, column] *= factor
+    sheet.to_csv(csv_file, index=False)
+    return sheet
+
+# ------ test update --------------------------------------------------
+
+def test_update(tmp_path):
+
+    directory = str(tmp_path)
+    export_xlswb(abs_file_path, directory, fmt='csv')
+    tab = Tableau(xlswb=directory, nsimuls=NSIMULS)
+    before = tab.add_summary()
+
+    # salary of 1 employee: rows are replaced in place
+    employees = edit(directory, 'tbl_deelnemer', 'ft_salaris', 1, 1.1)
+    ids, regeling_ids = tab.update()
+    assert list(ids) == [employees.id[1]] and len(regeling_ids) == 0
+    expected = Tableau(xlswb=directory, nsimuls=NSIMULS)
+    pd.testing.assert_frame_equal(tab.tableau, expected.tableau,
+                                  check_exact=True)
+    changed = tab.add_summary().id == employees.id[1]
+    assert (tab.add_summary()[changed].capital.values !=
+            before[changed].capital.values).any()
+
+    # percentage of 1 plan
+    claims = edit(directory, 'tbl_aanspraak', 'percentage', 0, 1.05)
+    ids, regeling_ids = tab.update()
+    assert list(regeling_ids) == [claims.regeling_id[0]]
+    expected = Tableau(xlswb=directory, nsimuls=NSIMULS)
+    pd.testing.assert_frame_equal(tab.tableau, expected.tableau,
+                                  check_exact=True)
+
+
+def test_update_fails(tmp_path):
+
+    directory = str(tmp_path)
+    export_xlswb(abs_file_path, directory, fmt='csv')
+    tab = Tableau(xlswb=directory, nsimuls=NSIMULS)
+    tableau, data = tab.tableau, tab.data
+
+    # unreadable workbook: the previous data and tableau are kept
+    csv_file = os.path.join(directory, 'tbl_deelnemer.csv')
+    employees = pd.read_csv(csv_file)
+    os.remove(csv_file)
+    with pytest.raises(FileNotFoundError):
+        tab.update()
+    assert tab.data is data and tab.tableau is tableau
+    with pytest.raises(FileNotFoundError):
+        tab.update(os.path.join(directory, 'missing'))
+    assert tab.xlswb == directory and tab.data is data
+
+    employees.loc[1, 'ft_salaris'] *= 1.1
+    employees.to_csv(csv_file, index=False)
+    ids, regeling_ids = tab.update()
+    assert list(ids) == [employees.id[1]]
+
+# ------ [end tests] --------------------------------------------------
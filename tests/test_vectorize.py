@@ -0,0 +1,72 @@
+"""
+Compare vectorized functions with scalar reference formulae
+"""
+
+from datetime import date, timedelta
+import numpy as np
+import formulae as f
+import vectorize as v
+
+# ----- settings for this test ----------------------------------------
+
+NSAMPLES = 2000
+SEED = 1234
+
+# ----- fixtures ------------------------------------------------------
+
+rng = np.random.RandomState(SEED)
+
+
+def random_dates(n, start=date(1940, 1, 1), ndays=80 * 365):
+    return [start + timedelta(days=int(days))
+            for days in rng.randint(0, ndays, size=n)]
+
+
+birthdates = random_dates(NSAMPLES)
+service_dates = random_dates(NSAMPLES, start=date(1960, 1, 1))
+calculation_date = date(2019, 7, 15)
+pension_ages = rng.randint(60, 71, size=NSAMPLES)
+fractions = rng.uniform(-50, 50, size=NSAMPLES)
+
+# ------ test vectorized versions -------------------------------------
+
+def test_pensiondate():
+
+    expected = [f.pensiondate(birthdate, int(pension_age)) for
+                birthdate, pension_age in zip(birthdates, pension_ages)]
+    calculated = v.pensiondate(birthdates, pension_ages)
+    assert calculated.dtype == np.dtype('datetime64[D]')
+    assert list(calculated.astype(object)) == expected
+
+
+def test_future_service_years():
+
+    pension_dates = [f.pensiondate(birthdate, int(pension_age)) for
+                     birthdate, pension_age in zip(birthdates, pension_ages)]
+    expected = [f.future_service_years(calculation_date, pension_date)
+                for pension_date in pension_dates]
+    calculated = v.future_service_years(calculation_date, pension_dates)
+    assert calculated.dtype == np.float64
+    assert np.array_equal(calculated, expected)
+
+
+def test_past_service_years():
+
+    for method in ['Oxylo', 'PwC']:
+        expected = [f.past_service_years(service_date, calculation_date,
+                                         method=method)
+                    for service_date in service_dates]
+        calculated = v.past_service_years(service_dates, calculation_date,
+                                          method=method)
+        assert calculated.dtype == np.float64
+        assert np.array_equal(calculated, expected)
+
+
+def test_roundup():
+
+    expected = [f.roundup(x) for x in fractions]
+    calculated = v.roundup(fractions)
+    assert calculated.dtype == np.int64
+    assert np.array_equal(calculated, expected)
+
+# ------ [end tests] --------------------------------------------------
@@ -0,0 +1,94 @@
+"""
+Compare assumption variants of one Tableau with Tableaus of workbooks with
+these assumptions
+"""
+
+import os
+import pandas as pd
+import pytest
+from codex import Tableau
+from load import export_xlswb
+
+# ----- settings for this test ----------------------------------------
+
+TESTDATA = 'codex_test_data_wtw.xlsx'
+NSIMULS = 2
+VARIANTS = {'nqx': {'nqx_id': 1, 'indexatie_id': 2},
+            'age': {'age_adjustment': -1, 'timing_belegging': 0.5},
+            'tariff': {'tarief_id': {2: 1}}}
+
+# ----- fixtures ------------------------------------------------------
+
+main_dir = os.path.dirname(__file__)
+abs_file_path = os.path.join(main_dir, TESTDATA)
+
+
+@pytest.fixture(scope='module')
+def workbook(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('what_if'))
+    export_xlswb(abs_file_path, directory, fmt='csv')
+    return directory
+
+
+def expected_summary(workbook, assumptions, detail=True):
+    directory = workbook + '_variant'
+    export_xlswb(abs_file_path, directory, fmt='csv')
+    assumptions = dict(assumptions)
+    tariff = assumptions.pop('tarief_id', None)
+    csv_file = os.path.join(directory, 'tbl_assumptie.csv')
+    sheet = pd.read_csv(csv_file).assign(**assumptions)
+    sheet.to_csv(csv_file, index=False)
+    if tariff is not None:
+        csv_file = os.path.join(directory, 'tbl_aanspraak.csv')
+        sheet = pd.read_csv(csv_file)
+        sheet['tarief_id'] = sheet.tarief_id.replace(tariff)
+        sheet.to_csv(csv_file, index=False)
+    tab = Tableau(xlswb=directory, nsimuls=NSIMULS, detail=detail)
+    return tab.add_summary().reset_index(drop=True)
+
+# ------ test variants ------------------------------------------------
+
+@pytest.mark.parametrize('detail', [True, False])
+def test_what_if(workbook, detail):
+
+    tab = Tableau(xlswb=workbook, nsimuls=NSIMULS, detail=detail)
+    result = tab.what_if(VARIANTS)
+    assert list(result.index.unique('variant')) == list(VARIANTS)
+    for name, assumptions in VARIANTS.items():
+        expected = expected_summary(workbook, assumptions, detail)
+        pd.testing.assert_frame_equal(result.loc[name], expected)
+    # base projection unchanged
+    pd.testing.assert_frame_equal(
+      tab.add_summary().reset_index(drop=True),
+      expected_summary(workbook, {}, detail))
+
+
+def test_skeleton_shared(workbook):
+
+    tab = Tableau(xlswb=workbook, nsimuls=NSIMULS, keep_stages=True)
+    tab.tableau
+    stages = len(tab.report)
+    tab.what_if([{'timing_belegging': 0.5}])
+    stages = [record.stage for record in tab.report][stages:]
+    assert '_merge' not in stages and '_add_age' not in stages
+    assert '_lookup_increments' in stages
+
+    # without keep_stages, the variants expand the tableau once
+    tab = Tableau(xlswb=workbook, nsimuls=NSIMULS)
+    tab.add_summary()
+    stages = len(tab.report)
+    tab.what_if([{'timing_belegging': 0.5}, {'age_adjustment': 0}])
+    stages = [record.stage for record in tab.report][stages:]
+    assert stages.count('_merge') == stages.count('_add_age') == 1
+    assert stages.count('_lookup_increments') == 2
+
+
+def test_rekendatum(workbook):
+
+    tab = Tableau(xlswb=workbook, nsimuls=NSIMULS)
+    with pytest.raises(ValueError):
+        tab.variant({'rekendatum': '2020-01-01'})
+    with pytest.raises(ValueError):
+        tab.variant({'rente': 2})
+
+# ------ [end tests] --------------------------------------------------
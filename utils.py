@@ -3,18 +3,51 @@ Boiler plate code besides formulae, to keep main program short & tidy.
 """
 import numpy as np
 import pandas as pd
+import json
+import os
 import pickle
+from functools import lru_cache
+import settings
 
 
 class CashFlows:
+    """ Annuity factors from a frame of expected cash flows
+
+    The cash flows are a frame indexed by (calc_year, pension_age, sex,
+    age, year number) with 1 column per insurance (OPLL, NPLLRS, NPTLO),
+    read from a pickle or from a cash flow store (see
+    save_cashflow_store). For the present values it is kept as dense
+    array (see cube), so the annuity factors of any number of (calc_year,
+    sex, age, insurance) combinations are computed in 1 matrix product
+    with the discount factors of a fixed intrest rate, a yield curve or a
+    yield curve per simulation.
+
+    infile defaults to settings.CASHFLOWS (environment variable
+    CODEX_CASHFLOWS, see settings.py).
+
+    A store is memory mapped (read only): nothing is unpickled at startup
+    and worker processes share 1 physical copy of the cash flows (pickling
+    CashFlows leaves the array out, the worker maps the store again).
+    """
 
-    def __init__(self, infile='/home/pieter/Desktop/cashflows_AG2014_67.pkl',
-                 pension_age=67, start=2017, end=2064):
-        self.infile = infile
-        self.cashflows = self.load_cfs()
+    def __init__(self, infile=None, pension_age=67, start=2017,
+                 end=2064):
+        self.infile = settings.CASHFLOWS if infile is None else infile
         self.pension_age = pension_age
         self.start = start
         self.end = end
+        self._cashflows = None
+        self._cube = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.is_store:
+            state.update(_cashflows=None, _cube=None)
+        return state
+
+    @property
+    def is_store(self):
+        return os.path.isdir(self.infile)
 
     def load_cfs(self):
         f = open(self.infile, 'rb')
@@ -22,6 +55,65 @@ class CashFlows:
         f.close()
         return cfs.sort_index()
 
+    @property
+    def cashflows(self):
+        """ Cash flows as frame (from a store: including the cash flows
+        of zeros padding the dense array)
+        """
+        if self._cashflows is None:
+            if self.is_store:
+                self._cashflows = cashflow_frame(self.cube)
+            else:
+                self._cashflows = self.load_cfs()
+        return self._cashflows
+
+    @property
+    def cube(self):
+        """ Cash flows as LookupArray with axes (calc_year, pension_age,
+        sex, age, insurance, year number), zero after the last cash flow
+        """
+        if self._cube is None:
+            if self.is_store:
+                self._cube = load_cashflow_store(self.infile)
+            else:
+                self._cube = cashflow_cube(self.cashflows)
+        return self._cube
+
+    def get_cashflows(self, calc_year, pension_age, sex_insured, age_insured,
+                      insurance_id):
+        """ Return cash flows of given keys (broadcast against each other),
+        with the year number as last axis
+        """
+        cube = self.cube
+        keys = [np.asarray(key)[..., None] for key in
+                (calc_year, pension_age, sex_insured, age_insured,
+                 insurance_id)]
+        return cube.lookup(*keys, np.asarray(cube.axes[-1]))
+
+    def annuity_factors(self, calc_year, sex_insured, age_insured,
+                        insurance_id, intrest=2.5, pension_age=None):
+        """ Return present values of the cash flows of given keys
+
+        Parameters
+        ----------
+            calc_year, sex_insured, age_insured, insurance_id :
+                scalars or arrays, broadcast against each other
+            intrest : fixed intrest rate, yield curve or 2D-array with
+                      1 yield curve per row (in %)
+            pension_age : defaults to pension age of the cash flows
+
+        Return
+        ------
+            factors : numpy array shaped like the broadcast keys, with an
+                      extra last axis for 2D intrest (1 per curve)
+        """
+        if pension_age is None:
+            pension_age = self.pension_age
+        cfs = self.get_cashflows(calc_year, pension_age, sex_insured,
+                                 age_insured, insurance_id)
+        v = discount_factors(intrest, cfs.shape[-1])
+        return cfs @ v.T
+
     def pv(self, calc_year, pension_age, sex_insured, age_insured,
            insurance_id, intrest):
         return present_value(
@@ -38,15 +130,112 @@ class CashFlows:
                                 'geslacht': sex_in,
                                 'calc_year': cal_yr,
                                 'pensioenlfd': self.pension_age})
-
-        factors['tar'] = factors.apply(lambda row: self.pv(row['calc_year'],
-                                       self.pension_age,
-                                       row['geslacht'],
-                                       self.pension_age,
-                                       row['aanspraak_id'],
-                                       intrest), axis=1)
+        # (insurance, sex, calc_year) in the same order as the rows above
+        factors['tar'] = self.annuity_factors(
+          np.arange(self.start, self.start + n)[None, None, :],
+          np.array(['M', 'F'])[None, :, None],
+          self.pension_age,
+          np.array(['OPLL', 'NPLLRS', 'NPTLO'])[:, None, None],
+          intrest=intrest).ravel()
         return factors
 
+    def factors_by_simulation(self, curves, calc_year, ages,
+                              sexes=('M', 'F'),
+                              insurances=('OPLL', 'NPLLRS', 'NPTLO')):
+        """ Return annuity factors at pension age of employees now
+        (calc_year) aged ages, for every simulated yield curve
+
+        Parameters
+        ----------
+            curves : 2D-array, 1 yield curve (in %) per simulation
+            calc_year : current year, employees aged x retire in
+                        calc_year + pension_age - x
+            ages : current ages
+
+        Return
+        ------
+            factors : frame like lookup_tar_at_pensionage, indexed by
+                      (pensioenlfd, geslacht, aanspraak_id, leeftijd,
+                      simulnr)
+        """
+        curves = np.atleast_2d(curves)
+        ages = np.asarray(ages)
+        factors = self.annuity_factors(
+          (calc_year + self.pension_age - ages)[None, None, :],
+          np.asarray(sexes)[:, None, None],
+          self.pension_age,
+          np.asarray(insurances)[None, :, None],
+          intrest=curves)
+        index = pd.MultiIndex.from_product(
+          [[self.pension_age], list(sexes), list(insurances), ages,
+           np.arange(1, len(curves) + 1)],
+          names=['pensioenlfd', 'geslacht', 'aanspraak_id', 'leeftijd',
+                 'simulnr'])
+        return pd.DataFrame({'tar': factors.ravel()}, index=index)
+
+
+def cashflow_cube(cashflows):
+    """ Return cash flows frame (see CashFlows) as LookupArray with axes
+    (calc_year, pension_age, sex, age, insurance, year number), zero for
+    missing cash flows
+    """
+    cashflows = cashflows.copy()
+    cashflows.columns.name = 'insurance'
+    stacked = cashflows.stack()
+    nlevels = stacked.index.nlevels
+    order = list(range(nlevels - 2)) + [nlevels - 1, nlevels - 2]
+    cube = LookupArray(stacked.reorder_levels(order))
+    cube.values = np.nan_to_num(cube.values)
+    return cube
+
+
+def cashflow_frame(cube):
+    """ Return cash flows frame (see CashFlows) of cash flows LookupArray
+    """
+    values = np.moveaxis(np.asarray(cube.values), -2, -1)
+    axes = cube.axes[:-2] + cube.axes[-1:]
+    index = pd.MultiIndex.from_product(
+      axes, names=cube.names[:-2] + cube.names[-1:])
+    return pd.DataFrame(values.reshape(len(index), -1), index=index,
+                        columns=pd.Index(cube.axes[-2],
+                                         name=cube.names[-2]))
+
+
+def save_cashflow_store(cashflows, path):
+    """ Write cash flows to store directory path: the dense array of
+    cashflow_cube as cashflows.npy and its axes as index.json
+
+    Parameters
+    ----------
+        cashflows : frame (see CashFlows) or name of pickled frame
+        path      : directory, created if it does not exist
+    """
+    if isinstance(cashflows, str):
+        with open(cashflows, 'rb') as f:
+            cashflows = pickle.load(f)
+    cube = cashflow_cube(cashflows)
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'cashflows.npy'), cube.values)
+    axes = [{'start': int(axis[0]), 'stop': int(axis[0]) + len(axis)}
+            if isinstance(axis, pd.RangeIndex) else axis.tolist()
+            for axis in cube.axes]
+    with open(os.path.join(path, 'index.json'), 'w') as f:
+        json.dump({'names': cube.names, 'axes': axes}, f)
+
+
+def load_cashflow_store(path, mmap_mode='r'):
+    """ Return cash flows LookupArray of store directory path (see
+    save_cashflow_store), memory mapped
+    """
+    with open(os.path.join(path, 'index.json')) as f:
+        index = json.load(f)
+    axes = [pd.RangeIndex(axis['start'], axis['stop'])
+            if isinstance(axis, dict) else pd.Index(axis)
+            for axis in index['axes']]
+    values = np.load(os.path.join(path, 'cashflows.npy'),
+                     mmap_mode=mmap_mode)
+    return LookupArray.from_arrays(values, axes, index['names'])
+
 
 def create_index(lst):
     """ Build index length sum(lst)
@@ -199,6 +388,188 @@ def calculate_cumulative_index_conjugate(df):
     return (1 - df).cumprod()
 
 
+class Segments:
+    """ Consecutive groups of rows (segments), e.g. the projection years of
+    one employee x claim x simulation in the sorted tableau
+
+    Cumulative operations within the segments are done in one go on a
+    padded (segments x max. segment length) array, instead of a Python
+    function call per group like groupby().apply(). Like pandas, missing
+    values are skipped (they stay NaN, the accumulation continues).
+
+    Parameters
+    ----------
+    is_start : boolean numpy array or Series
+        True for the first row of each segment (like BOY == 1)
+
+    Examples
+    --------
+        >>> segments = Segments(np.array([True, False, True, False, False]))
+        >>> segments.cumsum(np.array([1., 2., 3., 4., 5.]))
+        array([ 1.,  3.,  3.,  7., 12.])
+    """
+
+    def __init__(self, is_start):
+        is_start = np.asarray(is_start, dtype=bool)
+        starts = np.flatnonzero(is_start)
+        self.segment = np.cumsum(is_start) - 1
+        self.position = np.arange(len(is_start)) - starts[self.segment]
+        self.shape = (len(starts), self.position.max() + 1)
+
+    def pad(self, values, fill=0.):
+        """ Return values as (segments x max. segment length) array, the
+        end of shorter segments filled with fill
+        """
+        padded = np.full(self.shape, fill)
+        padded[self.segment, self.position] = values
+        return padded
+
+    def unpad(self, padded):
+        """ Return rows of padded array (inverse of pad)
+        """
+        return padded[self.segment, self.position]
+
+    def rows_by_position(self):
+        """ Return list of row numbers at each position (the first rows
+        of all segments, the second rows, ...), for recursions that step
+        through all segments at once. Rows are ordered by segment length
+        (longest first).
+        """
+        starts = np.flatnonzero(self.position == 0)
+        lengths = np.diff(np.append(starts, len(self.position)))
+        order = np.argsort(-lengths, kind='mergesort')
+        starts, lengths = starts[order], lengths[order]
+        counts = np.searchsorted(-lengths, -np.arange(self.shape[1]))
+        return [starts[:count] + position
+                for position, count in enumerate(counts)]
+
+    def _accumulate(self, ufunc, values, identity):
+        values = np.asarray(values, dtype=float)
+        missing = np.isnan(values)
+        padded = self.pad(np.where(missing, identity, values), identity)
+        result = self.unpad(ufunc.accumulate(padded, axis=1))
+        result[missing] = np.nan
+        return result
+
+    def cumsum(self, values):
+        """ Return cumulative sum within segments
+        (like groupby().cumsum())
+        """
+        return self._accumulate(np.add, values, 0.)
+
+    def cumprod(self, values):
+        """ Return cumulative product within segments
+        (like groupby().cumprod())
+        """
+        return self._accumulate(np.multiply, values, 1.)
+
+    def shift(self, values, fill=np.nan):
+        """ Shift 1 position forward within segments, replacing first
+        element and missing values with fill
+        (like groupby().shift().fillna(fill))
+        """
+        values = np.asarray(values, dtype=float)
+        shifted = np.empty_like(values)
+        shifted[1:] = values[:-1]
+        shifted[self.position == 0] = fill
+        shifted[np.isnan(shifted)] = fill
+        return shifted
+
+    def diff(self, values):
+        """ Return difference with previous element within segments, NaN
+        for first element (like groupby().diff())
+        """
+        return np.asarray(values, dtype=float) - self.shift(values)
+
+
+class LookupArray:
+    """ Lookup table as dense numpy array with integer coded axes
+
+    Integer index levels (ages, years, simulation numbers, ...) are coded
+    as offset from their minimum, other levels (sex, claim, status) by
+    position in their sorted labels. A lookup is then plain fancy
+    indexing instead of a join on a MultiIndex.
+
+    Parameters
+    ----------
+    series : Series
+        single column lookup table, indexed by the lookup keys
+
+    Examples
+    --------
+        >>> tariff = LookupArray(data.lookup_tariff['tarief_primo'])
+        >>> tariff.lookup(tarief_id, aanspraak, geslacht, leeftijd)
+    """
+
+    def __init__(self, series):
+        self.name = series.name
+        index = series.index
+        if not isinstance(index, pd.MultiIndex):
+            index = pd.MultiIndex.from_arrays([index])
+        self.names = list(index.names)
+        self.axes = []
+        codes = []
+        for level in range(index.nlevels):
+            keys = index.get_level_values(level)
+            if pd.api.types.is_integer_dtype(keys):
+                labels = pd.RangeIndex(keys.min(), keys.max() + 1)
+            else:
+                labels = pd.Index(np.sort(keys.unique()))
+            self.axes.append(labels)
+            codes.append(labels.get_indexer(keys))
+        self.values = np.full([len(labels) for labels in self.axes], np.nan)
+        self.values[tuple(codes)] = series.values
+
+    @classmethod
+    def from_arrays(cls, values, axes, names, name=None):
+        """ Return LookupArray of given values (array with 1 axis per
+        index level) and axes (labels per level)
+        """
+        array = cls.__new__(cls)
+        array.name = name
+        array.names = list(names)
+        array.axes = list(axes)
+        array.values = values
+        return array
+
+    def codes(self, axis, keys):
+        """ Return (codes, found) of keys on given axis
+        """
+        labels = self.axes[axis]
+        keys = np.asarray(keys)
+        if isinstance(labels, pd.RangeIndex):
+            first = labels[0]  # (RangeIndex.start needs pandas >= 0.25)
+            if keys.dtype.kind == 'O':
+                keys = keys.astype(float)
+            if keys.dtype.kind == 'f':
+                found = keys == np.floor(keys)
+                keys = np.where(found, keys, first).astype(np.int64)
+            else:
+                found = np.ones(keys.shape, dtype=bool)
+            codes = keys - first
+            found &= (codes >= 0) & (codes < len(labels))
+        else:
+            codes = labels.get_indexer(keys.ravel()).reshape(keys.shape)
+            found = codes >= 0
+        return np.where(found, codes, 0), found
+
+    def lookup(self, *keys):
+        """ Return values at given keys (1 array or scalar per axis)
+
+        Keys are broadcast against each other, so e.g. keys shaped
+        (n, 1) and (1, m) give an (n, m) result. Keys not in the table
+        give NaN (like a left join).
+        """
+        codes, found = zip(*[self.codes(axis, key)
+                             for axis, key in enumerate(keys)])
+        values = self.values[codes]
+        found = np.broadcast_to(np.logical_and.reduce(
+          np.broadcast_arrays(*found)), values.shape)
+        if not found.all():
+            values = np.where(found, values, np.nan)
+        return values
+
+
 def get_tar_at_pensiondate(csv_file, long_format=False):
     """ DEPRECIATED - use predict_factors_at_pensionage
     from the CashFlows class
@@ -216,6 +587,36 @@ def get_tar_at_pensiondate(csv_file, long_format=False):
         return df.set_index(index)
 
 
+@lru_cache(maxsize=None)
+def _flat_discount_factors(intrest, nyears):
+    v = 1 / (1 + intrest/100.)**np.arange(nyears)
+    v.flags.writeable = False
+    return v
+
+
+def discount_factors(intrest, nyears):
+    """ Return discount factors of year numbers 0, 1, ..., nyears - 1
+
+    Parameters
+    ----------
+        intrest : fixed intrest rate, yield curve (Series or array) or
+                  2D-array with 1 yield curve per row (in %)
+        nyears  : int
+
+    Return
+    ------
+        v : numpy array, shaped (nyears,) or (ncurves, nyears), zero
+            beyond the end of a yield curve
+    """
+    if np.ndim(intrest) == 0:
+        return _flat_discount_factors(float(intrest), nyears)
+    intrest = np.asarray(intrest, dtype=float)
+    n = min(intrest.shape[-1], nyears)
+    v = np.zeros(intrest.shape[:-1] + (nyears,))
+    v[..., :n] = 1 / (1 + intrest[..., :n]/100.)**np.arange(n)
+    return v
+
+
 def present_value(cfs, intrest=2.5):
     """ Return present value of given series of cashflows at either
     fixed intrest rate or yield curve
@@ -229,19 +630,8 @@ def present_value(cfs, intrest=2.5):
     ------
         pv : float
     """
-
-    if isinstance(intrest, pd.Series):
-        intrest = intrest.values
-        n = min(len(intrest), len(cfs))
-        yearnr = np.arange(n)
-        v = 1 / (1 + intrest[:n]/100.)**yearnr
-
-    if isinstance(intrest, int):
-        n = len(cfs)
-        yearnr = np.arange(n)
-        v = 1 / (1 + intrest/100.)**yearnr
-
-    return sum(v * cfs[:n])
+    cfs = np.asarray(cfs, dtype=float)
+    return float(discount_factors(intrest, len(cfs)) @ cfs)
 
 
 def stack_lookup_table(df, colname='value'):
@@ -269,54 +659,118 @@ def modulo_map(x, n):
     return (x - 1)%n + 1
 
 
+class ScenarioIndex:
+    """ Scenario numbers of a lookup table for simulations 1 .. nsimuls
+
+    Simulation k uses scenario (k - 1) % n + 1 of a lookup table with n
+    scenarios, so scenarios are recycled if there are more simulations
+    than scenarios.
+
+    Parameters
+    ----------
+    nscenarios : int
+        number of scenarios (highest simulnr) in lookup table
+    nsimuls    : int
+        number of simulations
+
+    Examples
+    --------
+        >>> scenarios = ScenarioIndex.from_table(data.lookup_intrest, 5)
+        >>> scenarios[tab.simulnr.values]  # scenario number of each row
+    """
+
+    def __init__(self, nscenarios, nsimuls):
+        self.nscenarios = int(nscenarios)
+        self.nsimuls = nsimuls
+        self.scenarios = modulo_map(np.arange(1, nsimuls + 1),
+                                    self.nscenarios)
+
+    @classmethod
+    def from_table(cls, table, nsimuls):
+        """ Return ScenarioIndex of lookup table with simulnr index level
+        """
+        return cls(table.index.get_level_values('simulnr').max(), nsimuls)
+
+    def __getitem__(self, simulnr):
+        """ Return scenario number(s) of given simulation number(s)
+        """
+        return self.scenarios[np.asarray(simulnr) - 1]
+
+    def axis(self):
+        """ Return scenario numbers of simulations 1 .. nsimuls, or [1] if
+        the lookup table has only 1 scenario (to broadcast over all
+        simulations)
+        """
+        if self.nscenarios == 1:
+            return self.scenarios[:1]
+        return self.scenarios
+
+
 def calculate_portfolio_return(lifecycle, stocks, bonds):
     """ Return portfiolio return combining LC, stocks, bonds
 
+    The return of each start age x year x simulation is computed in 1
+    broadcast over the lifecycle equity share at the future age (start age
+    + year - 1) and the stocks / bonds scenario matrices (year x
+    simulation). Bond scenarios are recycled like in the Tableau if there
+    are more stock scenarios.
+
     Parameters
     ----------
-        lifecycle : lookup table indexed by leeftijd
+        lifecycle : lookup table indexed by leeftijd, or by
+                    (profile, leeftijd) for multiple lifecycle profiles
+                    at once
         stocks    : lookup table indexed by jaar
         bonds     : lookup table indexed by jaar
 
     Return
     ------
         lookup_table_return : lookup table indexed by leeftijd, jaar, simulnr
+                              (profile, leeftijd, jaar, simulnr)
 
     """
-    # construct new df
-    lifecycle['tmp'] = 1
-    stocks['tmp'] = 1
-
-    df = pd.merge(lifecycle.reset_index(),
-                  stocks.reset_index(), on='tmp')
-    lifecycle.drop('tmp', inplace=True, axis=1)
-    stocks.drop('tmp', inplace=True, axis=1)
-
-    df = df[['leeftijd', 'jaar', 'simulnr']]
-    max_age = lifecycle.reset_index().leeftijd.max()
-    df = df[df.leeftijd + df.jaar <= max_age + 1]
-
-    # join lifecycle & returns stocks & bonds into df
-    df['future_age'] = df.leeftijd + df.jaar - 1
-    df = df.join(lifecycle, on='future_age')
-
-    df['simulnr_cpy'] = df.simulnr
-    n = stocks.index.get_level_values('simulnr').max()
-    df['simulnr'] = df.simulnr_cpy.map(lambda x: modulo_map(x, n))
-    df = df.join(stocks, on=['jaar', 'simulnr'])
-
-    n = bonds.index.get_level_values('simulnr').max()
-    df['simulnr'] = df.simulnr_cpy.map(lambda x: modulo_map(x, n))
-    df = df.join(bonds, on=['jaar', 'simulnr'])
-    df['simulnr'] = df.simulnr_cpy
-    df.drop('simulnr_cpy', inplace=True, axis=1)
-
+    share = LookupArray(lifecycle['pct_aandelen'])
+    ages = np.asarray(share.axes[-1])
+    shares = share.values.reshape(-1, len(ages))  # profile x age
+    present = ~np.isnan(shares)
+    max_age = ages[len(ages) - 1 - np.argmax(present[:, ::-1], axis=1)]
+
+    stock = LookupArray(stocks['pct_rendement_aandelen'])
+    bond = LookupArray(bonds['pct_rendement_obligaties'])
+    years = np.asarray(stock.axes[0])
+    simulnr = np.asarray(stock.axes[1])
+    bond_scenarios = ScenarioIndex.from_table(bonds, simulnr.max())
+    returns_stocks = stock.lookup(years[:, None], simulnr[None, :])
+    returns_bonds = bond.lookup(years[:, None],
+                                bond_scenarios[simulnr][None, :])
+
+    # profile x start age x year x simulation rows, like the cross join of
+    # lifecycle and stocks with start age + year - 1 <= max. age
+    future_age = ages[:, None] + years[None, :] - 1
+    codes, found = share.codes(len(share.axes) - 1, future_age)
+    valid = (present[:, :, None] &
+             (future_age[None, :, :] <= max_age[:, None, None]))
+    profile, age, year, sim = np.nonzero(
+      valid[..., None] & ~np.isnan(returns_stocks)[None, None, :, :])
+
+    pct_aandelen = np.where(found[age, year],
+                            shares[profile, codes[age, year]], np.nan)
+    df = pd.DataFrame({
+      'pct_aandelen': pct_aandelen,
+      'pct_rendement_aandelen': returns_stocks[year, sim],
+      'pct_rendement_obligaties': returns_bonds[year, sim]})
     df['pct_rendement_ultimo'] = (
         df.pct_aandelen * df.pct_rendement_aandelen +
         (1 - df.pct_aandelen) * df.pct_rendement_obligaties
         )
-    df.drop('future_age', inplace=True, axis=1)
-    return df.set_index(['leeftijd', 'jaar', 'simulnr'])
+    profiles = (np.unravel_index(profile, share.values.shape[:-1])
+                if share.values.ndim > 1 else [])
+    # codes passed by position: the keyword is labels before pandas 0.24
+    df.index = pd.MultiIndex(
+      share.axes[:-1] + [ages, years, simulnr],
+      list(profiles) + [age, year, sim],
+      names=share.names[:-1] + ['leeftijd', 'jaar', 'simulnr'])
+    return df
 
 
 def max_percentage_difference(df, test_cols, calculated_cols):
@@ -1,29 +1,60 @@
 """ Vectorized functions:
 for better perfomance  & cleaner code
+
+Date arguments may be datetime.date objects, Series / arrays of them or
+datetime64 arrays. The scalar versions in formulae.py are the reference
+implementation.
 """
 import numpy as np
-import formulae as f
+
+
+def to_datetime64(dates):
+    """ Return dates as numpy datetime64[D] array
+    """
+    return np.asarray(dates, dtype='datetime64[D]')
+
+
+def year_month(dates):
+    """ Return (year, month) integer arrays of given dates
+    """
+    months = to_datetime64(dates).astype('datetime64[M]').astype(np.int64)
+    return 1970 + months // 12, months % 12 + 1
 
 
 def pensiondate(birthdate, pension_age):
     """ Vectorized version of formulae.pensiondate
+
+    Returns
+    -------
+    pension_date : datetime64[D] array
     """
-    v = np.frompyfunc(f.pensiondate, 2, 1)
-    return v(birthdate, pension_age)
+    birth_month = to_datetime64(birthdate).astype('datetime64[M]')
+    pension_month = (birth_month +
+                     12 * np.asarray(pension_age, dtype=np.int64))
+    return pension_month.astype('datetime64[D]')
 
 
 def future_service_years(calculation_date, pension_date):
     """ Vectorized version of formulae.future_service_years
+
+    Returns
+    -------
+    future_service_years : float64 array
     """
-    vectorized = np.frompyfunc(f.future_service_years, 2, 1)
-    return vectorized(calculation_date, pension_date)
+    calculation_year, calculation_month = year_month(calculation_date)
+    pension_year, pension_month = year_month(pension_date)
+    return (pension_year - calculation_year +
+            (pension_month - calculation_month) / 12.)
 
 
 def roundup(arr):
     """ Vectorized version of formulae.roundup
+
+    Returns
+    -------
+    rounded : int64 array
     """
-    vectorized = np.frompyfunc(f.roundup, 1, 1)
-    return vectorized(arr)
+    return np.ceil(np.asarray(arr, dtype=float)).astype(np.int64)
 
 
 def nprojection_years(birthdate, calculation_date, pension_age):
@@ -43,9 +74,19 @@ def age(pension_age, future_service_years):
 def past_service_years(service_date, calculation_date,
                        method='Oxylo'):
     """ Vectorized version of formulae.past_service_years
+
+    Returns
+    -------
+    past_service_years : float64 array
     """
-    vectorized = np.frompyfunc(f.past_service_years, 3, 1)
-    return vectorized(service_date, calculation_date, method)
+    if method == 'Oxylo':
+        service_year, service_month = year_month(service_date)
+        calculation_year, calculation_month = year_month(calculation_date)
+        return (calculation_year - service_year +
+                calculation_month - service_month) / 12.
+    if method == 'PwC':
+        delta = to_datetime64(calculation_date) - to_datetime64(service_date)
+        return delta.astype(np.int64) / 365.25
 
 
 def total_service_years(past_service_years, future_service_years):
@@ -122,3 +163,74 @@ def eur_return(cumulated_capital, eur_employee_contribution,
     rate = pct_yield_ultimo / (1 + pct_yield_ultimo)
     return rate * cumulated
 
+
+def accumulate_capital(premium, rendement, nqx, timing_investments=1,
+                       segments=None):
+    """ Return DC capital at the end of each projection year
+
+    By the year recursion
+
+        capital_t = (capital_t-1 * (1 + r_t) +
+                     premium_t * (1 + timing_investments * r_t)) / (1 - q_t)
+
+    which equals rendement_idx / nqx_idx * cumsum(premium *
+    cf_timing_factor * nqx_idx_shifted / rendement_idx_shifted), without
+    the cumulative indices (that under- or overflow over long horizons).
+    Each year is computed in place in the result, from the year before.
+
+    A missing value (NaN) makes the capital of that year and all later
+    years of the claim NaN. (The cumulative indices of Segments skip
+    missing values instead, which drops the premium of that year.)
+
+    Parameters
+    ----------
+    premium            : premium (eur_premie_dc)
+    rendement          : return (pct_rendement_ultimo)
+    nqx                : mortality (nqx_primo)
+    timing_investments : part of the premium invested at the start of the
+        year (1 - timing_belegging)
+    segments           : utils.Segments of the rows, or None
+
+    All arrays have projection year as last axis and broadcast to
+    e.g. (claims, sims, years). With segments, they are rows of the
+    tableau instead (1 segment of consecutive years per employee x claim x
+    simulation), and each year is a step through all segments.
+    """
+    if segments is not None:
+        return _accumulate_capital_rows(premium, rendement, nqx,
+                                        timing_investments, segments)
+    shape = np.broadcast(premium, rendement, nqx).shape
+    # year-major, so each year is a contiguous block
+    capital = np.empty(shape[-1:] + shape[:-1])
+    growth = np.empty(shape[:-1])
+    previous = np.zeros(shape[:-1])
+    for year in range(shape[-1]):
+        r, current = rendement[..., year], capital[year, ...]
+        np.multiply(r, timing_investments, out=current)
+        current += 1
+        current *= premium[..., year]
+        np.add(r, 1, out=growth)
+        growth *= previous
+        current += growth
+        current /= 1 - nqx[..., year]
+        previous = current
+    return np.moveaxis(capital, 0, -1)
+
+
+def _accumulate_capital_rows(premium, rendement, nqx, timing_investments,
+                             segments):
+    """ accumulate_capital of tableau rows, by position in the segments
+    """
+    premium, rendement, nqx = (np.asarray(values, dtype=float)
+                               for values in (premium, rendement, nqx))
+    capital = np.empty(len(premium))
+    for position, rows in enumerate(segments.rows_by_position()):
+        r = rendement[rows]
+        current = r * timing_investments
+        current += 1
+        current *= premium[rows]
+        if position:
+            current += capital[rows - 1] * (1 + r)
+        current /= 1 - nqx[rows]
+        capital[rows] = current
+    return capital